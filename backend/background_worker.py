@@ -1,27 +1,133 @@
 import asyncio
+import heapq
 import logging
-from datetime import datetime, timezone
+import os
+import socket
+import uuid
+import zlib
+from collections import deque
+from datetime import datetime, timedelta, timezone
 import pytz
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
+from clock import SYSTEM_CLOCK, Clock
 from gateway import gateway
+from image_store import ImageStore, sniff_content_type
+from resilience import RateLimiter, CircuitBreaker, backoff_delay, is_transient
+from metrics import SEND_LAG, SEND_STAGE, SENDS, WORKER_LOOP
+from status_writer import StatusWriter
+from events import gateway_error
+from campaigns import FAILED, PENDING, SENT, final_status, pending_indexes, render_message
+import recurrences
 
 logger = logging.getLogger(__name__)
 
+def as_utc(dt: datetime) -> datetime:
+    """Mongo hands back naive UTC datetimes - make them comparable with aware ones"""
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc)
+
+def claimable_filter(now: datetime, lease_seconds: float) -> dict:
+    """Schedules a worker may claim: due ones, plus sends whose lease has run out"""
+    return {"$or": [
+        # next_attempt_at holds a transient failure back until its backoff has passed
+        {"status": "scheduled", "send_at": {"$lte": now}, "next_attempt_at": {"$not": {"$gt": now}}},
+        {"status": "sending", "lease_expires_at": {"$lt": now}},
+        # Rows left in "sending" by versions that did not stamp a lease
+        {
+            "status": "sending",
+            "lease_expires_at": {"$exists": False},
+            "updated_at": {"$lt": now - timedelta(seconds=lease_seconds)}
+        },
+    ]}
+
 class BackgroundWorker:
-    def __init__(self, db: AsyncIOMotorDatabase):
+    def __init__(self, db: AsyncIOMotorDatabase, clock: Clock = SYSTEM_CLOCK, gateway_client=None):
         self.db = db
+        # Injectable for simulations (bench/simulate.py); production uses the defaults
+        self.clock = clock
+        self.gateway = gateway_client or gateway
+        self.images = ImageStore(db)
         self.running = False
         self.task = None
+
+        # Claims are leases: a crashed worker's sends become claimable again
+        # once lease_expires_at passes; live workers heartbeat to extend them.
+        self.worker_id = os.environ.get('WORKER_ID') or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.lease_seconds = float(os.environ.get('WORKER_LEASE_SECONDS', '120'))
+
+        # The deadline heap drives on-time sends; the DB poll is only a safety net
+        # for schedules written behind our back (other processes, manual edits).
+        self.poll_interval = float(os.environ.get('WORKER_POLL_INTERVAL', '300'))
+        self.batch_size = 100
+
+        # Min-heap of (send_at, schedule_id). Entries are invalidated lazily:
+        # an entry is live only while _pending still maps the id to that send_at.
+        self._deadlines = []
+        self._pending = {}
+        self._wakeup = asyncio.Event()
+        self._reload = False
+
+        # Gateway protection: rate limits, automatic retries for transient
+        # errors, and a breaker that pauses dispatch while the gateway is down
+        self.limiter = RateLimiter(clock)
+        self.breaker = CircuitBreaker(clock)
+        self.max_attempts = int(os.environ.get('SEND_MAX_ATTEMPTS', '5'))
+        self.retry_base = float(os.environ.get('RETRY_BASE_SECONDS', '5'))
+        self.retry_cap = float(os.environ.get('RETRY_MAX_SECONDS', '600'))
+
+        # Recent send lag samples in seconds (actual send time - send_at)
+        self.send_lag = deque(maxlen=1000)
+
+        # Dispatch pipeline: one bounded queue per sender. Schedules are sharded
+        # by recipient so each phone's messages go out in FIFO order, and a full
+        # queue blocks enqueue() - that is the backpressure on poller and API.
+        self.concurrency = max(1, int(os.environ.get('DISPATCH_CONCURRENCY', '4')))
+        queue_size = int(os.environ.get('DISPATCH_QUEUE_SIZE', '1000'))
+        self.drain_timeout = float(os.environ.get('DISPATCH_DRAIN_TIMEOUT', '30'))
+        self._queues = [
+            asyncio.Queue(maxsize=max(1, queue_size // self.concurrency))
+            for _ in range(self.concurrency)
+        ]
+        self._queued = set()  # ids queued or in flight, so nothing is dispatched twice
+        self._senders = []
+
+        # Broadcast campaigns run as their own tasks, each fanning out over its
+        # recipients in a few lanes through the same limiter and breaker
+        self.campaign_concurrency = max(1, int(os.environ.get('CAMPAIGN_CONCURRENCY', '4')))
+        self.max_active_campaigns = max(1, int(os.environ.get('CAMPAIGN_MAX_ACTIVE', '2')))
+        self.campaign_flush_size = 50
+        self.campaign_flush_seconds = 2.0
+        self._campaigns = {}  # campaign id -> runner task
+        self._campaign_backlog = False
+
+        # Recurring series: each occurrence becomes a Schedule this long before it is due
+        self.recurrence_lead = float(os.environ.get('RECURRENCE_LEAD_SECONDS', '300'))
+        self.max_materialize = 100
+
+        # Called synchronously on every status change this worker makes
+        self._listeners = []
+
+        # Final sent/failed writes from all senders go out as periodic bulk writes
+        self.status_writer = StatusWriter(db.schedules, clock=clock)
+        # Heartbeats of sends whose final write is still buffered
+        self._lease_holders = set()
         
     async def start(self):
         """Start the background worker"""
         if not self.running:
             self.running = True
+            self.status_writer.start()
+            self._senders = [
+                asyncio.create_task(self._sender_loop(queue)) for queue in self._queues
+            ]
             self.task = asyncio.create_task(self._worker_loop())
-            logger.info("Background worker started")
+            logger.info(f"Background worker started with {self.concurrency} senders")
     
     async def stop(self):
-        """Stop the background worker"""
+        """Stop the background worker, letting in-flight sends finish"""
         self.running = False
         if self.task:
             self.task.cancel()
@@ -29,125 +135,709 @@ class BackgroundWorker:
                 await self.task
             except asyncio.CancelledError:
                 pass
+
+        # Queued-but-unstarted schedules stay "scheduled" in Mongo and are
+        # picked up again on the next start; only in-flight sends are drained.
+        for queue in self._queues:
+            while not queue.empty():
+                schedule = queue.get_nowait()
+                self._queued.discard(schedule["id"])
+                queue.task_done()
+            queue.put_nowait(None)
+
+        if self._senders:
+            done, pending = await asyncio.wait(self._senders, timeout=self.drain_timeout)
+            if pending:
+                logger.warning(f"{len(pending)} sends still in flight after {self.drain_timeout}s, cancelling")
+                for sender in pending:
+                    sender.cancel()
+                await asyncio.gather(*pending, return_exceptions=True)
+            self._senders = []
+
+        # Campaign lanes stop after their current recipient and hand the rest back
+        if self._campaigns:
+            runners = list(self._campaigns.values())
+            done, pending = await asyncio.wait(runners, timeout=self.drain_timeout)
+            for runner in pending:
+                runner.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        await self.status_writer.close()
+        # close() settled every buffered write, so these finish on their own
+        if self._lease_holders:
+            await asyncio.gather(*self._lease_holders, return_exceptions=True)
         logger.info("Background worker stopped")
     
+    async def enqueue(self, schedule: dict) -> bool:
+        """Hand a due schedule to the dispatch queue; waits while the queue is full"""
+        schedule_id = schedule["id"]
+        if not self.running or schedule_id in self._queued:
+            return False
+
+        self._queued.add(schedule_id)
+        self._pending.pop(schedule_id, None)
+        shard = zlib.crc32(schedule["phone"].encode()) % self.concurrency
+        try:
+            await self._queues[shard].put(schedule)
+        except BaseException:
+            self._queued.discard(schedule_id)
+            raise
+        return True
+
+    def queue_depth(self) -> int:
+        """Schedules waiting in (or being sent from) the dispatch queues"""
+        return len(self._queued)
+
+    def notify(self, schedule_id: str, send_at: datetime):
+        """Tell the worker a schedule is due at send_at (new or moved deadline)"""
+        if not self.running:
+            return
+        send_at = as_utc(send_at)
+        self._pending[schedule_id] = send_at
+        heapq.heappush(self._deadlines, (send_at, schedule_id))
+        self._wakeup.set()
+
+    def reload(self):
+        """Rebuild deadlines from Mongo on the next loop turn (after bulk imports)"""
+        if not self.running:
+            return
+        self._reload = True
+        self._wakeup.set()
+
+    def add_listener(self, listener):
+        """Register listener(event) for status changes, e.g. {"type": "schedule", "id", "status", "previous"}.
+
+        Final sends also carry "sent_at", and failures and retries an "error".
+        """
+        self._listeners.append(listener)
+
+    def _emit(self, schedule_id: str, status: str, previous: str, **fields):
+        event = {"type": "schedule", "id": schedule_id, "status": status, "previous": previous, **fields}
+        for listener in self._listeners:
+            try:
+                listener(event)
+            except Exception as e:
+                logger.warning(f"Worker listener failed: {e}")
+
+    def forget(self, schedule_id: str):
+        """Drop a schedule from the timeline (deleted or no longer scheduled)"""
+        if self._pending.pop(schedule_id, None) is not None:
+            self._wakeup.set()
+
+    def lag_stats(self) -> dict:
+        """Summary of recent send lag in milliseconds"""
+        samples = sorted(self.send_lag)
+        if not samples:
+            return {"count": 0}
+
+        def pct(p):
+            return round(samples[min(len(samples) - 1, int(p * len(samples)))] * 1000, 1)
+
+        return {
+            "count": len(samples),
+            "p50_ms": pct(0.50),
+            "p95_ms": pct(0.95),
+            "p99_ms": pct(0.99),
+            "max_ms": round(samples[-1] * 1000, 1),
+        }
+
     async def _worker_loop(self):
-        """Main worker loop that checks and sends scheduled messages"""
+        """Main worker loop: sleep until the next deadline, a wakeup, or the safety poll"""
         logger.info("Background worker loop started")
+        loop = asyncio.get_running_loop()
+        next_poll = self.clock.monotonic()
+        more_due = False
         
         while self.running:
+            iteration_started = loop.time()
             try:
-                await self._check_and_send_messages()
+                poll_due = self.clock.monotonic() >= next_poll or self._reload
+                self._reload = False
+                if poll_due:
+                    await self._load_deadlines()
+                    next_poll = self.clock.monotonic() + self.poll_interval
+
+                # Only touch Mongo when the safety poll fires or a deadline has passed
+                if self._pop_due(self.clock.now()) or poll_due or more_due:
+                    await self._check_recurrences()
+                    more_due = await self._check_and_send_messages() >= self.batch_size
+                    await self._check_campaigns()
+                elif self._campaign_backlog and len(self._campaigns) < self.max_active_campaigns:
+                    await self._check_campaigns()
             except Exception as e:
                 logger.error(f"Error in worker loop: {e}", exc_info=True)
-            
-            # Wait 30 seconds before next check
-            await asyncio.sleep(30)
-    
-    async def _check_and_send_messages(self):
-        """Check for due messages and send them"""
+            WORKER_LOOP.observe(loop.time() - iteration_started)
+
+            self._wakeup.clear()
+            timeout = 0 if more_due else next_poll - self.clock.monotonic()
+            if self._deadlines:
+                until_deadline = (self._deadlines[0][0] - self.clock.now()).total_seconds()
+                timeout = min(timeout, until_deadline)
+
+            try:
+                await self.clock.wait_for(self._wakeup.wait(), max(timeout, 0))
+            except asyncio.TimeoutError:
+                pass
+
+    def _pop_due(self, now: datetime) -> bool:
+        """Pop every deadline <= now; True if at least one live entry was due"""
+        due = False
+        while self._deadlines and self._deadlines[0][0] <= now:
+            send_at, schedule_id = heapq.heappop(self._deadlines)
+            if self._pending.get(schedule_id) == send_at:
+                del self._pending[schedule_id]
+                due = True
+        return due
+
+    async def _load_deadlines(self):
+        """Rebuild the heap from Mongo for everything due before the next safety poll"""
+        horizon = self.clock.now() + timedelta(seconds=self.poll_interval)
+        cursor = self.db.schedules.find(
+            {"status": "scheduled", "send_at": {"$lte": horizon}},
+            {"_id": 0, "id": 1, "send_at": 1, "next_attempt_at": 1}
+        ).sort("send_at", 1)
+
+        pending = {}
+        async for schedule in cursor:
+            # A retry is due after its backoff, which always ends after send_at
+            pending[schedule["id"]] = as_utc(schedule.get("next_attempt_at") or schedule["send_at"])
+        campaigns = self.db.campaigns.find(
+            {"status": "scheduled", "send_at": {"$lte": horizon}},
+            {"_id": 0, "id": 1, "send_at": 1}
+        )
+        async for campaign in campaigns:
+            pending[campaign["id"]] = as_utc(campaign["send_at"])
+        # A series is due when its next occurrence should be materialized
+        lead = timedelta(seconds=self.recurrence_lead)
+        series = self.db.recurrences.find(
+            {"status": recurrences.ACTIVE, "next_at": {"$lte": horizon + lead}},
+            {"_id": 0, "id": 1, "next_at": 1}
+        )
+        async for recurrence in series:
+            pending[recurrence["id"]] = as_utc(recurrence["next_at"]) - lead
+
+        # Keep deadlines announced via notify() that fall past the horizon
+        for schedule_id, send_at in self._pending.items():
+            pending.setdefault(schedule_id, send_at)
+
+        self._pending = pending
+        self._deadlines = [(send_at, schedule_id) for schedule_id, send_at in pending.items()]
+        heapq.heapify(self._deadlines)
+
+    async def _check_and_send_messages(self) -> int:
+        """Check for due messages and send them; returns how many were found"""
         try:
             # Get current time in GMT+7
             tz = pytz.timezone('Asia/Jakarta')
-            now_utc = datetime.now(timezone.utc)
+            now_utc = self.clock.now()
             now_gmt7 = now_utc.astimezone(tz)
             
-            # Find all scheduled messages that are due
+            # Find all due messages (and expired leases) not already queued here
             # Compare with UTC time stored in database
-            cursor = self.db.schedules.find({
-                "status": "scheduled",
-                "send_at": {"$lte": now_utc}
-            })
-            
-            schedules = await cursor.to_list(length=100)
+            query = claimable_filter(now_utc, self.lease_seconds)
+            query["id"] = {"$nin": list(self._queued)}
+            cursor = self.db.schedules.find(query).sort("send_at", 1)
+
+            schedules = await cursor.to_list(length=self.batch_size)
             
             if schedules:
                 logger.info(f"Found {len(schedules)} messages to send at {now_gmt7}")
             
             for schedule in schedules:
-                await self._send_schedule(schedule)
-                
+                await self.enqueue(schedule)
+
+            return len(schedules)
         except Exception as e:
             logger.error(f"Error checking messages: {e}", exc_info=True)
+            return 0
+
+    async def _sender_loop(self, queue: asyncio.Queue):
+        """Send schedules from one queue, one at a time, until a None sentinel arrives"""
+        while True:
+            schedule = await queue.get()
+            try:
+                if schedule is None:
+                    return
+                # Hold the schedule (still "scheduled" in Mongo) while the gateway is down
+                await self.breaker.ready()
+                await self._send_schedule(schedule)
+            except Exception as e:
+                logger.error(f"Sender error: {e}", exc_info=True)
+            finally:
+                if schedule is not None:
+                    self._queued.discard(schedule["id"])
+                queue.task_done()
+
+    async def _claim(self, schedule_id: str, collection=None):
+        """Atomically take a schedule (or campaign) for sending; None if another worker has it.
+
+        Returns the claimed document, with the status it was claimed from
+        ("scheduled", or "sending" for a reclaimed lease) in "claimed_from".
+        """
+        if collection is None:
+            collection = self.db.schedules
+        now = self.clock.now()
+        query = claimable_filter(now, self.lease_seconds)
+        query["id"] = schedule_id
+        claim = {
+            "status": "sending",
+            "worker_id": self.worker_id,
+            "lease_expires_at": now + timedelta(seconds=self.lease_seconds),
+            "updated_at": now
+        }
+        # The document as it was, so we know what we claimed it from
+        doc = await collection.find_one_and_update(
+            query,
+            {"$set": claim, "$inc": {"attempts": 1}},
+            return_document=ReturnDocument.BEFORE
+        )
+        if doc is None:
+            return None
+        doc["claimed_from"] = doc.get("status")
+        doc.update(claim)
+        doc["attempts"] = doc.get("attempts", 0) + 1
+        return doc
+
+    def _owned(self, schedule: dict) -> dict:
+        """Matches the row only while it is still under this claim of ours.
+
+        attempts goes up on every claim, so a write from a claim that expired
+        and was taken over (even by this same worker) matches nothing.
+        """
+        return {"id": schedule["id"], "worker_id": self.worker_id, "status": "sending",
+                "attempts": schedule["attempts"]}
+
+    async def _heartbeat(self, owned: dict, collection=None):
+        """Keep extending our lease while a long send is in progress"""
+        if collection is None:
+            collection = self.db.schedules
+        while True:
+            await self.clock.sleep(self.lease_seconds / 3)
+            try:
+                await collection.update_one(
+                    owned,
+                    {"$set": {"lease_expires_at": self.clock.now() + timedelta(seconds=self.lease_seconds)}}
+                )
+            except Exception as e:
+                # Try again next beat; the lease still has two thirds to run
+                logger.warning(f"Lease heartbeat for {owned['id']} failed: {e}")
+
+    async def _stop_heartbeat(self, heartbeat: asyncio.Task):
+        heartbeat.cancel()
+        await asyncio.gather(heartbeat, return_exceptions=True)
+
+    async def _hold_lease(self, heartbeat: asyncio.Task, settled: asyncio.Future):
+        """Keep heartbeating until a buffered final write has landed (or been dropped)"""
+        try:
+            await settled
+        finally:
+            await self._stop_heartbeat(heartbeat)
     
     async def _send_schedule(self, schedule: dict):
         """Send a single scheduled message - completely stateless, no filesystem access"""
         schedule_id = schedule["id"]
+        self._pending.pop(schedule_id, None)
+
+        # Claim first so two replicas never send the same schedule; the claimed
+        # document is also the freshest copy of the content.
+        with SEND_STAGE.time("claim"):
+            schedule = await self._claim(schedule_id)
+        if schedule is None:
+            SENDS.inc("skipped")
+            logger.info(f"Schedule {schedule_id} already claimed or no longer due, skipping")
+            return
+        self._emit(schedule_id, "sending", schedule["claimed_from"])
+
+        # Final writes only land while we still own the lease
+        owned = self._owned(schedule)
+        heartbeat = asyncio.create_task(self._heartbeat(owned))
+        # The final write's future; the lease is held until it settles
+        settled = None
         
         try:
-            # Update status to sending
-            await self.db.schedules.update_one(
-                {"id": schedule_id},
-                {
-                    "$set": {
-                        "status": "sending",
-                        "updated_at": datetime.now(timezone.utc)
-                    }
-                }
-            )
-            
             # Send the message
             phone = schedule["phone"]
+            with SEND_STAGE.time("rate_limit"):
+                await self.limiter.acquire(phone)
             message = schedule.get("message_md", "")
-            image_base64 = schedule.get("image_base64")
-            
-            if image_base64:
-                # Decode base64 to bytes in memory (NO filesystem)
-                import base64
-                
-                image_filename = schedule.get("image_filename", f"{schedule_id}.jpg")
-                
-                # Decode directly to bytes
-                image_bytes = base64.b64decode(image_base64)
-                
-                logger.info(f"Decoded image in memory ({len(image_bytes)} bytes) for {phone}")
-                
-                # Send with image - passes bytes directly, no temp files
-                result = await gateway.send_image_message(
-                    phone=phone,
-                    image_bytes=image_bytes,
-                    filename=image_filename,
-                    caption=message
-                )
-            else:
-                # Send text only
-                result = await gateway.send_text_message(
-                    phone=phone,
-                    message=message
-                )
+            image_bytes = None
+
+            with SEND_STAGE.time("image"):
+                if schedule.get("image_id"):
+                    # Raw bytes straight from the image store - no decode step
+                    image_bytes = await self.images.get(schedule["image_id"])
+                    if image_bytes is None:
+                        raise RuntimeError(f"Image {schedule['image_id']} not found")
+                elif schedule.get("image_base64"):
+                    # Legacy row not yet migrated (see migrate_images.py)
+                    import base64
+                    image_bytes = base64.b64decode(schedule["image_base64"])
+
+            if image_bytes is not None:
+                logger.info(f"Loaded image in memory ({len(image_bytes)} bytes) for {phone}")
+
+            result = await self._deliver(
+                phone, message, image_bytes,
+                schedule.get("image_filename") or f"{schedule_id}.jpg"
+            )
+
+            sent_at = self.clock.now()
+            lag = (sent_at - as_utc(schedule["send_at"])).total_seconds()
+
+            # Transient errors go back on the timeline with backoff instead of failing
+            attempts = schedule.get("attempts", 1)
+            if is_transient(result) and attempts < self.max_attempts:
+                SENDS.inc("retry")
+                with SEND_STAGE.time("write"):
+                    await self._schedule_retry(schedule, attempts, result)
+                return
             
             # Determine final status
             if result.get("code") == "SUCCESS":
                 status = "sent"
-                logger.info(f"Successfully sent message {schedule_id} to {phone}")
+                self.limiter.on_success()
+                self.send_lag.append(lag)
+                SEND_LAG.observe(lag)
+                logger.info(f"Successfully sent message {schedule_id} to {phone} (lag {lag * 1000:.0f} ms)")
             else:
                 status = "failed"
-                logger.warning(f"Failed to send message {schedule_id}: {result}")
-            
-            # Update final status
-            await self.db.schedules.update_one(
-                {"id": schedule_id},
-                {
-                    "$set": {
-                        "status": status,
-                        "sent_at": datetime.now(timezone.utc),
-                        "gateway_response": result,
-                        "updated_at": datetime.now(timezone.utc)
-                    }
-                }
-            )
+                logger.warning(f"Failed to send message {schedule_id} after {attempts} attempt(s): {result}")
+
+            # Update final status (buffered; listeners hear about it once it is flushed)
+            SENDS.inc(status)
+            final = {
+                "status": status,
+                "sent_at": sent_at,
+                # Delivery receipts find the row by this id
+                "gateway_message_id": (result.get("results") or {}).get("message_id"),
+                "updated_at": sent_at
+            }
+            with SEND_STAGE.time("write"):
+                settled = await self.status_writer.write(
+                    owned,
+                    {
+                        "$set": {**final, "send_lag_ms": round(lag * 1000), "gateway_response": result},
+                        "$unset": {"lease_expires_at": "", "next_attempt_at": ""}
+                    },
+                    lambda: self._emit(schedule_id, status, "sending", sent_at=sent_at,
+                                       error=None if status == "sent" else gateway_error(result)),
+                    # Should the gateway's answer be unwritable, the status alone still stops a resend
+                    fallback={"$set": final, "$unset": {"lease_expires_at": "", "next_attempt_at": ""}}
+                )
             
         except Exception as e:
             logger.error(f"Error sending schedule {schedule_id}: {e}", exc_info=True)
+            SENDS.inc("error")
+            # The callback runs after the flush, once e is out of scope
+            error = str(e)
             
             # Mark as failed
-            await self.db.schedules.update_one(
-                {"id": schedule_id},
+            failed_at = self.clock.now()
+            settled = await self.status_writer.write(
+                owned,
                 {
                     "$set": {
                         "status": "failed",
-                        "gateway_response": {"error": str(e)},
-                        "updated_at": datetime.now(timezone.utc)
-                    }
-                }
+                        "gateway_response": {"error": error},
+                        "updated_at": failed_at
+                    },
+                    "$unset": {"lease_expires_at": "", "next_attempt_at": ""}
+                },
+                lambda: self._emit(schedule_id, "failed", "sending", error=error),
+                fallback={"$set": {"status": "failed", "updated_at": failed_at},
+                          "$unset": {"lease_expires_at": "", "next_attempt_at": ""}}
             )
+        finally:
+            if settled is None or settled.done():
+                await self._stop_heartbeat(heartbeat)
+            else:
+                holder = asyncio.create_task(self._hold_lease(heartbeat, settled))
+                self._lease_holders.add(holder)
+                holder.add_done_callback(self._lease_holders.discard)
+
+    async def _deliver(self, phone: str, message: str, image_bytes=None, image_filename=None,
+                       content_type=None) -> dict:
+        """One gateway call, feeding the outcome back into the limiter and breaker"""
+        # Taken here, right around the call, so a half-open probe always reports back
+        await self.breaker.before_call()
+        try:
+            with SEND_STAGE.time("gateway"):
+                if image_bytes is not None:
+                    # Send with image - passes bytes directly, no temp files
+                    result = await self.gateway.send_image_message(
+                        phone=phone,
+                        image_bytes=image_bytes,
+                        filename=image_filename,
+                        caption=message,
+                        content_type=content_type or sniff_content_type(image_bytes)
+                    )
+                else:
+                    # Send text only
+                    result = await self.gateway.send_text_message(
+                        phone=phone,
+                        message=message
+                    )
+        except BaseException:
+            self.breaker.release()
+            raise
+
+        if result.get("status_code") == 429:
+            self.limiter.on_throttled()
+        if is_transient(result):
+            self.breaker.record_failure()
+        else:
+            # Any real answer (even a rejection) means the gateway is up
+            self.breaker.record_success()
+        return result
+
+    async def _schedule_retry(self, schedule: dict, attempts: int, result: dict):
+        """Release the claim and re-queue a transient failure after exponential backoff.
+
+        The backoff goes to next_attempt_at; send_at keeps the requested time,
+        so send lag is still measured from it.
+        """
+        schedule_id = schedule["id"]
+        delay = backoff_delay(attempts, self.retry_base, self.retry_cap)
+        now = self.clock.now()
+        retry_at = now + timedelta(seconds=delay)
+
+        await self.db.schedules.update_one(
+            self._owned(schedule),
+            {
+                "$set": {
+                    "status": "scheduled",
+                    "next_attempt_at": retry_at,
+                    "gateway_response": result,
+                    "updated_at": now
+                },
+                "$unset": {"lease_expires_at": ""}
+            }
+        )
+        self._emit(schedule_id, "scheduled", "sending", error=gateway_error(result))
+        self.notify(schedule_id, retry_at)
+        logger.warning(f"Transient failure for {schedule_id} (attempt {attempts}/{self.max_attempts}), retrying in {delay:.1f}s: {result.get('message')}")
+
+    async def _check_recurrences(self):
+        """Materialize occurrences of every series due within the lead window"""
+        now = self.clock.now()
+        until = now + timedelta(seconds=self.recurrence_lead)
+        cursor = self.db.recurrences.find({"status": recurrences.ACTIVE, "next_at": {"$lte": until}})
+        for series in await cursor.to_list(length=self.batch_size):
+            try:
+                await self._materialize(series, until, now)
+            except Exception as e:
+                logger.error(f"Could not materialize recurrence {series['id']}: {e}", exc_info=True)
+
+    async def _materialize(self, series: dict, until: datetime, now: datetime):
+        """Insert Schedules for the series' occurrences up to until and advance its next_at"""
+        series_id = series["id"]
+        next_at = as_utc(series["next_at"])
+        occurrences = recurrences.occurrences_between(series, next_at, until, self.max_materialize)
+        docs = [recurrences.occurrence_doc(series, occurrence, now) for occurrence in occurrences]
+
+        failed = set()
+        if docs:
+            try:
+                await self.db.schedules.insert_many(docs, ordered=False)
+            except BulkWriteError as e:
+                # Duplicates mean another worker got there first; that is fine
+                for error in e.details.get("writeErrors", []):
+                    failed.add(error["index"])
+                    if error.get("code") != 11000:
+                        logger.error(f"Occurrence insert failed for recurrence {series_id}: {error.get('errmsg')}")
+        inserted = [doc for i, doc in enumerate(docs) if i not in failed]
+
+        following = recurrences.next_occurrence(series, occurrences[-1] if occurrences else next_at, inc=not occurrences)
+        # Advance only if the series was not edited (or advanced elsewhere) meanwhile
+        result = await self.db.recurrences.update_one(
+            {"id": series_id, "revision": series.get("revision", 0), "next_at": series["next_at"]},
+            {"$set": {
+                "next_at": following,
+                "status": recurrences.ACTIVE if following else recurrences.ENDED,
+                "updated_at": now
+            }}
+        )
+        if result.modified_count == 0:
+            # Edited mid-flight: drop what we wrote from the old revision; the next pass redoes it
+            if inserted:
+                await self.db.schedules.delete_many({"id": {"$in": [doc["id"] for doc in inserted]}, "status": "scheduled"})
+            self.reload()
+            return
+
+        for doc in inserted:
+            self._emit(doc["id"], "scheduled", None)
+            self.notify(doc["id"], doc["send_at"])
+        if following:
+            self.notify(series_id, following - timedelta(seconds=self.recurrence_lead))
+        if inserted:
+            logger.info(f"Materialized {len(inserted)} occurrence(s) of recurrence {series_id}, next at {following}")
+
+    async def _check_campaigns(self):
+        """Start a runner for each claimable campaign, up to max_active_campaigns"""
+        free = self.max_active_campaigns - len(self._campaigns)
+        if free <= 0:
+            self._campaign_backlog = True
+            return
+        try:
+            query = claimable_filter(self.clock.now(), self.lease_seconds)
+            query["id"] = {"$nin": list(self._campaigns)}
+            campaigns = await self.db.campaigns.find(query, {"_id": 0, "id": 1}).sort("send_at", 1).to_list(length=free)
+        except Exception as e:
+            logger.error(f"Error checking campaigns: {e}", exc_info=True)
+            return
+
+        # A full page may mean more are waiting for a free slot
+        self._campaign_backlog = len(campaigns) == free
+        for campaign in campaigns:
+            campaign_id = campaign["id"]
+            self._pending.pop(campaign_id, None)
+            runner = asyncio.create_task(self._run_campaign(campaign_id))
+            self._campaigns[campaign_id] = runner
+            runner.add_done_callback(lambda _, cid=campaign_id: self._campaign_done(cid))
+
+    def _campaign_done(self, campaign_id: str):
+        self._campaigns.pop(campaign_id, None)
+        if self._campaign_backlog:
+            self._wakeup.set()
+
+    async def _run_campaign(self, campaign_id: str):
+        """Fan one campaign out over its pending recipients, writing delivery state back in batches"""
+        with SEND_STAGE.time("claim"):
+            campaign = await self._claim(campaign_id, self.db.campaigns)
+        if campaign is None:
+            logger.info(f"Campaign {campaign_id} already claimed or no longer due, skipping")
+            return
+
+        owned = self._owned(campaign)
+        heartbeat = asyncio.create_task(self._heartbeat(owned, self.db.campaigns))
+        state = {"updates": {}, "counts": {SENT: 0, FAILED: 0}, "flushed_at": self.clock.monotonic(), "lost": False}
+        recipients = campaign["recipients"]
+        remaining = pending_indexes(recipients)
+        done = 0
+
+        async def flush():
+            updates, counts = state["updates"], state["counts"]
+            if not updates:
+                return
+            state["updates"], state["counts"] = {}, {SENT: 0, FAILED: 0}
+            state["flushed_at"] = self.clock.monotonic()
+            now = self.clock.now()
+            with SEND_STAGE.time("write"):
+                result = await self.db.campaigns.update_one(owned, {
+                    "$set": {**updates, "updated_at": now},
+                    "$inc": {
+                        f"counts.{SENT}": counts[SENT],
+                        f"counts.{FAILED}": counts[FAILED],
+                        f"counts.{PENDING}": -(counts[SENT] + counts[FAILED])
+                    }
+                })
+            if result.matched_count == 0:
+                # Canceled, or our lease went to another worker: stop sending
+                state["lost"] = True
+
+        try:
+            image_bytes = content_type = None
+            if campaign.get("image_id"):
+                # Loaded once and shared by every recipient
+                with SEND_STAGE.time("image"):
+                    image_bytes = await self.images.get(campaign["image_id"])
+                if image_bytes is None:
+                    raise RuntimeError(f"Image {campaign['image_id']} not found")
+                content_type = sniff_content_type(image_bytes)
+            filename = campaign.get("image_filename") or f"{campaign_id}.jpg"
+            logger.info(f"Campaign {campaign_id}: sending to {len(remaining)} of {len(recipients)} recipients")
+
+            indexes = iter(remaining)
+
+            async def lane():
+                nonlocal done
+                for index in indexes:
+                    if not self.running or state["lost"]:
+                        return
+                    recipient = recipients[index]
+                    fields = await self._send_to_recipient(campaign, recipient, image_bytes, filename, content_type)
+                    status = fields["status"]
+                    SENDS.inc(status)
+                    state["counts"][status] += 1
+                    for key, value in fields.items():
+                        state["updates"][f"recipients.{index}.{key}"] = value
+                    done += 1
+                    if (state["counts"][SENT] + state["counts"][FAILED] >= self.campaign_flush_size
+                            or self.clock.monotonic() - state["flushed_at"] >= self.campaign_flush_seconds):
+                        await flush()
+
+            await asyncio.gather(*(lane() for _ in range(min(self.campaign_concurrency, len(remaining)) or 1)))
+            await flush()
+
+            now = self.clock.now()
+            if done < len(remaining):
+                if not state["lost"]:
+                    # Stopped midway: hand the rest back so the next start resumes it
+                    await self.db.campaigns.update_one(owned, {
+                        "$set": {"status": "scheduled", "updated_at": now},
+                        "$unset": {"lease_expires_at": ""}
+                    })
+                logger.info(f"Campaign {campaign_id} paused with {len(remaining) - done} recipients left")
+                return
+
+            fresh = await self.db.campaigns.find_one({"id": campaign_id}, {"_id": 0, "counts": 1})
+            status = final_status(fresh["counts"]) if fresh else "sent"
+            await self.db.campaigns.update_one(owned, {
+                "$set": {"status": status, "sent_at": now, "updated_at": now},
+                "$unset": {"lease_expires_at": ""}
+            })
+            logger.info(f"Campaign {campaign_id} finished: {status} {fresh['counts'] if fresh else ''}")
+
+        except asyncio.CancelledError:
+            await asyncio.shield(self._release_campaign(owned, flush))
+            raise
+        except Exception as e:
+            logger.error(f"Error running campaign {campaign_id}: {e}", exc_info=True)
+            await flush()
+            await self.db.campaigns.update_one(owned, {
+                "$set": {"status": "failed", "error": str(e), "updated_at": self.clock.now()},
+                "$unset": {"lease_expires_at": ""}
+            })
+        finally:
+            await self._stop_heartbeat(heartbeat)
+
+    async def _release_campaign(self, owned: dict, flush):
+        """Record what was delivered and put the campaign back to scheduled"""
+        try:
+            await flush()
+            await self.db.campaigns.update_one(owned, {
+                "$set": {"status": "scheduled", "updated_at": self.clock.now()},
+                "$unset": {"lease_expires_at": ""}
+            })
+        except Exception as e:
+            logger.error(f"Could not release campaign {owned['id']}: {e}")
+
+    async def _send_to_recipient(self, campaign: dict, recipient: dict, image_bytes, filename, content_type) -> dict:
+        """Deliver to one recipient, retrying transient failures in place; returns the fields to record"""
+        phone = recipient["phone"]
+        message = render_message(campaign.get("message_md", ""), recipient.get("vars") or {}, campaign.get("vars"))
+        attempts = recipient.get("attempts", 0)
+
+        while True:
+            attempts += 1
+            await self.breaker.ready()
+            with SEND_STAGE.time("rate_limit"):
+                await self.limiter.acquire(phone)
+            result = await self._deliver(phone, message, image_bytes, filename, content_type)
+
+            if is_transient(result) and attempts < self.max_attempts:
+                SENDS.inc("retry")
+                await self.clock.sleep(backoff_delay(attempts, self.retry_base, self.retry_cap))
+                continue
+
+            now = self.clock.now()
+            if result.get("code") == "SUCCESS":
+                lag = (now - as_utc(campaign["send_at"])).total_seconds()
+                self.limiter.on_success()
+                self.send_lag.append(lag)
+                SEND_LAG.observe(lag)
+                message_id = (result.get("results") or {}).get("message_id")
+                return {"status": SENT, "attempts": attempts, "sent_at": now, "message_id": message_id}
+
+            logger.warning(f"Campaign {campaign['id']}: failed to send to {phone} after {attempts} attempt(s): {result}")
+            return {"status": FAILED, "attempts": attempts, "error": str(result.get("message") or result)[:500]}
@@ -0,0 +1,179 @@
+import base64
+import json
+import logging
+import os
+import uuid
+import zlib
+from datetime import datetime, timezone
+from typing import AsyncIterator, Optional
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pydantic import ValidationError
+from pymongo import ReplaceOne
+from pymongo.errors import BulkWriteError
+
+from background_worker import as_utc
+from image_store import ImageStore
+from models import Schedule
+
+logger = logging.getLogger(__name__)
+
+# Backups are NDJSON: a meta line, then one line per image, then one line per
+# schedule. Both directions stream - export straight off Mongo cursors,
+# import in chunks of upserts - so memory stays flat whatever the size.
+EXPORT_VERSION = 2
+EXPORT_BLOCK_BYTES = 64 * 1024
+IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', '500'))
+MAX_REPORTED_ERRORS = 100
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return as_utc(value).isoformat()
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode()
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+def dumps_line(obj: dict) -> bytes:
+    return json.dumps(obj, default=_json_default).encode() + b"\n"
+
+async def export_lines(db: AsyncIOMotorDatabase, include_images: bool = True) -> AsyncIterator[bytes]:
+    """NDJSON export, yielded in ~64 KB blocks"""
+    block = bytearray(dumps_line({
+        "type": "meta",
+        "version": EXPORT_VERSION,
+        "exported_at": datetime.now(timezone.utc),
+        "app_name": "WhatsApp Daily Devotion Scheduler",
+        "timezone": "GMT+7"
+    }))
+
+    if include_images:
+        async for image in db.images.find({}, batch_size=16):
+            image["id"] = image.pop("_id")
+            block += dumps_line({"type": "image", **image})
+            if len(block) >= EXPORT_BLOCK_BYTES:
+                yield bytes(block)
+                block.clear()
+
+    async for schedule in db.schedules.find({}, {"_id": 0}, batch_size=500):
+        block += dumps_line({"type": "schedule", **schedule})
+        if len(block) >= EXPORT_BLOCK_BYTES:
+            yield bytes(block)
+            block.clear()
+
+    if block:
+        yield bytes(block)
+
+async def gzip_stream(blocks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    async for block in blocks:
+        compressed = compressor.compress(block)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+async def maybe_gunzip(stream: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Pass a body through, transparently inflating it if it starts with the gzip magic"""
+    decompressor = None
+    first = True
+    async for chunk in stream:
+        if first and chunk:
+            first = False
+            if chunk[:2] == b"\x1f\x8b":
+                decompressor = zlib.decompressobj(31)
+        if decompressor is not None:
+            chunk = decompressor.decompress(chunk)
+        if chunk:
+            yield chunk
+    if decompressor is not None:
+        tail = decompressor.flush()
+        if tail:
+            yield tail
+
+class ImportJob:
+    """One streaming import: validates rows as they arrive and upserts them by id in chunks"""
+
+    def __init__(self, db: AsyncIOMotorDatabase, import_id: Optional[str] = None):
+        self.db = db
+        self.images = ImageStore(db)
+        self.import_id = import_id or uuid.uuid4().hex
+        self.status = "running"
+        self.processed = 0
+        self.upserted = 0
+        self.updated = 0
+        self.images_imported = 0
+        self.error_count = 0
+        self.errors = []
+        self._ops = []
+        self._image_ids = {}  # exported image id -> stored id (they differ only if bytes changed)
+
+    def progress(self) -> dict:
+        return {
+            "import_id": self.import_id,
+            "status": self.status,
+            "processed": self.processed,
+            "upserted": self.upserted,
+            "updated": self.updated,
+            "images": self.images_imported,
+            "error_count": self.error_count,
+            "errors": self.errors
+        }
+
+    def error(self, line_no: int, message: str):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"line": line_no, "error": message})
+
+    async def feed(self, line_no: int, obj: dict):
+        """Handle one parsed row (meta, image or schedule; untyped rows are schedules)"""
+        kind = obj.pop("type", "schedule")
+        if kind == "meta":
+            return
+        self.processed += 1
+
+        if kind == "image":
+            try:
+                data = base64.b64decode(obj["data"])
+                stored_id = await self.images.put(data, filename=obj.get("filename"))
+                self._image_ids[obj.get("id", stored_id)] = stored_id
+                self.images_imported += 1
+            except Exception as e:
+                self.error(line_no, f"image: {e}")
+            return
+
+        try:
+            image_base64 = obj.pop("image_base64", None)
+            schedule = Schedule.model_validate(obj)
+        except ValidationError as e:
+            self.error(line_no, str(e))
+            return
+
+        doc = schedule.model_dump(mode='python', exclude={'image_base64'})
+        if image_base64:
+            # Pre-image-store exports carry the payload inline
+            doc["image_id"] = await self.images.put_base64(image_base64, doc.get("image_filename"))
+        elif doc.get("image_id") in self._image_ids:
+            doc["image_id"] = self._image_ids[doc["image_id"]]
+
+        # Upsert by id, so re-running the same import is a no-op
+        self._ops.append(ReplaceOne({"id": doc["id"]}, doc, upsert=True))
+        if len(self._ops) >= IMPORT_CHUNK_SIZE:
+            await self.flush()
+
+    async def flush(self):
+        if not self._ops:
+            return
+        ops, self._ops = self._ops, []
+        try:
+            result = await self.db.schedules.bulk_write(ops, ordered=False)
+            self.upserted += result.upserted_count
+            self.updated += result.matched_count
+        except BulkWriteError as e:
+            details = e.details
+            self.upserted += details.get("nUpserted", 0)
+            self.updated += details.get("nMatched", 0)
+            for err in details.get("writeErrors", []):
+                self.error(0, err.get("errmsg", "write error"))
+        logger.info(f"Import {self.import_id}: {self.processed} rows processed")
+
+    async def finish(self):
+        await self.flush()
+        self.status = "done"
@@ -0,0 +1,4 @@
+"""Benchmarks and load-test tooling (not shipped in the Docker image).
+
+Run from the backend directory, e.g. ``python -m bench.gateway_client``.
+"""
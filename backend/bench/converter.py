@@ -0,0 +1,103 @@
+"""HTML-to-WhatsApp conversion speed and memory: the old HTMLParser converter vs the current one.
+
+    python -m bench.converter --iterations 2000
+
+Runs both converters over devotion-sized HTML bodies like the editor emits
+(headings, paragraphs, nested lists, marks, links) and prints conversions per
+second and peak allocation per conversion, for cold (unique bodies) and warm
+(repeated templates, served from the cache) inputs.
+"""
+import argparse
+import re
+import time
+import tracemalloc
+from html.parser import HTMLParser
+
+import markdown_converter
+
+class LegacyConverter(HTMLParser):
+    # What html_to_whatsapp_markdown did before the single-pass converter
+    def __init__(self):
+        super().__init__()
+        self.markdown = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ('strong', 'b'):
+            self.markdown.append('*')
+        elif tag in ('em', 'i'):
+            self.markdown.append('_')
+        elif tag == 'li':
+            self.markdown.append('\n• ')
+        elif tag == 'br':
+            self.markdown.append('\n')
+
+    def handle_endtag(self, tag):
+        if tag in ('strong', 'b'):
+            self.markdown.append('*')
+        elif tag in ('em', 'i'):
+            self.markdown.append('_')
+        elif tag == 'p':
+            self.markdown.append('\n\n')
+
+    def handle_data(self, data):
+        if data.strip():
+            self.markdown.append(data)
+
+def legacy_convert(html: str) -> str:
+    parser = LegacyConverter()
+    parser.feed(html)
+    return re.sub(r'\n{3,}', '\n\n', ''.join(parser.markdown)).strip()
+
+def devotion(day: int) -> str:
+    """A ~1 KB devotion body in the shape the TipTap editor produces"""
+    return (
+        f"<h2>Renungan Hari ke-{day}</h2>"
+        "<p><strong>Bacaan:</strong> <em>Mazmur 23:1-6</em></p>"
+        "<p>Tuhan adalah gembalaku, takkan kekurangan aku. Ia membaringkan aku di padang "
+        "yang berumput hijau, Ia membimbing aku ke air yang tenang; Ia menyegarkan jiwaku.</p>"
+        "<p>Dalam perjalanan hidup kita sering merasa <s>sendirian</s> lelah, namun Firman "
+        "mengingatkan bahwa Gembala yang baik <mark>tidak pernah meninggalkan</mark> domba-Nya.</p>"
+        "<h3>Refleksi</h3>"
+        "<ol><li><p>Apa yang membuat Anda merasa kekurangan hari ini?</p></li>"
+        "<li><p>Di mana Anda melihat pemeliharaan Tuhan minggu ini?</p>"
+        "<ul><li><p>di keluarga</p></li><li><p>di pekerjaan</p></li></ul></li>"
+        "<li><p>Bagaimana Anda dapat menjadi berkat bagi orang lain?</p></li></ol>"
+        "<p><strong>Doa:</strong> Tuhan, ajar kami percaya sepenuhnya kepada-Mu. "
+        "<em>Amin.</em></p>"
+        f"<p>Bacaan lengkap: <a href=\"https://alkitab.example/mzm/23?d={day}\">Mazmur 23</a></p>"
+        "<p>Ayat hafalan: <code>Mzm 23:1</code></p>"
+    )
+
+def measure(name: str, convert, bodies, iterations: int):
+    start = time.perf_counter()
+    for i in range(iterations):
+        convert(bodies[i % len(bodies)])
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    for body in bodies[:50]:
+        convert(body)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{name:<22} {iterations / elapsed:10.0f} conv/s   {elapsed / iterations * 1e6:8.1f} us/conv   peak {peak / 1024:7.1f} KB")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--templates", type=int, default=7, help="distinct bodies in the warm run")
+    args = parser.parse_args()
+
+    cold = [devotion(day) for day in range(args.iterations)]
+    warm = [devotion(day) for day in range(args.templates)]
+    print(f"{len(cold[0])} byte bodies, {args.iterations} conversions per run")
+
+    measure("legacy (cold)", legacy_convert, cold, args.iterations)
+    measure("single-pass (cold)", markdown_converter._convert, cold, args.iterations)
+    measure("legacy (templates)", legacy_convert, warm, args.iterations)
+    markdown_converter.clear_cache()
+    measure("cached (templates)", markdown_converter.html_to_whatsapp_markdown, warm, args.iterations)
+    print(f"cache: {markdown_converter.cache_info()}")
+
+if __name__ == "__main__":
+    main()
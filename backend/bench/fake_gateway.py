@@ -0,0 +1,217 @@
+"""Local stand-in for the WhatsApp gateway.
+
+Implements the two endpoints the scheduler uses (/send/message and
+/send/image) with configurable latency and error rate, so benchmarks never
+touch the real gateway:
+
+    python -m bench.fake_gateway --port 3901 --latency-ms 20 --error-rate 0.01
+
+With --webhook-url it also calls back like the real gateway: a delivered and
+then a read receipt for every message it accepts, and POST /receipts/burst
+fires a stream of receipts (repeats included) at a given rate.
+"""
+import argparse
+import asyncio
+import json
+import random
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from pathlib import Path
+from typing import List, Optional
+
+import httpx
+from fastapi import FastAPI, Form, File, UploadFile
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+class Burst(BaseModel):
+    message_ids: List[str]
+    total: int = 10000  # callbacks to send
+    rate: float = 5000  # per second
+    concurrency: int = 64
+    ids_per_callback: int = 1
+    duplicate_rate: float = 0.2  # share of callbacks that repeat an earlier one
+
+def receipt(message_ids: List[str], receipt_type: str) -> dict:
+    # go-whatsapp-web-multidevice "message.ack" webhook shape
+    return {
+        "event": "message.ack",
+        "payload": {"ids": message_ids, "receipt_type": receipt_type},
+        "timestamp": time.time(),
+    }
+
+def create_app(latency_ms: float = 0.0, error_rate: float = 0.0, webhook_url: Optional[str] = None) -> FastAPI:
+    app = FastAPI()
+    app.state.stats = {"messages": 0, "images": 0, "errors": 0,
+                       "callbacks": 0, "callback_errors": 0, "callback_ms_max": 0.0}
+    app.state.client = None
+    app.state.tasks = set()
+
+    @app.on_event("startup")
+    async def startup():
+        if webhook_url:
+            app.state.client = httpx.AsyncClient(timeout=30, limits=httpx.Limits(max_connections=256))
+
+    @app.on_event("shutdown")
+    async def shutdown():
+        if app.state.client:
+            await app.state.client.aclose()
+
+    def record(ok: bool, started: float):
+        stats = app.state.stats
+        stats["callbacks" if ok else "callback_errors"] += 1
+        stats["callback_ms_max"] = max(stats["callback_ms_max"], (time.perf_counter() - started) * 1000)
+
+    async def callback(body: dict):
+        started = time.perf_counter()
+        try:
+            response = await app.state.client.post(webhook_url, json=body)
+            ok = response.status_code < 300
+        except httpx.HTTPError:
+            ok = False
+        record(ok, started)
+
+    def spawn(coro):
+        task = asyncio.create_task(coro)
+        app.state.tasks.add(task)
+        task.add_done_callback(app.state.tasks.discard)
+
+    async def acknowledge(message_id: str):
+        await asyncio.sleep(random.uniform(0.05, 0.5))
+        await callback(receipt([message_id], "delivered"))
+        await asyncio.sleep(random.uniform(0.1, 1.0))
+        await callback(receipt([message_id], "read"))
+
+    async def respond(kind: str, phone: str):
+        if latency_ms:
+            await asyncio.sleep(latency_ms / 1000)
+        if error_rate and random.random() < error_rate:
+            app.state.stats["errors"] += 1
+            return JSONResponse(status_code=503, content={"code": "ERROR", "message": "fake gateway error"})
+        app.state.stats[kind] += 1
+        message_id = uuid.uuid4().hex.upper()
+        if app.state.client:
+            spawn(acknowledge(message_id))
+        return {
+            "code": "SUCCESS",
+            "message": "Success",
+            "results": {"message_id": message_id, "status": f"sent to {phone}"}
+        }
+
+    @app.post("/send/message")
+    async def send_message(payload: dict):
+        return await respond("messages", payload.get("phone", ""))
+
+    @app.post("/send/image")
+    async def send_image(phone: str = Form(...), caption: str = Form(""), image: UploadFile = File(...)):
+        await image.read()
+        return await respond("images", phone)
+
+    @app.get("/app/devices")
+    async def devices():
+        # What the pool's health check probes
+        return {"code": "SUCCESS", "message": "Fetch device success", "results": [{"name": "fake", "device": "fake"}]}
+
+    @app.post("/receipts/burst")
+    async def burst(spec: Burst):
+        """Fire spec.total receipt callbacks at spec.rate; returns once they are all answered"""
+        if not webhook_url:
+            return JSONResponse(status_code=400, content={"detail": "started without --webhook-url"})
+        # Keep-alive raw HTTP/1.1 connections: an httpx pool would cap the
+        # rate on the sender's side long before the receiver's
+        url = httpx.URL(webhook_url)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=spec.concurrency * 4)
+
+        async def sender():
+            reader, writer = await asyncio.open_connection(url.host, url.port or 80)
+            try:
+                while (item := await queue.get()) is not None:
+                    data, queued_at = item
+                    writer.write(f"POST {url.raw_path.decode()} HTTP/1.1\r\nHost: {url.host}\r\n"
+                                 f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n\r\n".encode() + data)
+                    await writer.drain()
+                    status = int((await reader.readline()).split()[1])
+                    length = 0
+                    while (line := await reader.readline()) not in (b"\r\n", b""):
+                        name, _, value = line.partition(b":")
+                        if name.strip().lower() == b"content-length":
+                            length = int(value)
+                    await reader.readexactly(length)
+                    record(status < 300, queued_at)
+            finally:
+                writer.close()
+
+        senders = [asyncio.create_task(sender()) for _ in range(spec.concurrency)]
+        started = time.perf_counter()
+        sent = []
+        for i in range(spec.total):
+            if sent and random.random() < spec.duplicate_rate:
+                data = random.choice(sent)
+            else:
+                ids = random.sample(spec.message_ids, min(spec.ids_per_callback, len(spec.message_ids)))
+                data = json.dumps(receipt(ids, random.choice(("delivered", "read")))).encode()
+                sent.append(data)
+            # Pace to the requested rate
+            delay = started + i / spec.rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await queue.put((data, time.perf_counter()))
+        for _ in senders:
+            await queue.put(None)
+        await asyncio.gather(*senders)
+        elapsed = time.perf_counter() - started
+        return {"callbacks": spec.total, "unique": len(sent), "seconds": round(elapsed, 3),
+                "per_second": round(spec.total / elapsed, 1)}
+
+    @app.get("/stats")
+    async def stats():
+        return app.state.stats
+
+    return app
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_in_background(port: int, latency_ms: float = 0.0, error_rate: float = 0.0,
+                        webhook_url: Optional[str] = None) -> subprocess.Popen:
+    """Launch the fake gateway as a subprocess and wait until it accepts connections"""
+    command = [sys.executable, "-m", "bench.fake_gateway", "--port", str(port),
+               "--latency-ms", str(latency_ms), "--error-rate", str(error_rate)]
+    if webhook_url:
+        command += ["--webhook-url", webhook_url]
+    proc = subprocess.Popen(
+        command,
+        cwd=Path(__file__).resolve().parent.parent,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 15
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return proc
+        except OSError:
+            time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError(f"fake gateway did not come up on port {port}")
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=3901)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--webhook-url", help="where to send delivery/read receipts, e.g. http://127.0.0.1:8001/api/webhooks/gateway")
+    args = parser.parse_args()
+
+    uvicorn.run(create_app(args.latency_ms, args.error_rate, args.webhook_url), host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
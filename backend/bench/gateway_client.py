@@ -0,0 +1,73 @@
+"""Per-message latency: fresh httpx client per send vs the pooled gateway client.
+
+    python -m bench.gateway_client --messages 500
+
+Starts a local fake gateway, sends the same text message N times each way
+and prints mean/p50/p95 latency per message and the time saved by pooling.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+from bench.fake_gateway import free_port, start_in_background
+from gateway import WhatsAppGateway
+
+async def fresh_client_send(base_url: str, phone: str, message: str):
+    # What send_text_message did before the shared client
+    async with httpx.AsyncClient(timeout=30.0) as client:
+        response = await client.post(f"{base_url}/send/message", json={"phone": phone, "message": message})
+        response.raise_for_status()
+        return response.json()
+
+async def measure(send, count: int):
+    samples = []
+    for _ in range(count):
+        start = time.perf_counter()
+        await send()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+def summarize(name: str, samples):
+    samples = sorted(samples)
+    p95 = samples[int(0.95 * (len(samples) - 1))]
+    print(f"{name:<14} mean {statistics.mean(samples):7.3f} ms   p50 {statistics.median(samples):7.3f} ms   p95 {p95:7.3f} ms")
+    return statistics.mean(samples)
+
+async def run(count: int, latency_ms: float):
+    port = free_port()
+    proc = start_in_background(port, latency_ms=latency_ms)
+    base_url = f"http://127.0.0.1:{port}"
+    phone, message = "6281200000000", "Selamat pagi - renungan hari ini"
+    try:
+        # Warm up the fake gateway before timing anything
+        await fresh_client_send(base_url, phone, message)
+
+        fresh = await measure(lambda: fresh_client_send(base_url, phone, message), count)
+
+        pooled_gateway = WhatsAppGateway(base_url=base_url, username="", password="")
+        await pooled_gateway.open()
+        try:
+            pooled = await measure(lambda: pooled_gateway.send_text_message(phone, message), count)
+        finally:
+            await pooled_gateway.close()
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    print(f"{count} text messages against fake gateway on {base_url} (latency {latency_ms} ms)")
+    fresh_mean = summarize("fresh client", fresh)
+    pooled_mean = summarize("pooled client", pooled)
+    print(f"saved per message: {fresh_mean - pooled_mean:.3f} ms ({(1 - pooled_mean / fresh_mean) * 100:.0f}%)")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    args = parser.parse_args()
+    asyncio.run(run(args.messages, args.latency_ms))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Seed a large schedules collection and assert every hot query uses an index.
+
+    python -m bench.index_plans --rows 200000
+
+Needs a real MongoDB (explain() is not emulated by mongomock). Uses
+MONGO_URL (default mongodb://localhost:27017) and a throwaway database that
+is dropped afterwards. Exits non-zero if any winning plan is a COLLSCAN, so
+it can gate CI.
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from indexes import check_query_plans, ensure_indexes
+
+STATUSES = ["scheduled"] * 2 + ["sent"] * 6 + ["failed", "canceled"]
+
+def make_rows(count: int, start: datetime):
+    for _ in range(count):
+        send_at = start + timedelta(minutes=random.randint(-525600, 525600))
+        status = random.choice(STATUSES)
+        yield {
+            "id": str(uuid.uuid4()),
+            "phone": "120363291513749102@g.us",
+            "message_html": "<p>Renungan</p>",
+            "message_md": "Renungan",
+            "send_at": send_at,
+            "status": status,
+            "sent_at": send_at + timedelta(seconds=1) if status == "sent" else None,
+            "created_at": start,
+            "updated_at": start,
+        }
+
+async def run(rows: int, db_name: str) -> int:
+    client = AsyncIOMotorClient(os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    db = client[db_name]
+    try:
+        await client.drop_database(db_name)
+        batch = []
+        for row in make_rows(rows, datetime.now(timezone.utc)):
+            batch.append(row)
+            if len(batch) == 5000:
+                await db.schedules.insert_many(batch, ordered=False)
+                batch = []
+        if batch:
+            await db.schedules.insert_many(batch, ordered=False)
+
+        await ensure_indexes(db)
+        plans = await check_query_plans(db)
+    finally:
+        await client.drop_database(db_name)
+        client.close()
+
+    failed = 0
+    for name, stages in plans.items():
+        ok = "COLLSCAN" not in stages and "IXSCAN" in stages
+        failed += not ok
+        print(f"{'ok  ' if ok else 'FAIL'} {name:<16} {' > '.join(stages)}")
+    return 1 if failed or not plans else 0
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--db", default="scheduler_index_check")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(run(args.rows, args.db)))
+
+if __name__ == "__main__":
+    main()
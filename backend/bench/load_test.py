@@ -0,0 +1,198 @@
+"""End-to-end dispatch load test: BackgroundWorker against the fake gateway.
+
+    python -m bench.load_test --count 2000 --mongomock
+    python -m bench.load_test --count 20000 --latency-ms 50 --min-throughput 200 --max-p95-lag-ms 60000
+    python -m bench.load_test --count 5000 --gateways 3 --kill-gateway-after 2 --mongomock
+
+Seeds --count schedules due at the same instant, runs a BackgroundWorker
+until every one is sent or failed, and reports throughput, p50/p95/p99 send
+lag (sent_at - send_at, from every row) and peak RSS. Runs against MONGO_URL
+in a throwaway database that is dropped afterwards, or in-process with
+--mongomock (needs mongomock-motor).
+
+--gateways N runs N fake gateways behind the gateway pool and reports how
+sends spread over them; --kill-gateway-after S stops the first one S seconds
+into the run to exercise failover.
+
+The --min-throughput / --max-p95-lag-ms / --max-failed thresholds make the
+process exit non-zero when breached, so a dispatch-path regression fails CI.
+Gateway rate limits default to values high enough not to be the bottleneck;
+set GATEWAY_RATE_PER_SEC etc. to measure with production limits.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+# The limiter reads these when the worker is constructed
+for name, value in (("GATEWAY_RATE_PER_SEC", "100000"), ("GATEWAY_BURST", "100000"),
+                    ("RECIPIENT_RATE_PER_SEC", "100000"), ("RECIPIENT_BURST", "100000"),
+                    ("RETRY_BASE_SECONDS", "0.1"), ("RETRY_MAX_SECONDS", "1")):
+    os.environ.setdefault(name, value)
+
+from background_worker import BackgroundWorker
+from bench.fake_gateway import free_port, start_in_background
+from bench.seed import seed
+from gateway import gateway
+from indexes import ensure_indexes
+
+def current_rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+def percentile(samples, p: float) -> float:
+    if not samples:
+        return 0.0
+    return float(samples[min(len(samples) - 1, int(p * len(samples)))])
+
+def open_database(args):
+    if args.mongomock:
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            sys.exit("--mongomock needs the mongomock-motor package")
+        client = AsyncMongoMockClient()
+    else:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        client = AsyncIOMotorClient(os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    return client, client[args.db]
+
+async def wait_until_done(db, count: int, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if await db.schedules.count_documents({"status": {"$in": ["sent", "failed"]}}) >= count:
+            return True
+        await asyncio.sleep(0.2)
+    return False
+
+async def run(args) -> dict:
+    ports = [free_port() for _ in range(args.gateways)]
+    procs = [start_in_background(port, latency_ms=args.latency_ms, error_rate=args.error_rate) for port in ports]
+    gateway.configure([{"url": f"http://127.0.0.1:{port}", "username": "", "password": ""} for port in ports])
+    client, db = open_database(args)
+
+    try:
+        await client.drop_database(args.db)
+        await ensure_indexes(db)
+        # Seed in the far future, then move every row onto one deadline
+        # right before the worker starts, so seeding time is not counted as lag
+        await seed(db, args.count, datetime.now(timezone.utc) + timedelta(days=1), args.recipients, args.images)
+        due_at = datetime.now(timezone.utc) + timedelta(seconds=1)
+        await db.schedules.update_many({}, {"$set": {"send_at": due_at}})
+
+        await gateway.open()
+        rss_before = current_rss_mb()
+        worker = BackgroundWorker(db)
+        await worker.start()
+        try:
+            await asyncio.sleep(max(0.0, (due_at - datetime.now(timezone.utc)).total_seconds()))
+            started = time.perf_counter()
+            if args.kill_gateway_after is not None:
+                asyncio.get_running_loop().call_later(args.kill_gateway_after, procs[0].terminate)
+            finished = await wait_until_done(db, args.count, args.timeout)
+            elapsed = time.perf_counter() - started
+        finally:
+            await worker.stop()
+            nodes = gateway.stats()
+            await gateway.close()
+
+        rows = await db.schedules.find({}, {"_id": 0, "status": 1, "send_lag_ms": 1, "attempts": 1}).to_list(None)
+        lags = sorted(row["send_lag_ms"] for row in rows if row.get("status") == "sent" and row.get("send_lag_ms") is not None)
+        sent = sum(1 for row in rows if row.get("status") == "sent")
+        failed = sum(1 for row in rows if row.get("status") == "failed")
+        retried = sum(1 for row in rows if (row.get("attempts") or 0) > 1)
+    finally:
+        await client.drop_database(args.db)
+        client.close()
+        for proc in procs:
+            proc.terminate()
+            proc.wait()
+
+    return {
+        "count": args.count,
+        "completed": finished,
+        "sent": sent,
+        "failed": failed,
+        "retried": retried,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_per_s": round(sent / elapsed, 1) if elapsed else 0.0,
+        "lag_p50_ms": percentile(lags, 0.50),
+        "lag_p95_ms": percentile(lags, 0.95),
+        "lag_p99_ms": percentile(lags, 0.99),
+        "lag_max_ms": float(lags[-1]) if lags else 0.0,
+        "rss_before_mb": round(rss_before, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "gateway_nodes": [{k: node[k] for k in ("name", "healthy", "sent", "errors")} for node in nodes],
+    }
+
+def check_thresholds(result: dict, args) -> list:
+    breaches = []
+    if not result["completed"]:
+        breaches.append(f"not all schedules finished within {args.timeout}s")
+    if args.min_throughput is not None and result["throughput_per_s"] < args.min_throughput:
+        breaches.append(f"throughput {result['throughput_per_s']}/s < {args.min_throughput}/s")
+    if args.max_p95_lag_ms is not None and result["lag_p95_ms"] > args.max_p95_lag_ms:
+        breaches.append(f"p95 lag {result['lag_p95_ms']} ms > {args.max_p95_lag_ms} ms")
+    if args.max_failed is not None and result["failed"] > args.max_failed:
+        breaches.append(f"{result['failed']} failed > {args.max_failed}")
+    return breaches
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=1000)
+    parser.add_argument("--recipients", type=int, default=1000)
+    parser.add_argument("--images", type=float, default=0.0, help="fraction of rows with an image")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="fake gateway latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fake gateway 503 rate")
+    parser.add_argument("--gateways", type=int, default=1, help="fake gateways behind the pool")
+    parser.add_argument("--kill-gateway-after", type=float, help="stop the first fake gateway after this many seconds")
+    parser.add_argument("--mongomock", action="store_true", help="in-process mongomock instead of MONGO_URL")
+    parser.add_argument("--db", default="scheduler_load_test")
+    parser.add_argument("--timeout", type=float, default=600.0)
+    parser.add_argument("--min-throughput", type=float, help="fail below this many sends/s")
+    parser.add_argument("--max-p95-lag-ms", type=float, help="fail above this p95 send lag")
+    parser.add_argument("--max-failed", type=int, help="fail above this many failed schedules")
+    parser.add_argument("--json", action="store_true", help="print the result as JSON")
+    parser.add_argument("--verbose", action="store_true", help="show worker and gateway warnings")
+    args = parser.parse_args()
+
+    # Per-send failure logs would drown the report when --error-rate is set
+    logging.basicConfig(level=logging.WARNING if args.verbose else logging.CRITICAL)
+    result = asyncio.run(run(args))
+    breaches = check_thresholds(result, args)
+
+    if args.json:
+        print(json.dumps({**result, "breaches": breaches}))
+    else:
+        print(f"{result['sent']}/{result['count']} sent, {result['failed']} failed, {result['retried']} retried "
+              f"in {result['elapsed_s']} s ({args.latency_ms} ms gateway latency, {args.error_rate:.0%} errors)")
+        print(f"throughput   {result['throughput_per_s']:10.1f} sends/s")
+        print(f"send lag     p50 {result['lag_p50_ms']:.0f} ms   p95 {result['lag_p95_ms']:.0f} ms   "
+              f"p99 {result['lag_p99_ms']:.0f} ms   max {result['lag_max_ms']:.0f} ms")
+        print(f"memory       {result['rss_before_mb']} MB RSS at worker start, peak {result['peak_rss_mb']} MB")
+        if len(result["gateway_nodes"]) > 1:
+            for node in result["gateway_nodes"]:
+                print(f"gateway      {node['name']:22} {node['sent']:7} sent {node['errors']:5} errors  "
+                      f"{'up' if node['healthy'] else 'DOWN'}")
+        for breach in breaches:
+            print(f"FAIL {breach}")
+    sys.exit(1 if breaches else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""Receipt webhook under a callback burst, and what it does to API latency.
+
+    python -m bench.receipts --mongomock
+    python -m bench.receipts --messages 20000 --callbacks 50000 --rate 5000 --max-p99-ms 250
+
+Seeds --messages sent schedules carrying gateway message ids, serves the app
+in-process, and has the fake gateway fire --callbacks receipt webhooks at
+--rate per second (a --duplicate-rate share of them repeats). Meanwhile
+GET /api/schedules is probed continuously. Reports the callback rate the
+endpoint sustained, webhook and API latency during the burst, and how the
+receipts ended up on the schedules after the final flush.
+Runs against MONGO_URL in a throwaway database, or in-process with
+--mongomock (needs mongomock-motor).
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+for name, value in (("MONGO_URL", "mongodb://localhost:27017"), ("DB_NAME", "scheduler_receipts")):
+    os.environ.setdefault(name, value)
+
+import httpx
+
+from bench.fake_gateway import free_port, start_in_background
+from bench.load_test import open_database, percentile
+from bench.seed import make_schedule
+from receipts import ReceiptBuffer
+
+async def seed_sent(db, count: int) -> list:
+    """Insert count sent rows, each with its own gateway message id"""
+    sent_at = datetime.now(timezone.utc) - timedelta(minutes=1)
+    message_ids = []
+    batch = []
+    for i in range(count):
+        row = make_schedule(i, sent_at, 1000)
+        message_id = uuid.uuid4().hex.upper()
+        row.update(status="sent", sent_at=sent_at, attempts=1, gateway_message_id=message_id,
+                   gateway_response={"code": "SUCCESS", "results": {"message_id": message_id}})
+        batch.append(row)
+        message_ids.append(message_id)
+        if len(batch) == 1000:
+            await db.schedules.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        await db.schedules.insert_many(batch, ordered=False)
+    return message_ids
+
+async def probe_once(client: httpx.AsyncClient, count: int) -> list:
+    latencies = []
+    for _ in range(count):
+        started = time.perf_counter()
+        (await client.get("/api/schedules", params={"limit": 20, "status": "sent"})).raise_for_status()
+        latencies.append((time.perf_counter() - started) * 1000)
+    return sorted(latencies)
+
+async def probe(client: httpx.AsyncClient, stop: asyncio.Event, interval: float) -> list:
+    latencies = []
+    while not stop.is_set():
+        started = time.perf_counter()
+        response = await client.get("/api/schedules", params={"limit": 20, "status": "sent"})
+        response.raise_for_status()
+        latencies.append((time.perf_counter() - started) * 1000)
+        await asyncio.sleep(interval)
+    return sorted(latencies)
+
+async def run(args) -> dict:
+    import uvicorn
+
+    import server
+
+    client, db = open_database(args)
+    await client.drop_database(args.db)
+    server.db = db
+    server.receipts = ReceiptBuffer(db, on_applied=server.receipts_applied)
+    server.receipts.start()
+
+    api_port = free_port()
+    api = uvicorn.Server(uvicorn.Config(server.app, host="127.0.0.1", port=api_port, lifespan="off", log_level="warning"))
+    api_task = asyncio.create_task(api.serve())
+    gateway_port = free_port()
+    proc = start_in_background(gateway_port, webhook_url=f"http://127.0.0.1:{api_port}/api/webhooks/gateway")
+    try:
+        while not api.started:
+            await asyncio.sleep(0.05)
+        message_ids = await seed_sent(db, args.messages)
+
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{api_port}", timeout=30) as api_client, \
+                httpx.AsyncClient(base_url=f"http://127.0.0.1:{gateway_port}", timeout=None) as gateway_client:
+            idle = await probe_once(api_client, args.idle_probes)
+            stop = asyncio.Event()
+            prober = asyncio.create_task(probe(api_client, stop, args.probe_interval_ms / 1000))
+            response = await gateway_client.post("/receipts/burst", json={
+                "message_ids": message_ids,
+                "total": args.callbacks,
+                "rate": args.rate,
+                "concurrency": args.concurrency,
+                "ids_per_callback": args.ids_per_callback,
+                "duplicate_rate": args.duplicate_rate,
+            })
+            response.raise_for_status()
+            burst = response.json()
+            stop.set()
+            busy = await prober
+            gateway_stats = (await gateway_client.get("/stats")).json()
+
+        await server.receipts.close()
+        stats = server.receipts.stats()
+        delivered = await db.schedules.count_documents({"delivery_status": {"$in": ["delivered", "read"]}})
+        read = await db.schedules.count_documents({"delivery_status": "read"})
+        return {
+            "callbacks": burst["callbacks"],
+            "callbacks_per_second": burst["per_second"],
+            "callback_errors": gateway_stats["callback_errors"],
+            "callback_ms_max": round(gateway_stats["callback_ms_max"], 1),
+            "api_p50_ms_idle": round(percentile(idle, 0.50), 1),
+            "api_p50_ms": round(percentile(busy, 0.50), 1),
+            "api_p99_ms": round(percentile(busy, 0.99), 1),
+            "api_probes": len(busy),
+            **stats,
+            "rows_delivered": delivered,
+            "rows_read": read,
+        }
+    finally:
+        proc.terminate()
+        proc.wait()
+        api.should_exit = True
+        await api_task
+        await client.drop_database(args.db)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=5000, help="sent schedules to receive receipts for")
+    parser.add_argument("--callbacks", type=int, default=20000)
+    parser.add_argument("--rate", type=float, default=5000, help="callbacks per second")
+    parser.add_argument("--concurrency", type=int, default=64, help="callbacks in flight")
+    parser.add_argument("--ids-per-callback", type=int, default=1)
+    parser.add_argument("--duplicate-rate", type=float, default=0.2)
+    parser.add_argument("--probe-interval-ms", type=float, default=10)
+    parser.add_argument("--idle-probes", type=int, default=50)
+    parser.add_argument("--max-p99-ms", type=float, help="exit non-zero if API p99 during the burst exceeds this")
+    parser.add_argument("--db", default=os.environ["DB_NAME"])
+    parser.add_argument("--mongomock", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    result = asyncio.run(run(args))
+    width = max(len(key) for key in result)
+    for key, value in result.items():
+        print(f"{key:<{width}}  {value}")
+    if args.max_p99_ms is not None and result["api_p99_ms"] > args.max_p99_ms:
+        sys.exit(f"API p99 {result['api_p99_ms']} ms during the burst exceeds {args.max_p99_ms} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""Mongo round trips per operation, legacy access pattern vs current.
+
+    python -m bench.roundtrips --mongomock
+    python -m bench.roundtrips --sends 2000 --latency-ms 20
+
+Wraps the database so every collection call that reaches the server is
+counted, then runs schedule update, retry and the worker's send path both
+the old way (separate reads and writes, one status write per send) and the
+current way (find-and-modify, status writes batched by StatusWriter).
+Runs against MONGO_URL in a throwaway database, or in-process with
+--mongomock (needs mongomock-motor).
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+for name, value in (("GATEWAY_RATE_PER_SEC", "100000"), ("GATEWAY_BURST", "100000"),
+                    ("RECIPIENT_RATE_PER_SEC", "100000"), ("RECIPIENT_BURST", "100000"),
+                    ("MONGO_URL", "mongodb://localhost:27017"), ("DB_NAME", "scheduler_roundtrips")):
+    os.environ.setdefault(name, value)
+
+from background_worker import BackgroundWorker
+from bench.fake_gateway import free_port, start_in_background
+from bench.load_test import open_database
+from bench.seed import seed
+from gateway import gateway
+from models import ScheduleUpdate
+from status_writer import StatusWriter
+
+# Collection methods that cost one round trip each (cursors count once, for the first batch)
+ROUND_TRIP_METHODS = {
+    "find", "find_one", "find_one_and_update", "find_one_and_delete", "find_one_and_replace",
+    "insert_one", "insert_many", "update_one", "update_many", "replace_one", "delete_one",
+    "delete_many", "bulk_write", "count_documents", "aggregate",
+}
+
+class CountingCollection:
+    def __init__(self, collection, counts: Counter):
+        self._collection = collection
+        self._counts = counts
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name in ROUND_TRIP_METHODS:
+            def counted(*args, **kwargs):
+                self._counts[f"{self._collection.name}.{name}"] += 1
+                return attr(*args, **kwargs)
+            return counted
+        return attr
+
+class CountingDatabase:
+    def __init__(self, db):
+        self._db = db
+        self.counts = Counter()
+
+    def __getattr__(self, name):
+        # The app only reaches collections as attributes (db.schedules)
+        if name.startswith("_"):
+            return getattr(self._db, name)
+        return CountingCollection(self._db[name], self.counts)
+
+    def __getitem__(self, name):
+        return CountingCollection(self._db[name], self.counts)
+
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+async def legacy_update(db, schedule_id: str, update: dict) -> dict:
+    """update_schedule before find-and-modify: read, write, read back"""
+    await db.schedules.find_one({"id": schedule_id})
+    await db.schedules.update_one({"id": schedule_id}, {"$set": {**update, "updated_at": datetime.now(timezone.utc)}})
+    return await db.schedules.find_one({"id": schedule_id})
+
+async def legacy_retry(db, schedule_id: str):
+    """retry_schedule before find-and-modify: read, then write"""
+    await db.schedules.find_one({"id": schedule_id})
+    now = datetime.now(timezone.utc)
+    await db.schedules.update_one({"id": schedule_id}, {"$set": {"status": "scheduled", "send_at": now, "attempts": 0, "updated_at": now}})
+
+async def measure(counted: CountingDatabase, label: str, operation, repeat: int) -> dict:
+    counted.counts.clear()
+    for _ in range(repeat):
+        await operation()
+    return {"operation": label, "per_op": counted.total() / repeat, "calls": dict(counted.counts)}
+
+async def measure_sends(counted: CountingDatabase, label: str, count: int, flush_size: int) -> dict:
+    """Send count due schedules through the worker's send path with the given status flush size"""
+    await counted._db.schedules.delete_many({})
+    await seed(counted._db, count, datetime.now(timezone.utc) - timedelta(seconds=1), recipients=count)
+    schedules = await counted._db.schedules.find({}, {"_id": 0, "id": 1, "phone": 1}).to_list(None)
+
+    worker = BackgroundWorker(counted)
+    worker.status_writer = StatusWriter(counted.schedules, flush_size=flush_size)
+    worker.status_writer.start()
+    lanes = asyncio.Semaphore(worker.concurrency)
+
+    async def send(schedule):
+        async with lanes:
+            await worker._send_schedule(schedule)
+
+    counted.counts.clear()
+    await asyncio.gather(*(send(schedule) for schedule in schedules))
+    await worker.status_writer.close()
+    sent = await counted._db.schedules.count_documents({"status": "sent"})
+    return {"operation": label, "per_op": counted.total() / count, "calls": dict(counted.counts), "sent": sent}
+
+async def run(args) -> list:
+    import server
+
+    port = free_port()
+    proc = start_in_background(port, latency_ms=args.latency_ms)
+    gateway.configure([{"url": f"http://127.0.0.1:{port}", "username": "", "password": ""}])
+    client, raw_db = open_database(args)
+    counted = CountingDatabase(raw_db)
+    server.db = counted
+
+    results = []
+    try:
+        await client.drop_database(args.db)
+        await seed(raw_db, 1, datetime.now(timezone.utc) + timedelta(days=1))
+        schedule_id = (await raw_db.schedules.find_one({}, {"id": 1}))["id"]
+        change = {"message_html": "<p>edited</p>", "message_md": "edited"}
+
+        results.append(await measure(counted, "update_schedule (legacy)", lambda: legacy_update(counted, schedule_id, change), args.repeat))
+        results.append(await measure(counted, "update_schedule", lambda: server.update_schedule(schedule_id, ScheduleUpdate(**change)), args.repeat))
+        results.append(await measure(counted, "retry_schedule (legacy)", lambda: legacy_retry(counted, schedule_id), args.repeat))
+        results.append(await measure(counted, "retry_schedule", lambda: server.retry_schedule(schedule_id), args.repeat))
+
+        await gateway.open()
+        try:
+            results.append(await measure_sends(counted, "send (legacy, per-send write)", args.sends, 1))
+            results.append(await measure_sends(counted, "send (batched status writes)", args.sends, args.flush_size))
+        finally:
+            await gateway.close()
+    finally:
+        await client.drop_database(args.db)
+        client.close()
+        proc.terminate()
+        proc.wait()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=100, help="runs of each API operation")
+    parser.add_argument("--sends", type=int, default=500, help="schedules sent through the worker")
+    parser.add_argument("--flush-size", type=int, default=int(os.environ.get("STATUS_FLUSH_SIZE", "100")))
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="fake gateway latency")
+    parser.add_argument("--mongomock", action="store_true", help="in-process mongomock instead of MONGO_URL")
+    parser.add_argument("--db", default="scheduler_roundtrips")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+    results = asyncio.run(run(args))
+
+    print(f"{'operation':34} {'round trips/op':>15}  breakdown")
+    for result in results:
+        breakdown = ", ".join(f"{name} {calls}" for name, calls in sorted(result["calls"].items()))
+        print(f"{result['operation']:34} {result['per_op']:15.2f}  {breakdown}")
+    for result in results:
+        if "sent" in result and result["sent"] != args.sends:
+            sys.exit(f"{result['operation']}: only {result['sent']}/{args.sends} sent")
+
+if __name__ == "__main__":
+    main()
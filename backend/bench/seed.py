@@ -0,0 +1,85 @@
+"""Seed N schedules that all fall due at the same instant.
+
+    python -m bench.seed --count 5000 --in-seconds 10 --images 0.1
+
+Writes straight to MONGO_URL / DB_NAME (the same variables the app reads),
+so a running worker picks them up like any other schedule. Rows spread over
+--recipients distinct phones; --images is the fraction that carry an image
+from the image store.
+"""
+import argparse
+import asyncio
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+from image_store import ImageStore
+
+# A 1x1 PNG is enough to exercise the multipart path
+PIXEL_PNG = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000154a24f5d0000000049454e44ae426082"
+)
+
+def make_schedule(index: int, send_at: datetime, recipients: int, image_id=None) -> dict:
+    now = datetime.now(timezone.utc)
+    return {
+        "id": str(uuid.uuid4()),
+        "phone": f"62812{index % recipients:07d}",
+        "message_html": f"<p><strong>Renungan</strong> #{index}</p>",
+        "message_md": f"*Renungan* #{index}",
+        "image_id": image_id,
+        "image_filename": "pixel.png" if image_id else None,
+        "send_at": send_at,
+        "status": "scheduled",
+        "sent_at": None,
+        "gateway_response": None,
+        "attempts": 0,
+        "created_at": now,
+        "updated_at": now,
+    }
+
+async def seed(db: AsyncIOMotorDatabase, count: int, send_at: datetime, recipients: int = 1000,
+               image_ratio: float = 0.0, batch_size: int = 1000) -> int:
+    """Insert count scheduled rows due at send_at; returns the number inserted"""
+    image_id = await ImageStore(db).put(PIXEL_PNG, filename="pixel.png") if image_ratio > 0 else None
+    image_every = round(1 / image_ratio) if image_ratio > 0 else 0
+
+    inserted = 0
+    batch = []
+    for i in range(count):
+        with_image = image_every and i % image_every == 0
+        batch.append(make_schedule(i, send_at, recipients, image_id if with_image else None))
+        if len(batch) == batch_size:
+            await db.schedules.insert_many(batch, ordered=False)
+            inserted += len(batch)
+            batch = []
+    if batch:
+        await db.schedules.insert_many(batch, ordered=False)
+        inserted += len(batch)
+    return inserted
+
+async def run(args):
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    client = AsyncIOMotorClient(os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    db = client[os.environ.get("DB_NAME", "devotion_scheduler")]
+    send_at = datetime.now(timezone.utc) + timedelta(seconds=args.in_seconds)
+    try:
+        inserted = await seed(db, args.count, send_at, args.recipients, args.images)
+    finally:
+        client.close()
+    print(f"Seeded {inserted} schedules due at {send_at.isoformat()}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=1000)
+    parser.add_argument("--in-seconds", type=float, default=0.0, help="due this many seconds from now")
+    parser.add_argument("--recipients", type=int, default=1000)
+    parser.add_argument("--images", type=float, default=0.0, help="fraction of rows with an image")
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""List endpoint serialization: response_model validation vs the orjson fast path.
+
+    python -m bench.serialization --rows 100 1000 --image-kb 256
+
+Serves the same in-memory schedule documents (legacy rows carrying an inline
+image_base64 of --image-kb) through two minimal FastAPI endpoints, one the
+way get_schedules used to (Schedule(**s) for each row, then response_model
+validation and the stdlib JSON encoder) and one through serialization's
+list_encoder, and prints request latency and peak allocation per request
+for each row count. Both bodies are checked to be the same JSON.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import statistics
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+from typing import List
+
+import httpx
+from fastapi import FastAPI, Response
+
+from models import Schedule
+from serialization import list_encoder, orjson
+
+def make_rows(count: int, image_kb: int) -> List[dict]:
+    image = base64.b64encode(os.urandom(image_kb * 1024)).decode()
+    now = datetime.now(timezone.utc).replace(tzinfo=None)
+    return [{
+        "_id": i,
+        "id": f"00000000-0000-0000-0000-{i:012d}",
+        "phone": "120363291513749102@g.us",
+        "message_html": f"<p><strong>Renungan</strong> hari ke-{i}</p>",
+        "message_md": f"*Renungan* hari ke-{i}",
+        "image_base64": image,
+        "image_filename": "renungan.jpg",
+        "send_at": now + timedelta(days=i),
+        "status": "sent",
+        "sent_at": now + timedelta(days=i, seconds=1),
+        "gateway_response": {"code": "SUCCESS", "message": "Success", "results": {"message_id": f"M{i}"}},
+        "attempts": 1,
+        "worker_id": "bench",
+        "created_at": now,
+        "updated_at": now,
+    } for i in range(count)]
+
+def create_app(rows: List[dict]) -> FastAPI:
+    app = FastAPI()
+    encode = list_encoder(Schedule)
+
+    @app.get("/validated", response_model=List[Schedule])
+    async def validated():
+        # What get_schedules did before the fast path
+        return [Schedule(**s) for s in rows]
+
+    @app.get("/fast")
+    async def fast():
+        return Response(content=encode(rows), media_type="application/json")
+
+    return app
+
+async def measure(client: httpx.AsyncClient, path: str, requests: int):
+    await client.get(path)  # warm up
+    latencies, peaks = [], []
+    for _ in range(requests):
+        tracemalloc.start()
+        started = time.perf_counter()
+        response = await client.get(path)
+        latencies.append((time.perf_counter() - started) * 1000)
+        peaks.append(tracemalloc.get_traced_memory()[1] / (1024 * 1024))
+        tracemalloc.stop()
+        response.raise_for_status()
+    return statistics.median(latencies), statistics.median(peaks), response.content
+
+async def run(args):
+    print(f"{'rows':>6} {'path':<12} {'p50 latency':>12} {'peak alloc':>12}")
+    for count in args.rows:
+        rows = make_rows(count, args.image_kb)
+        transport = httpx.ASGITransport(app=create_app(rows))
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            results = {}
+            for path in ("validated", "fast"):
+                latency, peak, body = await measure(client, f"/{path}", args.requests)
+                results[path] = (latency, body)
+                print(f"{count:>6} {path:<12} {latency:9.1f} ms {peak:9.1f} MB")
+            if json.loads(results["validated"][1]) != json.loads(results["fast"][1]):
+                raise SystemExit(f"fast path output differs from the validated output for {count} rows")
+            print(f"{count:>6} {'speedup':<12} {results['validated'][0] / results['fast'][0]:10.1f} x")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--image-kb", type=int, default=64, help="inline image size per row")
+    parser.add_argument("--requests", type=int, default=5, help="timed requests per endpoint")
+    args = parser.parse_args()
+    if orjson is None:
+        raise SystemExit("orjson is not installed; the fast path falls back to pydantic")
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+"""Capacity planning: replay a day of schedules through BackgroundWorker on a virtual clock.
+
+    python -m bench.simulate --mongomock --count 2000
+    python -m bench.simulate --count 30000 --spike-share 0.95 --gateway-p50-ms 900 --max-lag-seconds 1800
+    python -m bench.simulate --from-export scheduler-backup.ndjson.gz --date 2027-03-11 --speed 30
+
+Runs the real dispatch path (claims, leases, rate limiter, breaker, retries,
+buffered status writes) on a VirtualClock going --speed times faster than
+real time, against a latency-modelled gateway in-process (lognormal latency
+from --gateway-p50-ms/--gateway-p99-ms, an --gateway-error-rate of transient
+503s, --gateway-concurrency sends at a time). Idle stretches are skipped.
+
+The day is synthetic (a --spike-share of --count rows due at --spike-at, the
+rest spread over --window) or the schedules in a backup export, moved onto
+--date at their original Jakarta time of day. Limits come from the usual
+environment (GATEWAY_RATE_PER_SEC, DISPATCH_CONCURRENCY, ...), so try a
+campaign's settings before it runs. Prints backlog over time and send lag
+measured from each row's original send_at; --max-lag-seconds exits non-zero
+when the worst case is over it.
+
+Mongo round trips and CPU take real time, so they count --speed times over
+in simulated time; the report shows the simulated round-trip cost; lower
+--speed if it is not small next to the gateway latency. Runs against
+MONGO_URL in a throwaway database, or in-process with --mongomock, which
+scans every row on each query and so only suits checking the harness itself.
+"""
+import argparse
+import asyncio
+import bisect
+import gzip
+import json
+import logging
+import math
+import random
+import sys
+import time
+import uuid
+from datetime import date, datetime, timedelta, timezone
+
+from dateutil import tz
+
+from background_worker import BackgroundWorker, as_utc
+from bench.load_test import open_database, percentile
+from bench.seed import PIXEL_PNG, make_schedule
+from clock import Clock, VirtualClock
+from image_store import ImageStore
+from indexes import ensure_indexes
+from recurrences import DEFAULT_TIMEZONE
+
+LOCAL = tz.gettz(DEFAULT_TIMEZONE)
+
+class SimulatedGateway:
+    """Stand-in for the gateway pool whose latency passes on the simulation clock"""
+
+    def __init__(self, clock: Clock, p50_ms: float, p99_ms: float, image_ms: float = 0.0,
+                 error_rate: float = 0.0, concurrency: int = 8):
+        self.clock = clock
+        # Lognormal through the given median and 99th percentile
+        self.mu = math.log(p50_ms / 1000)
+        self.sigma = math.log(max(p99_ms, p50_ms) / p50_ms) / 2.326
+        self.image_seconds = image_ms / 1000
+        self.error_rate = error_rate
+        self.slots = asyncio.Semaphore(concurrency)
+        self.calls = 0
+        self.errors = 0
+
+    async def _send(self, extra: float) -> dict:
+        async with self.slots:
+            await self.clock.sleep(random.lognormvariate(self.mu, self.sigma) + extra)
+        self.calls += 1
+        if random.random() < self.error_rate:
+            self.errors += 1
+            return {"code": "ERROR", "message": "simulated gateway error", "results": {},
+                    "status_code": 503, "transient": True}
+        return {"code": "SUCCESS", "message": "Success", "results": {"message_id": uuid.uuid4().hex.upper()}}
+
+    async def send_text_message(self, phone: str, message: str) -> dict:
+        return await self._send(0.0)
+
+    async def send_image_message(self, phone: str, image_bytes: bytes, filename: str, caption: str = "",
+                                 content_type=None) -> dict:
+        return await self._send(self.image_seconds)
+
+def local_time(day: date, hhmm: str) -> datetime:
+    hour, minute = (int(part) for part in hhmm.split(":"))
+    return datetime(day.year, day.month, day.day, hour, minute, tzinfo=LOCAL).astimezone(timezone.utc)
+
+def synthetic_day(args, day: date, image_id) -> list:
+    start, end, spike = (local_time(day, t) for t in (*args.window, args.spike_at))
+    spread = (end - start).total_seconds()
+    image_every = round(1 / args.images) if args.images > 0 else 0
+    rows = []
+    for i in range(args.count):
+        if random.random() < args.spike_share:
+            send_at = spike
+        else:
+            send_at = start + timedelta(seconds=random.uniform(0, spread))
+        rows.append(make_schedule(i, send_at, args.recipients, image_id if image_every and i % image_every == 0 else None))
+    return rows
+
+def recorded_day(args, day: date, image_id) -> list:
+    """Schedules from a backup export, moved onto day at the same local time of day"""
+    start, end = (local_time(day, t) for t in args.window)
+    opener = gzip.open if args.from_export.endswith(".gz") else open
+    rows = []
+    with opener(args.from_export, "rt", encoding="utf-8") as export:
+        for i, line in enumerate(export):
+            record = json.loads(line)
+            if record.get("type") != "schedule" or not record.get("send_at"):
+                continue
+            original = as_utc(datetime.fromisoformat(record["send_at"])).astimezone(LOCAL)
+            send_at = original.replace(year=day.year, month=day.month, day=day.day).astimezone(timezone.utc)
+            if not start <= send_at <= end:
+                continue
+            with_image = record.get("image_id") or record.get("image_base64")
+            row = make_schedule(i, send_at, args.recipients, image_id if with_image else None)
+            row.update(phone=record.get("phone") or row["phone"], message_md=record.get("message_md") or row["message_md"])
+            rows.append(row)
+    return rows
+
+async def round_trip_ms(db, samples: int = 20) -> float:
+    timings = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        await db.schedules.find_one({"id": "none"})
+        timings.append((time.perf_counter() - started) * 1000)
+    return sorted(timings)[len(timings) // 2]
+
+async def run(args) -> dict:
+    day = date.fromisoformat(args.date) if args.date else datetime.now(LOCAL).date() + timedelta(days=1)
+    client, db = open_database(args)
+    try:
+        await client.drop_database(args.db)
+        await ensure_indexes(db)
+        image_id = await ImageStore(db).put(PIXEL_PNG, filename="pixel.png")
+        rows = recorded_day(args, day, image_id) if args.from_export else synthetic_day(args, day, image_id)
+        if not rows:
+            sys.exit("no schedules fall inside the window")
+        for i in range(0, len(rows), 1000):
+            await db.schedules.insert_many(rows[i:i + 1000], ordered=False)
+        intended = {row["id"]: row["send_at"] for row in rows}
+        due_times = sorted(intended.values())
+        rtt_ms = await round_trip_ms(db)
+
+        clock = VirtualClock(min(due_times) - timedelta(seconds=args.lead_seconds), args.speed)
+        gateway = SimulatedGateway(clock, args.gateway_p50_ms, args.gateway_p99_ms, args.gateway_image_ms,
+                                   args.gateway_error_rate, args.gateway_concurrency)
+        worker = BackgroundWorker(db, clock=clock, gateway_client=gateway)
+        finished = 0
+
+        def on_event(event):
+            nonlocal finished
+            if event["status"] in ("sent", "failed"):
+                finished += 1
+
+        worker.add_listener(on_event)
+        samples = []
+        next_sample = clock.now()
+        deadline = max(due_times) + timedelta(hours=args.max_hours)
+        started = time.perf_counter()
+        await worker.start()
+        try:
+            while finished < len(rows) and clock.now() < deadline:
+                await asyncio.sleep(0.01)
+                now = clock.now()
+                due = bisect.bisect_right(due_times, now)
+                if now >= next_sample:
+                    samples.append({"at": now, "due": due, "done": finished, "backlog": due - finished,
+                                    "queued": worker.queue_depth()})
+                    next_sample = now + timedelta(seconds=args.sample_seconds)
+                # Nothing outstanding: jump to just before the next deadline
+                if due == finished and worker.queue_depth() == 0 and due < len(due_times):
+                    gap = (due_times[due] - now).total_seconds() - 1
+                    if gap > 1:
+                        clock.advance(gap)
+                        worker.reload()
+        finally:
+            await worker.stop()
+        real_seconds = time.perf_counter() - started
+        simulated_seconds = clock.monotonic()
+        ended_at = clock.now()
+        samples.append({"at": ended_at, "due": bisect.bisect_right(due_times, ended_at), "done": finished,
+                        "backlog": bisect.bisect_right(due_times, ended_at) - finished, "queued": worker.queue_depth()})
+
+        results = await db.schedules.find({}, {"_id": 0, "id": 1, "status": 1, "sent_at": 1, "attempts": 1}).to_list(None)
+    finally:
+        await client.drop_database(args.db)
+        client.close()
+
+    lags = sorted((as_utc(row["sent_at"]) - intended[row["id"]]).total_seconds()
+                  for row in results if row.get("status") == "sent" and row.get("sent_at"))
+    peak = max(samples, key=lambda sample: sample["backlog"])
+    last_sent = max((as_utc(row["sent_at"]) for row in results if row.get("sent_at")), default=None)
+    return {
+        "day": day.isoformat(),
+        "count": len(rows),
+        "sent": sum(1 for row in results if row.get("status") == "sent"),
+        "failed": sum(1 for row in results if row.get("status") == "failed"),
+        "unfinished": sum(1 for row in results if row.get("status") in ("scheduled", "sending")),
+        "retried": sum(1 for row in results if (row.get("attempts") or 0) > 1),
+        "lag_p50_s": round(percentile(lags, 0.50), 1),
+        "lag_p95_s": round(percentile(lags, 0.95), 1),
+        "lag_p99_s": round(percentile(lags, 0.99), 1),
+        "lag_max_s": round(lags[-1], 1) if lags else 0.0,
+        "peak_backlog": peak["backlog"],
+        "peak_backlog_at": peak["at"].astimezone(LOCAL).strftime("%H:%M:%S"),
+        "last_sent_at": last_sent.astimezone(LOCAL).strftime("%H:%M:%S") if last_sent else None,
+        "gateway_calls": gateway.calls,
+        "gateway_errors": gateway.errors,
+        "speed": args.speed,
+        "real_s": round(real_seconds, 1),
+        "simulated_s": round(simulated_seconds, 1),
+        "mongo_round_trip_ms_simulated": round(rtt_ms * args.speed, 1),
+        "backlog": [{**sample, "at": sample["at"].astimezone(LOCAL).strftime("%H:%M:%S")} for sample in samples],
+    }
+
+def print_report(result: dict):
+    print(f"{result['day']}: {result['sent']}/{result['count']} sent, {result['failed']} failed, "
+          f"{result['unfinished']} unfinished, {result['retried']} retried")
+    print(f"{'time (WIB)':>10} {'due':>8} {'done':>8} {'backlog':>8} {'queued':>7}")
+    previous = None
+    for sample in result["backlog"]:
+        # Only the stretches with a backlog, each followed by the sample it cleared in
+        if previous is None or sample["backlog"] or previous["backlog"]:
+            print(f"{sample['at']:>10} {sample['due']:8} {sample['done']:8} {sample['backlog']:8} {sample['queued']:7}")
+        previous = sample
+    print(f"peak backlog {result['peak_backlog']} at {result['peak_backlog_at']}, last send at {result['last_sent_at']}")
+    print(f"send lag     p50 {result['lag_p50_s']} s   p95 {result['lag_p95_s']} s   "
+          f"p99 {result['lag_p99_s']} s   max {result['lag_max_s']} s")
+    print(f"gateway      {result['gateway_calls']} calls, {result['gateway_errors']} errors")
+    print(f"simulation   {result['simulated_s']} s simulated in {result['real_s']} s at {result['speed']}x; "
+          f"a Mongo round trip counts as {result['mongo_round_trip_ms_simulated']} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--count", type=int, default=2000, help="synthetic schedules")
+    parser.add_argument("--spike-at", default="05:00", help="local time the synthetic spike is due")
+    parser.add_argument("--spike-share", type=float, default=0.9, help="fraction of synthetic rows in the spike")
+    parser.add_argument("--window", nargs=2, default=["04:30", "08:00"], metavar=("START", "END"),
+                        help="local time span the rest of the day is spread over (or exported rows are taken from)")
+    parser.add_argument("--from-export", help="replay the schedules in this backup export (.ndjson or .ndjson.gz)")
+    parser.add_argument("--date", help="simulated day, YYYY-MM-DD (default tomorrow)")
+    parser.add_argument("--recipients", type=int, default=1000)
+    parser.add_argument("--images", type=float, default=0.0, help="fraction of synthetic rows with an image")
+    parser.add_argument("--gateway-p50-ms", type=float, default=400.0)
+    parser.add_argument("--gateway-p99-ms", type=float, default=2500.0)
+    parser.add_argument("--gateway-image-ms", type=float, default=1500.0, help="extra latency for image sends")
+    parser.add_argument("--gateway-error-rate", type=float, default=0.0, help="share of transient 503s")
+    parser.add_argument("--gateway-concurrency", type=int, default=8, help="sends the gateway handles at once")
+    parser.add_argument("--speed", type=float, default=60.0, help="simulated seconds per real second")
+    parser.add_argument("--lead-seconds", type=float, default=60.0, help="start this long before the first row is due")
+    parser.add_argument("--sample-seconds", type=float, default=60.0, help="backlog sampling interval (simulated)")
+    parser.add_argument("--max-hours", type=float, default=6.0, help="give up this long after the last row is due")
+    parser.add_argument("--max-lag-seconds", type=float, help="exit non-zero if the worst send lag exceeds this")
+    parser.add_argument("--mongomock", action="store_true", help="in-process mongomock instead of MONGO_URL")
+    parser.add_argument("--db", default="scheduler_simulation")
+    parser.add_argument("--json", action="store_true", help="print the result as JSON")
+    parser.add_argument("--verbose", action="store_true", help="show worker warnings")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING if args.verbose else logging.CRITICAL)
+    result = asyncio.run(run(args))
+    breaches = []
+    if result["unfinished"]:
+        breaches.append(f"{result['unfinished']} schedules still unsent {args.max_hours} h after the last was due")
+    if args.max_lag_seconds is not None and result["lag_max_s"] > args.max_lag_seconds:
+        breaches.append(f"worst send lag {result['lag_max_s']} s > {args.max_lag_seconds} s")
+
+    if args.json:
+        print(json.dumps({**result, "breaches": breaches}))
+    else:
+        print_report(result)
+        for breach in breaches:
+            print(f"FAIL {breach}")
+    sys.exit(1 if breaches else 0)
+
+if __name__ == "__main__":
+    main()
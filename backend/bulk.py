@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Tuple
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import BulkWriteError
+
+import idempotency
+from markdown_converter import convert_batch
+
+logger = logging.getLogger(__name__)
+
+# Large batches (a year of daily devotions and up) are converted in worker
+# processes and inserted in unordered chunks, so one bad row never sinks the
+# rest and the event loop keeps serving requests.
+BULK_CHUNK_SIZE = int(os.environ.get('BULK_CHUNK_SIZE', '500'))
+BULK_OFFLOAD_THRESHOLD = int(os.environ.get('BULK_OFFLOAD_THRESHOLD', '200'))
+BULK_CONVERT_WORKERS = int(os.environ.get('BULK_CONVERT_WORKERS', str(min(4, os.cpu_count() or 1))))
+MAX_NDJSON_LINE_BYTES = 32 * 1024 * 1024
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # spawn, not fork: the API process holds Mongo client threads
+        _executor = ProcessPoolExecutor(
+            max_workers=BULK_CONVERT_WORKERS,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+    return _executor
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+async def convert_many(htmls: List[str]) -> List[str]:
+    """HTML -> WhatsApp markdown for a batch, off the event loop when the batch is big"""
+    if len(htmls) < BULK_OFFLOAD_THRESHOLD:
+        return convert_batch(htmls)
+
+    loop = asyncio.get_running_loop()
+    executor = _get_executor()
+    size = max(1, len(htmls) // BULK_CONVERT_WORKERS + 1)
+    parts = await asyncio.gather(*(
+        loop.run_in_executor(executor, convert_batch, htmls[i:i + size])
+        for i in range(0, len(htmls), size)
+    ))
+    return [markdown for part in parts for markdown in part]
+
+def new_schedule_doc(data: dict, markdown: str, now: datetime) -> dict:
+    """Schedule document straight from validated ScheduleCreate data (no second model pass)"""
+    doc = {k: v for k, v in data.items() if k not in ('image_base64', 'idempotency_key')}
+    doc.update(
+        id=str(uuid.uuid4()),
+        message_md=markdown,
+        status="scheduled",
+        sent_at=None,
+        gateway_response=None,
+        attempts=0,
+        created_at=now,
+        updated_at=now
+    )
+    return doc
+
+async def insert_unordered(db: AsyncIOMotorDatabase, docs: List[dict]) -> dict:
+    """insert_many(ordered=False); returns {position in docs: error message} for failed rows"""
+    if not docs:
+        return {}
+    try:
+        await db.schedules.insert_many(docs, ordered=False)
+        return {}
+    except BulkWriteError as e:
+        return {err["index"]: err.get("errmsg", "write error") for err in e.details.get("writeErrors", [])}
+
+async def create_chunk(
+    db: AsyncIOMotorDatabase,
+    chunk: List[Tuple[int, dict]],
+    store_image: Callable[[dict], Awaitable[dict]],
+    on_created: Callable[[dict], Awaitable[None]]
+) -> Tuple[List[dict], List[dict]]:
+    """Create one chunk of (item index, ScheduleCreate data) pairs.
+
+    Items with an idempotency_key that an earlier request already created
+    are not written again; the schedule stored with the key comes back
+    instead (status "replayed") and is not dispatched a second time.
+    Returns (created or replayed documents, per-item results), both in input order.
+    """
+    results = {}
+    documents = {}  # item index -> created or replayed schedule
+    keys = await _claim_keys(db, chunk, results, documents)
+    todo = [(index, data) for index, data in chunk if index not in results]
+
+    created = []
+    try:
+        markdowns = await convert_many([data["message_html"] for _, data in todo])
+        now = datetime.now(timezone.utc)
+
+        pending = []  # (item index, doc)
+        for (index, data), markdown in zip(todo, markdowns):
+            try:
+                await store_image(data)
+                pending.append((index, new_schedule_doc(data, markdown, now)))
+            except Exception as e:
+                results[index] = {"index": index, "status": "error", "error": str(e)}
+
+        errors = await insert_unordered(db, [doc for _, doc in pending])
+
+        for position, (index, doc) in enumerate(pending):
+            if position in errors:
+                results[index] = {"index": index, "status": "error", "error": errors[position]}
+            else:
+                created.append(doc)
+                documents[index] = doc
+                results[index] = {"index": index, "status": "created", "id": doc["id"]}
+    finally:
+        # Keys of items that did not make it are freed for a retry
+        await idempotency.release_many(db, idempotency.SCHEDULES,
+                                       [key for index, key in keys.items() if index not in documents])
+    await idempotency.complete_many(db, idempotency.SCHEDULES, {
+        key: {k: v for k, v in documents[index].items() if k != "_id"}
+        for index, key in keys.items() if index in documents
+    })
+
+    for doc in created:
+        await on_created(doc)
+
+    return [documents[index] for index, _ in chunk if index in documents], [results[index] for index, _ in chunk]
+
+async def _claim_keys(db: AsyncIOMotorDatabase, chunk: List[Tuple[int, dict]], results: dict, documents: dict):
+    """Claim the chunk's idempotency keys in one round trip; replays and conflicts go straight into results.
+
+    Returns {item index: key} for the keyed items still to create.
+    """
+    keys, fingerprints = {}, {}
+    for index, data in chunk:
+        key = data.get("idempotency_key")
+        if key is None:
+            continue
+        if not idempotency.valid_key(key) or key in fingerprints:
+            results[index] = {"index": index, "status": "error", "error": "invalid or repeated idempotency_key"}
+            continue
+        keys[index] = key
+        fingerprints[key] = idempotency.fingerprint({k: v for k, v in data.items() if k != "idempotency_key"})
+
+    earlier = await idempotency.begin_many(db, idempotency.SCHEDULES, fingerprints)
+    for index, key in list(keys.items()):
+        record = earlier.get(key)
+        if record is None:
+            continue
+        del keys[index]
+        problem = idempotency.conflict(record, fingerprints[key])
+        if problem:
+            results[index] = {"index": index, "status": "error", "error": problem[1]}
+        else:
+            documents[index] = record["response"]
+            results[index] = {"index": index, "status": "replayed", "id": record["response"]["id"]}
+    return keys
+
+async def iter_ndjson_lines(stream: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, bytes]]:
+    """(1-based line number, line) for each non-blank line of a streamed NDJSON body"""
+    buffer = b""
+    line_no = 0
+    async for chunk in stream:
+        buffer += chunk
+        if len(buffer) > MAX_NDJSON_LINE_BYTES and b"\n" not in buffer:
+            raise ValueError(f"NDJSON line {line_no + 1} exceeds {MAX_NDJSON_LINE_BYTES} bytes")
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            line_no += 1
+            if line.strip():
+                yield line_no, line
+    if buffer.strip():
+        yield line_no + 1, buffer
@@ -0,0 +1,88 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+from fastapi import Request, Response
+
+class CachedBody:
+    __slots__ = ("body", "etag", "headers", "expires", "generations")
+
+    def __init__(self, body: bytes, headers: Dict[str, str], expires: float, generations: Tuple[Tuple[str, int], ...]):
+        self.body = body
+        self.etag = '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+        self.headers = headers
+        self.expires = expires
+        self.generations = generations
+
+    def response(self, request: Request) -> Response:
+        """The cached JSON body, or a bodiless 304 when the client already has it"""
+        headers = {**self.headers, "ETag": self.etag, "Cache-Control": "no-cache"}
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match and self.etag in {tag.strip() for tag in if_none_match.split(",")}:
+            return Response(status_code=304, headers=headers)
+        return Response(content=self.body, media_type="application/json", headers=headers)
+
+class ResponseCache:
+    """TTL + LRU cache of serialized read responses, invalidated by tag generations.
+
+    Each entry records the generation of every tag it depends on (a status,
+    a schedule id, or "all"). A write bumps the generations of the tags it
+    touches, which retires exactly the entries that could have changed,
+    without scanning the cache.
+    """
+
+    def __init__(self, ttl: Optional[float] = None, max_entries: Optional[int] = None):
+        self.ttl = ttl if ttl is not None else float(os.environ.get('CACHE_TTL_SECONDS', '30'))
+        self.max_entries = max_entries if max_entries is not None else int(os.environ.get('CACHE_MAX_ENTRIES', '256'))
+        self.max_body_bytes = int(os.environ.get('CACHE_MAX_BODY_BYTES', str(2 * 1024 * 1024)))
+        self.entries: "OrderedDict[tuple, CachedBody]" = OrderedDict()
+        self.tags: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.ttl > 0 and self.max_entries > 0
+
+    def get(self, key: tuple) -> Optional[CachedBody]:
+        entry = self.entries.get(key)
+        if entry is not None:
+            if entry.expires > time.monotonic() and all(self.tags.get(tag, 0) == gen for tag, gen in entry.generations):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            del self.entries[key]
+        self.misses += 1
+        return None
+
+    def snapshot(self, tags: Iterable[str]) -> Tuple[Tuple[str, int], ...]:
+        """Tag generations to store with an entry; take it before reading, so a write racing the read wins"""
+        return tuple((tag, self.tags.get(tag, 0)) for tag in ("epoch", *tags))
+
+    def put(self, key: tuple, generations: Tuple[Tuple[str, int], ...], body: bytes,
+            headers: Optional[Dict[str, str]] = None) -> CachedBody:
+        entry = CachedBody(body, headers or {}, time.monotonic() + self.ttl, generations)
+        if self.enabled and len(body) <= self.max_body_bytes:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, schedule_id: Optional[str] = None, statuses: Iterable[Optional[str]] = ()):
+        """Retire entries for one schedule, lists filtered by the given statuses, and unfiltered lists"""
+        for tag in ["all", *(f"status:{s}" for s in statuses if s), *([f"schedule:{schedule_id}"] if schedule_id else [])]:
+            self.tags[tag] = self.tags.get(tag, 0) + 1
+        if len(self.tags) > 16 * max(self.max_entries, 64):
+            # Per-schedule tags accumulate; starting over keeps them bounded
+            self.clear()
+
+    def clear(self):
+        """Drop everything (bulk rewrites such as imports); the epoch also retires in-flight reads"""
+        self.tags = {"epoch": self.tags.get("epoch", 0) + 1}
+        self.entries.clear()
+
+    def stats(self) -> dict:
+        return {"entries": len(self.entries), "hits": self.hits, "misses": self.misses, "ttl_seconds": self.ttl}
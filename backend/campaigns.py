@@ -0,0 +1,69 @@
+import re
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional
+
+# A campaign stores its message and image once and fans out to its
+# recipients at send time. Per-recipient delivery state lives in the
+# recipients array itself and is written back in batches, so a campaign
+# to 40 groups is one document and a handful of writes, not 40 schedules
+# each carrying the image.
+
+PENDING = "pending"
+SENT = "sent"
+FAILED = "failed"
+
+VARIABLE_RE = re.compile(r"\{\{\s*([A-Za-z_][A-Za-z0-9_]*)\s*\}\}")
+
+def render_message(template: str, variables: Dict[str, str], defaults: Optional[Dict[str, str]] = None) -> str:
+    """Fill {{name}} placeholders from the recipient's vars, then the campaign's; unknown ones become empty"""
+    if "{{" not in template:
+        return template
+
+    def replace(match):
+        name = match.group(1)
+        if name in variables:
+            return str(variables[name])
+        if defaults and name in defaults:
+            return str(defaults[name])
+        return ""
+
+    return VARIABLE_RE.sub(replace, template)
+
+def new_recipient(phone: str, variables: Optional[Dict[str, str]] = None) -> dict:
+    recipient = {"phone": phone, "status": PENDING, "attempts": 0}
+    if variables:
+        recipient["vars"] = variables
+    return recipient
+
+def new_campaign_doc(data: dict, markdown: str, now: datetime) -> dict:
+    """Campaign document from validated CampaignCreate data"""
+    recipients = [new_recipient(r["phone"], r.get("vars")) for r in data["recipients"]]
+    return {
+        "id": str(uuid.uuid4()),
+        "name": data.get("name") or "",
+        "message_html": data["message_html"],
+        "message_md": markdown,
+        "vars": data.get("vars") or {},
+        "image_id": data.get("image_id"),
+        "image_filename": data.get("image_filename"),
+        "send_at": data["send_at"],
+        "status": "scheduled",
+        "recipients": recipients,
+        "counts": {"total": len(recipients), PENDING: len(recipients), SENT: 0, FAILED: 0},
+        "attempts": 0,
+        "sent_at": None,
+        "created_at": now,
+        "updated_at": now,
+    }
+
+def final_status(counts: Dict[str, int]) -> str:
+    """Campaign status once nothing is pending: sent, failed, or partial"""
+    if counts.get(FAILED, 0) == 0:
+        return "sent"
+    if counts.get(SENT, 0) == 0:
+        return "failed"
+    return "partial"
+
+def pending_indexes(recipients: List[dict]) -> List[int]:
+    return [i for i, r in enumerate(recipients) if r.get("status", PENDING) == PENDING]
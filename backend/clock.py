@@ -0,0 +1,55 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+
+# The worker reads the time and sleeps only through a Clock, so a simulation
+# can run the real dispatch code on an accelerated clock (bench/simulate.py)
+# while production keeps using the system one.
+
+class Clock:
+    """System time"""
+
+    speed = 1.0
+
+    def now(self) -> datetime:
+        return datetime.now(timezone.utc)
+
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    async def sleep(self, seconds: float):
+        await asyncio.sleep(seconds)
+
+    async def wait_for(self, awaitable, timeout: float):
+        return await asyncio.wait_for(awaitable, timeout)
+
+class VirtualClock(Clock):
+    """Simulated time that starts at start and runs speed times faster than real time.
+
+    advance() jumps ahead over an idle stretch; tasks already asleep are not
+    woken by it. Real work (Mongo round trips, CPU) looks speed times slower
+    in simulated time, so keep speed low enough for that to stay small.
+    """
+
+    def __init__(self, start: datetime, speed: float = 60.0):
+        self.start = start
+        self.speed = speed
+        self._origin = time.monotonic()
+        self._skipped = 0.0
+
+    def monotonic(self) -> float:
+        return (time.monotonic() - self._origin) * self.speed + self._skipped
+
+    def now(self) -> datetime:
+        return self.start + timedelta(seconds=self.monotonic())
+
+    def advance(self, seconds: float):
+        self._skipped += max(0.0, seconds)
+
+    async def sleep(self, seconds: float):
+        await asyncio.sleep(max(0.0, seconds) / self.speed)
+
+    async def wait_for(self, awaitable, timeout: float):
+        return await asyncio.wait_for(awaitable, None if timeout is None else max(0.0, timeout) / self.speed)
+
+SYSTEM_CLOCK = Clock()
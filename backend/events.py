@@ -0,0 +1,202 @@
+import asyncio
+import json
+import logging
+import os
+from datetime import datetime
+from typing import AsyncIterator, Callable, Optional, Set
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import OperationFailure, PyMongoError
+
+try:
+    import orjson
+except ImportError:  # optional: events are tiny, json is fine without it
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# Live status events for the dashboard (GET /api/events, server-sent events).
+# Every status change is encoded once and the same bytes are handed to each
+# connected client's bounded queue, so an open dashboard costs a queue slot
+# per event and no database reads. A client that falls EVENT_QUEUE_SIZE
+# events behind is disconnected instead of slowing the publisher down; its
+# EventSource reconnects and reloads the lists.
+#
+# Events come from the embedded worker's listeners and the CRUD handlers, or,
+# when the worker runs as a separate process (EMBEDDED_WORKER=false), from a
+# change stream on schedules (StatusFeed). Events carry the new state, so a
+# change reported twice is harmless.
+
+EVENT_QUEUE_SIZE = int(os.environ.get('EVENT_QUEUE_SIZE', '256'))
+EVENT_HEARTBEAT_SECONDS = float(os.environ.get('EVENT_HEARTBEAT_SECONDS', '15'))
+
+STATUS = "status"
+# Many rows changed at once (bulk create, import): reload instead of patching
+RELOAD = "reload"
+
+def gateway_error(result) -> Optional[str]:
+    """Short error text from a stored gateway_response"""
+    if not isinstance(result, dict):
+        return None
+    error = result.get("message") or result.get("error") or result.get("code")
+    return str(error) if error is not None else None
+
+def status_event(schedule_id: str, status: str, previous: Optional[str] = None,
+                 sent_at: Optional[datetime] = None, error: Optional[str] = None) -> dict:
+    """The compact event dashboards get; previous is None when unknown (or for inserts)"""
+    return {"id": schedule_id, "status": status, "previous": previous, "sent_at": sent_at, "error": error}
+
+def _dumps(data: dict) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_UTC_Z)
+    return json.dumps(data, default=lambda value: value.isoformat()).encode()
+
+def encode(kind: str, data: dict) -> bytes:
+    return b"event: " + kind.encode() + b"\ndata: " + _dumps(data) + b"\n\n"
+
+class Subscriber:
+    def __init__(self, size: int):
+        self.queue = asyncio.Queue(maxsize=size)
+        self.dropped = False
+
+class Broadcaster:
+    """Fans events out to every connected client without ever blocking the publisher"""
+
+    def __init__(self, queue_size: int = EVENT_QUEUE_SIZE, heartbeat_seconds: float = EVENT_HEARTBEAT_SECONDS):
+        self.queue_size = queue_size
+        self.heartbeat_seconds = heartbeat_seconds
+        self._subscribers: Set[Subscriber] = set()
+        self.published = 0
+        self.dropped = 0
+
+    def publish(self, kind: str, data: dict):
+        """Queue one event for every client; synchronous, so worker listeners can call it"""
+        if not self._subscribers:
+            return
+        message = encode(kind, data)
+        self.published += 1
+        for subscriber in list(self._subscribers):
+            try:
+                subscriber.queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # Too slow to keep up: cut it loose, it reloads on reconnect
+                self._subscribers.discard(subscriber)
+                subscriber.dropped = True
+                self.dropped += 1
+                subscriber.queue.get_nowait()
+                subscriber.queue.put_nowait(None)
+
+    def publish_status(self, event: dict):
+        """Worker listener: forward a status change (see BackgroundWorker.add_listener)"""
+        if event.get("type", "schedule") == "schedule":
+            self.publish(STATUS, status_event(event["id"], event["status"], event.get("previous"),
+                                              event.get("sent_at"), event.get("error")))
+
+    async def stream(self) -> AsyncIterator[bytes]:
+        """The SSE body for one client; ends when the client is dropped or disconnects"""
+        subscriber = Subscriber(self.queue_size)
+        self._subscribers.add(subscriber)
+        try:
+            # Tell EventSource how long to wait before reconnecting
+            yield b"retry: 3000\n\n"
+            while True:
+                try:
+                    message = await asyncio.wait_for(subscriber.queue.get(), self.heartbeat_seconds)
+                except asyncio.TimeoutError:
+                    # Keeps proxies from closing an idle connection
+                    yield b": ping\n\n"
+                    continue
+                if message is None:
+                    return
+                yield message
+        finally:
+            self._subscribers.discard(subscriber)
+
+    def stats(self) -> dict:
+        return {
+            "clients": len(self._subscribers),
+            "published": self.published,
+            "dropped_clients": self.dropped,
+        }
+
+class StatusFeed:
+    """Publishes status changes made by other processes, read from a change stream on schedules.
+
+    Needs a replica set (or sharded cluster). Resumes after the last event it
+    saw when the stream breaks; on a standalone server it logs once and stops.
+    on_change is called with the schedule id before each event goes out, so
+    caches can drop what the event makes stale.
+    """
+
+    PIPELINE = [
+        {"$match": {"$or": [
+            {"operationType": "update", "updateDescription.updatedFields.status": {"$exists": True}},
+            # The worker materializes recurring occurrences straight into schedules
+            {"operationType": "insert", "fullDocument.recurrence_id": {"$exists": True}},
+        ]}},
+        {"$project": {
+            "fullDocument.id": 1,
+            "fullDocument.status": 1,
+            "fullDocument.sent_at": 1,
+            "fullDocument.gateway_response.code": 1,
+            "fullDocument.gateway_response.message": 1,
+            "fullDocument.gateway_response.error": 1,
+        }},
+    ]
+
+    def __init__(self, db: AsyncIOMotorDatabase, broadcaster: Broadcaster,
+                 on_change: Optional[Callable[[str], None]] = None):
+        self.db = db
+        self.broadcaster = broadcaster
+        self.on_change = on_change
+        self._task = None
+        self._resume_token = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        delay = 1.0
+        while True:
+            try:
+                # updateLookup costs one read per change, shared by every client
+                async with self.db.schedules.watch(self.PIPELINE, full_document="updateLookup",
+                                                   resume_after=self._resume_token) as stream:
+                    logger.info("Status feed: watching schedules")
+                    delay = 1.0
+                    async for change in stream:
+                        self._resume_token = stream.resume_token
+                        self._publish(change)
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                if e.code == 40573:
+                    logger.warning("Status feed: change streams need a replica set; live events only cover this process")
+                    return
+                if e.code == 286:
+                    # Resume point fell off the oplog: start from now
+                    self._resume_token = None
+                logger.error(f"Status feed error, restarting in {delay:.0f}s: {e}")
+            except PyMongoError as e:
+                logger.error(f"Status feed error, restarting in {delay:.0f}s: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60.0)
+
+    def _publish(self, change: dict):
+        doc = change.get("fullDocument")
+        if not doc or not doc.get("id"):
+            return  # deleted before the lookup; the delete handler announced it
+        if self.on_change:
+            # Before publishing: dashboards refetch as soon as they hear about it
+            self.on_change(doc["id"])
+        self.broadcaster.publish(STATUS, status_event(
+            doc["id"], doc.get("status"), sent_at=doc.get("sent_at"),
+            error=None if doc.get("status") == "sent" else gateway_error(doc.get("gateway_response"))
+        ))
@@ -1,40 +1,138 @@
+import asyncio
+import hashlib
 import httpx
+import json
+import math
 import os
 import logging
-from typing import Optional, Dict, Any
+import time
+from collections import OrderedDict
+from typing import Optional, Dict, Any, List
+from urllib.parse import urlparse
+
+from metrics import GATEWAY_LATENCY
 
 logger = logging.getLogger(__name__)
 
 class WhatsAppGateway:
-    def __init__(self):
-        self.base_url = os.environ.get('GATEWAY_BASE_URL', 'http://dermapack.net:3001')
-        self.username = os.environ.get('GATEWAY_USER', '')
-        self.password = os.environ.get('GATEWAY_PASS', '')
+    def __init__(self, base_url: Optional[str] = None, username: Optional[str] = None, password: Optional[str] = None):
+        self.base_url = base_url or os.environ.get('GATEWAY_BASE_URL', 'http://dermapack.net:3001')
+        self.username = username if username is not None else os.environ.get('GATEWAY_USER', '')
+        self.password = password if password is not None else os.environ.get('GATEWAY_PASS', '')
+
+        # One long-lived client per process: keep-alive connections are reused
+        # across sends instead of paying a TCP (and TLS) handshake per message.
+        self.max_connections = int(os.environ.get('GATEWAY_MAX_CONNECTIONS', '20'))
+        self.max_keepalive = int(os.environ.get('GATEWAY_MAX_KEEPALIVE', '10'))
+        self.keepalive_expiry = float(os.environ.get('GATEWAY_KEEPALIVE_EXPIRY', '30'))
+        self.http2 = os.environ.get('GATEWAY_HTTP2', 'false').lower() == 'true'
+        self.connect_timeout = float(os.environ.get('GATEWAY_CONNECT_TIMEOUT', '5'))
+        self.read_timeout = float(os.environ.get('GATEWAY_READ_TIMEOUT', '30'))
+        self.image_read_timeout = float(os.environ.get('GATEWAY_IMAGE_READ_TIMEOUT', '60'))
+        self._client: Optional[httpx.AsyncClient] = None
         
     def _get_auth(self) -> Optional[httpx.BasicAuth]:
         if self.username and self.password:
             return httpx.BasicAuth(self.username, self.password)
         return None
     
+    def _timeout(self, read: float) -> httpx.Timeout:
+        return httpx.Timeout(read, connect=self.connect_timeout)
+
+    async def open(self):
+        """Create the shared connection pool (called from the startup hook)"""
+        if self._client is not None:
+            return
+
+        http2 = self.http2
+        if http2:
+            try:
+                import h2  # noqa: F401 - optional, only needed for HTTP/2
+            except ImportError:
+                logger.warning("GATEWAY_HTTP2 is set but the 'h2' package is missing, using HTTP/1.1")
+                http2 = False
+
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            auth=self._get_auth(),
+            http2=http2,
+            timeout=self._timeout(self.read_timeout),
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_keepalive,
+                keepalive_expiry=self.keepalive_expiry
+            )
+        )
+        logger.info(f"Gateway client opened for {self.base_url} (http2={http2}, max_connections={self.max_connections})")
+
+    async def close(self):
+        """Close pooled connections (called from the shutdown hook)"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            logger.info("Gateway client closed")
+
+    async def _get_client(self) -> httpx.AsyncClient:
+        # Scripts that never ran the startup hook still get a pooled client
+        if self._client is None:
+            await self.open()
+        return self._client
+
+    @staticmethod
+    def _error_result(e: Exception) -> Dict[str, Any]:
+        """Error result, flagged transient for timeouts, connection errors, 5xx and 429"""
+        status_code = e.response.status_code if isinstance(e, httpx.HTTPStatusError) else None
+        transient = isinstance(e, httpx.TransportError) or (
+            status_code is not None and (status_code >= 500 or status_code == 429)
+        )
+        result = {"code": "ERROR", "message": str(e), "results": {}, "status_code": status_code, "transient": transient}
+        if isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout)):
+            # The request never reached the gateway, so sending it elsewhere cannot duplicate it
+            result["not_sent"] = True
+        return result
+
+    async def check_health(self, path: str, timeout: float) -> bool:
+        """Whether the gateway answers at all (anything below 500 counts as up)"""
+        try:
+            client = await self._get_client()
+            response = await client.get(path, timeout=self._timeout(timeout))
+            return response.status_code < 500
+        except Exception:
+            return False
+
+    @staticmethod
+    def _observe(endpoint: str, started: float, code):
+        """Record one round trip, labelled with the HTTP status or the transport failure"""
+        GATEWAY_LATENCY.observe(time.perf_counter() - started, endpoint, str(code))
+
+    @classmethod
+    def _observe_failure(cls, endpoint: str, started: float, e: Exception):
+        # Responses were already recorded with their status code
+        if isinstance(e, httpx.TransportError):
+            cls._observe(endpoint, started, "timeout" if isinstance(e, httpx.TimeoutException) else "error")
+
     async def send_text_message(self, phone: str, message: str) -> Dict[str, Any]:
         """Send text message via WhatsApp gateway"""
+        started = time.perf_counter()
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
-                    f"{self.base_url}/send/message",
-                    json={
-                        "phone": phone,
-                        "message": message
-                    },
-                    auth=self._get_auth()
-                )
-                response.raise_for_status()
-                return response.json()
+            client = await self._get_client()
+            response = await client.post(
+                "/send/message",
+                json={
+                    "phone": phone,
+                    "message": message
+                },
+                timeout=self._timeout(self.read_timeout)
+            )
+            self._observe("/send/message", started, response.status_code)
+            response.raise_for_status()
+            return response.json()
         except Exception as e:
+            self._observe_failure("/send/message", started, e)
             logger.error(f"Failed to send text message: {e}")
-            return {"code": "ERROR", "message": str(e), "results": {}}
-    
-    async def send_image_message(self, phone: str, image_bytes: bytes, filename: str, caption: str = "") -> Dict[str, Any]:
+            return self._error_result(e)
+
+    async def send_image_message(self, phone: str, image_bytes: bytes, filename: str, caption: str = "", content_type: str = "image/jpeg") -> Dict[str, Any]:
         """Send image with optional caption via WhatsApp gateway
         
         Args:
@@ -42,30 +140,208 @@ class WhatsAppGateway:
             image_bytes: Image data as bytes (no filesystem required)
             filename: Filename for the image
             caption: Optional caption text
+            content_type: MIME type of the image
         """
+        started = time.perf_counter()
         try:
             logger.info(f"Sending image ({len(image_bytes)} bytes) to {phone}")
             
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                # Create in-memory file-like object
-                from io import BytesIO
-                image_file = BytesIO(image_bytes)
-                
-                files = {'image': (filename, image_file, 'image/jpeg')}
-                data = {
-                    'phone': phone,
-                    'caption': caption
-                }
-                response = await client.post(
-                    f"{self.base_url}/send/image",
-                    files=files,
-                    data=data,
-                    auth=self._get_auth()
-                )
-                response.raise_for_status()
-                return response.json()
+            client = await self._get_client()
+            # httpx streams the bytes object as-is, no intermediate buffer
+            files = {'image': (filename, image_bytes, content_type)}
+            data = {
+                'phone': phone,
+                'caption': caption
+            }
+            response = await client.post(
+                "/send/image",
+                files=files,
+                data=data,
+                timeout=self._timeout(self.image_read_timeout)
+            )
+            self._observe("/send/image", started, response.status_code)
+            response.raise_for_status()
+            return response.json()
         except Exception as e:
+            self._observe_failure("/send/image", started, e)
             logger.error(f"Failed to send image message: {e}", exc_info=True)
-            return {"code": "ERROR", "message": str(e), "results": {}}
+            return self._error_result(e)
+
+class GatewayNode:
+    """One gateway endpoint (one WhatsApp session) in the pool"""
+
+    def __init__(self, name: str, client: WhatsAppGateway, weight: float = 1.0):
+        self.name = name
+        self.client = client
+        self.weight = max(weight, 0.01)
+        self.healthy = True
+        self.in_flight = 0
+        self.failures = 0  # consecutive transient failures
+        self.sent = 0
+        self.errors = 0
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "url": self.client.base_url,
+            "weight": self.weight,
+            "healthy": self.healthy,
+            "in_flight": self.in_flight,
+            "sent": self.sent,
+            "errors": self.errors,
+        }
+
+class GatewayPool:
+    """Several gateway endpoints behind the WhatsAppGateway send interface.
+
+    Each recipient sticks to one node while it is healthy, so a chat always
+    comes from the same session and in order. New recipients are placed by
+    weighted rendezvous hashing ("weighted", stable across processes) or on
+    the node with the fewest sends in flight per unit of weight
+    ("least_in_flight"). A node is taken out of rotation after
+    GATEWAY_NODE_MAX_FAILURES consecutive transient failures or a failed
+    health check, and put back once a health check passes.
+    """
+
+    def __init__(self, nodes: Optional[List[GatewayNode]] = None):
+        self.nodes: List[GatewayNode] = nodes or []
+        self.strategy = os.environ.get('GATEWAY_BALANCE', 'weighted')
+        self.max_failures = int(os.environ.get('GATEWAY_NODE_MAX_FAILURES', '3'))
+        self.health_interval = float(os.environ.get('GATEWAY_HEALTH_INTERVAL', '10'))
+        self.health_path = os.environ.get('GATEWAY_HEALTH_PATH', '/app/devices')
+        self.health_timeout = float(os.environ.get('GATEWAY_HEALTH_TIMEOUT', '5'))
+        self._sticky: "OrderedDict[str, GatewayNode]" = OrderedDict()
+        self.max_sticky = 10000
+        self._health_task = None
+
+    @classmethod
+    def from_env(cls) -> "GatewayPool":
+        """GATEWAY_NODES: a JSON list of {url, username, password, weight, name} or comma-separated URLs;
+        falls back to the single GATEWAY_BASE_URL node"""
+        raw = os.environ.get('GATEWAY_NODES', '').strip()
+        if not raw:
+            specs = [{}]
+        elif raw.startswith('['):
+            specs = json.loads(raw)
+        else:
+            specs = [{"url": url.strip()} for url in raw.split(',') if url.strip()]
+        pool = cls()
+        pool.configure(specs)
+        return pool
+
+    def configure(self, specs: List[dict]):
+        """Replace the node list (call before open())"""
+        nodes = []
+        for i, spec in enumerate(specs):
+            client = WhatsAppGateway(base_url=spec.get("url"), username=spec.get("username"), password=spec.get("password"))
+            name = spec.get("name") or urlparse(client.base_url).netloc or f"node{i}"
+            nodes.append(GatewayNode(name, client, float(spec.get("weight", 1.0))))
+        self.nodes = nodes
+        self._sticky.clear()
+
+    @property
+    def base_url(self) -> str:
+        return ", ".join(node.client.base_url for node in self.nodes)
+
+    async def open(self):
+        for node in self.nodes:
+            await node.client.open()
+        if len(self.nodes) > 1 and self.health_interval > 0 and self._health_task is None:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def close(self):
+        if self._health_task:
+            self._health_task.cancel()
+            await asyncio.gather(self._health_task, return_exceptions=True)
+            self._health_task = None
+        for node in self.nodes:
+            await node.client.close()
+
+    @staticmethod
+    def _score(node: GatewayNode, key: str) -> float:
+        # Weighted rendezvous hashing: -w / ln(u), u uniform in (0, 1) per (node, key)
+        digest = hashlib.blake2b(f"{node.name}|{key}".encode(), digest_size=8).digest()
+        u = (int.from_bytes(digest, "big") + 1) / (2 ** 64 + 2)
+        return -node.weight / math.log(u)
+
+    def pick(self, phone: str, exclude: Optional[GatewayNode] = None) -> GatewayNode:
+        """The node this recipient's next message goes through"""
+        candidates = [n for n in self.nodes if n.healthy and n is not exclude]
+        if not candidates:
+            # Everything is down: keep trying (the worker's breaker backs off)
+            candidates = [n for n in self.nodes if n is not exclude] or self.nodes
+        if len(candidates) == 1:
+            return candidates[0]
+
+        if self.strategy == "least_in_flight":
+            node = self._sticky.get(phone)
+            if node is None or node not in candidates:
+                node = min(candidates, key=lambda n: (n.in_flight / n.weight, n.sent / n.weight))
+                self._sticky[phone] = node
+                while len(self._sticky) > self.max_sticky:
+                    self._sticky.popitem(last=False)
+            else:
+                self._sticky.move_to_end(phone)
+            return node
+        return max(candidates, key=lambda n: self._score(n, phone))
+
+    def _record(self, node: GatewayNode, result: Dict[str, Any]):
+        if result.get("transient"):
+            node.errors += 1
+            node.failures += 1
+            if node.healthy and node.failures >= self.max_failures:
+                node.healthy = False
+                logger.warning(f"Gateway node {node.name} taken out of rotation after {node.failures} failures: {result.get('message')}")
+        else:
+            node.failures = 0
+            if result.get("code") == "SUCCESS":
+                node.sent += 1
+
+    async def _send(self, phone: str, send) -> Dict[str, Any]:
+        node = self.pick(phone)
+        for attempt in range(2):
+            node.in_flight += 1
+            try:
+                result = await send(node.client)
+            finally:
+                node.in_flight -= 1
+            self._record(node, result)
+            if attempt == 0 and result.get("not_sent") and len(self.nodes) > 1:
+                # Unreachable node: fail over once, there is no risk of a duplicate
+                fallback = self.pick(phone, exclude=node)
+                if fallback is not node:
+                    logger.warning(f"Gateway node {node.name} unreachable, sending to {phone} via {fallback.name}")
+                    node = fallback
+                    continue
+            break
+        result["gateway_node"] = node.name
+        return result
+
+    async def send_text_message(self, phone: str, message: str) -> Dict[str, Any]:
+        return await self._send(phone, lambda client: client.send_text_message(phone, message))
+
+    async def send_image_message(self, phone: str, image_bytes: bytes, filename: str, caption: str = "",
+                                 content_type: str = "image/jpeg") -> Dict[str, Any]:
+        return await self._send(phone, lambda client: client.send_image_message(
+            phone, image_bytes, filename, caption=caption, content_type=content_type
+        ))
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            results = await asyncio.gather(*(
+                node.client.check_health(self.health_path, self.health_timeout) for node in self.nodes
+            ))
+            for node, ok in zip(self.nodes, results):
+                if ok and not node.healthy:
+                    node.healthy = True
+                    node.failures = 0
+                    logger.info(f"Gateway node {node.name} is back in rotation")
+                elif not ok and node.healthy:
+                    node.healthy = False
+                    logger.warning(f"Gateway node {node.name} failed its health check, taken out of rotation")
+
+    def stats(self) -> List[dict]:
+        return [node.stats() for node in self.nodes]
 
-gateway = WhatsAppGateway()
+gateway = GatewayPool.from_env()
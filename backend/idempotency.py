@@ -0,0 +1,152 @@
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, Optional, Tuple
+
+from bson.codec_options import CodecOptions
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+# Idempotency-Key support for the create endpoints. Each key is one document
+# in idempotency_keys, _id "<scope>:<key>" (so every lookup is an _id hit),
+# holding a fingerprint of the request and, once it finished, the response to
+# replay. A TTL index drops keys IDEMPOTENCY_TTL_HOURS after they complete.
+# A key stays "pending" while its request runs; one whose request died is
+# taken over after IDEMPOTENCY_PENDING_SECONDS. Bulk items are claimed a
+# chunk at a time with one insert_many, so keyed bulk requests stay cheap.
+
+IDEMPOTENCY_TTL_HOURS = float(os.environ.get('IDEMPOTENCY_TTL_HOURS', '24'))
+IDEMPOTENCY_PENDING_SECONDS = float(os.environ.get('IDEMPOTENCY_PENDING_SECONDS', '120'))
+HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+
+PENDING = "pending"
+DONE = "done"
+
+# Scopes: schedule creation (single and bulk items share one) and imports
+SCHEDULES = "schedules"
+IMPORTS = "imports"
+
+# Stored datetimes come back as aware UTC (at BSON's millisecond precision)
+_CODEC = CodecOptions(tz_aware=True)
+
+def _keys(db: AsyncIOMotorDatabase):
+    return db.get_collection("idempotency_keys", codec_options=_CODEC)
+
+def valid_key(key: Optional[str]) -> bool:
+    return bool(key) and len(key) <= MAX_KEY_LENGTH
+
+def fingerprint(value) -> str:
+    """Hash of a raw body (bytes) or of request data (JSON-able with datetimes)"""
+    if not isinstance(value, bytes):
+        value = json.dumps(value, sort_keys=True, default=str).encode()
+    return hashlib.sha256(value).hexdigest()
+
+def conflict(record: dict, request_fingerprint: str) -> Optional[Tuple[int, str]]:
+    """(status code, reason) when an earlier record cannot be replayed for this request"""
+    if record.get("fingerprint") != request_fingerprint:
+        return 422, "Idempotency-Key was already used for a different request"
+    if record.get("status") != DONE:
+        return 409, "A request with this Idempotency-Key is still in progress"
+    return None
+
+def _pending_doc(scope: str, key: str, request_fingerprint: str, now: datetime) -> dict:
+    return {
+        "_id": f"{scope}:{key}",
+        "fingerprint": request_fingerprint,
+        "status": PENDING,
+        "created_at": now,
+        "expires_at": now + timedelta(seconds=IDEMPOTENCY_PENDING_SECONDS),
+    }
+
+async def _take_over(db: AsyncIOMotorDatabase, record: dict, doc: dict, now: datetime) -> bool:
+    """Claim a key whose request never finished; False if it is still live or someone beat us"""
+    if record.get("status") != PENDING or record["expires_at"] > now:
+        return False
+    taken = await _keys(db).find_one_and_update(
+        {"_id": record["_id"], "status": PENDING, "expires_at": record["expires_at"]},
+        {"$set": {k: v for k, v in doc.items() if k != "_id"}}
+    )
+    return taken is not None
+
+async def begin(db: AsyncIOMotorDatabase, scope: str, key: str, request_fingerprint: str) -> Optional[dict]:
+    """Claim key for a new request; None when claimed, else the earlier request's record"""
+    now = datetime.now(timezone.utc)
+    doc = _pending_doc(scope, key, request_fingerprint, now)
+    for _ in range(3):
+        try:
+            await _keys(db).insert_one(doc)
+            return None
+        except DuplicateKeyError:
+            record = await _keys(db).find_one({"_id": doc["_id"]})
+        if record is None:
+            continue  # expired between the insert and the read
+        if await _take_over(db, record, doc, now):
+            return None
+        return record
+    raise RuntimeError(f"Could not claim idempotency key {key}")
+
+async def complete(db: AsyncIOMotorDatabase, scope: str, key: str, response):
+    """Store the response to replay and start the key's TTL"""
+    now = datetime.now(timezone.utc)
+    await _keys(db).update_one(
+        {"_id": f"{scope}:{key}"},
+        {"$set": {"status": DONE, "response": response, "completed_at": now,
+                  "expires_at": now + timedelta(hours=IDEMPOTENCY_TTL_HOURS)}}
+    )
+
+async def release(db: AsyncIOMotorDatabase, scope: str, key: str):
+    """Forget a key whose request failed, so the client can retry it"""
+    await _keys(db).delete_one({"_id": f"{scope}:{key}", "status": PENDING})
+
+async def begin_many(db: AsyncIOMotorDatabase, scope: str, fingerprints: Dict[str, str]) -> Dict[str, dict]:
+    """begin() for many keys (key -> fingerprint) in one insert; returns key -> earlier record for those not claimed"""
+    if not fingerprints:
+        return {}
+    now = datetime.now(timezone.utc)
+    docs = [_pending_doc(scope, key, request_fingerprint, now) for key, request_fingerprint in fingerprints.items()]
+    try:
+        await _keys(db).insert_many(docs, ordered=False)
+        return {}
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        other = [err for err in errors if err.get("code") != 11000]
+        if other:
+            # Claimed ones would block their retries until they expire
+            claimed = set(range(len(docs))) - {err["index"] for err in errors}
+            await _keys(db).delete_many({"_id": {"$in": [docs[i]["_id"] for i in claimed]}, "status": PENDING})
+            raise RuntimeError(f"{len(other)} idempotency keys could not be stored: {other[0].get('errmsg')}")
+        taken = [docs[err["index"]] for err in errors]
+
+    prefix = len(scope) + 1
+    records = {}
+    async for record in _keys(db).find({"_id": {"$in": [doc["_id"] for doc in taken]}}):
+        records[record["_id"][prefix:]] = record
+    for doc in taken:
+        key = doc["_id"][prefix:]
+        record = records.get(key)
+        if record is None:
+            # Expired between the insert and the read: claim it now
+            if await begin(db, scope, key, doc["fingerprint"]) is not None:
+                records[key] = await _keys(db).find_one({"_id": doc["_id"]})
+        elif await _take_over(db, record, doc, now):
+            del records[key]
+    return records
+
+async def complete_many(db: AsyncIOMotorDatabase, scope: str, responses: Dict[str, object]):
+    if not responses:
+        return
+    now = datetime.now(timezone.utc)
+    expires_at = now + timedelta(hours=IDEMPOTENCY_TTL_HOURS)
+    await _keys(db).bulk_write([
+        UpdateOne({"_id": f"{scope}:{key}"},
+                  {"$set": {"status": DONE, "response": response, "completed_at": now, "expires_at": expires_at}})
+        for key, response in responses.items()
+    ], ordered=False)
+
+async def release_many(db: AsyncIOMotorDatabase, scope: str, keys: Iterable[str]):
+    ids = [f"{scope}:{key}" for key in keys]
+    if ids:
+        await _keys(db).delete_many({"_id": {"$in": ids}, "status": PENDING})
@@ -0,0 +1,102 @@
+import base64
+import hashlib
+import logging
+from datetime import datetime, timezone
+from typing import Optional
+from bson.binary import Binary
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+def sniff_content_type(data: bytes) -> str:
+    """Best-effort image MIME type from magic bytes"""
+    if data.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    return 'image/jpeg'
+
+class ImageStore:
+    """Content-addressed image storage.
+
+    Each distinct image is stored once in the ``images`` collection as raw
+    BSON binary, keyed by its SHA-256 hex digest. Schedules only carry that
+    digest in ``image_id``.
+    """
+
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self.collection = db.images
+
+    @staticmethod
+    def digest(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    async def put(self, data: bytes, filename: Optional[str] = None, image_id: Optional[str] = None) -> str:
+        """Store image bytes (no-op if already present) and return the image id"""
+        image_id = image_id or self.digest(data)
+        now = datetime.now(timezone.utc)
+        try:
+            await self.collection.update_one(
+                {"_id": image_id},
+                {
+                    "$setOnInsert": {
+                        "data": Binary(data),
+                        "size": len(data),
+                        "content_type": sniff_content_type(data),
+                        "filename": filename,
+                        "created_at": now
+                    },
+                    # Retention never collects an image uploaded again recently
+                    "$set": {"last_used_at": now}
+                },
+                upsert=True
+            )
+        except DuplicateKeyError:
+            # Two concurrent uploads of the same image - the other one won
+            pass
+        return image_id
+
+    async def put_base64(self, image_base64: str, filename: Optional[str] = None) -> str:
+        """Store a legacy base64 payload, decoding it once"""
+        return await self.put(base64.b64decode(image_base64), filename=filename)
+
+    async def get(self, image_id: str) -> Optional[bytes]:
+        """Raw image bytes, or None if the image is unknown"""
+        doc = await self.collection.find_one({"_id": image_id}, {"data": 1})
+        return doc["data"] if doc else None
+
+    async def exists(self, image_id: str) -> bool:
+        return await self.collection.find_one({"_id": image_id}, {"_id": 1}) is not None
+
+    async def get_meta(self, image_id: str) -> Optional[dict]:
+        """Image metadata without the payload"""
+        return await self.collection.find_one({"_id": image_id}, {"data": 0})
+
+async def migrate_inline_images(db: AsyncIOMotorDatabase, batch_size: int = 100) -> int:
+    """Move image_base64 payloads out of schedules into the image store.
+
+    Safe to re-run: only documents that still carry image_base64 are touched.
+    Returns the number of schedules migrated.
+    """
+    store = ImageStore(db)
+    migrated = 0
+    cursor = db.schedules.find(
+        {"image_base64": {"$nin": [None, ""]}},
+        {"_id": 1, "id": 1, "image_base64": 1, "image_filename": 1},
+        batch_size=batch_size
+    )
+    async for schedule in cursor:
+        image_id = await store.put_base64(schedule["image_base64"], schedule.get("image_filename"))
+        await db.schedules.update_one(
+            {"_id": schedule["_id"]},
+            {"$set": {"image_id": image_id}, "$unset": {"image_base64": ""}}
+        )
+        migrated += 1
+        if migrated % batch_size == 0:
+            logger.info(f"Migrated {migrated} schedule images")
+
+    logger.info(f"Image migration finished: {migrated} schedules migrated")
+    return migrated
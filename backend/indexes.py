@@ -0,0 +1,126 @@
+import logging
+from datetime import datetime, timezone
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import PyMongoError
+
+from background_worker import claimable_filter
+from retention import ARCHIVE_TTL_DAYS
+
+logger = logging.getLogger(__name__)
+
+SCHEDULE_INDEXES = [
+    IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+    # Due-message poll and deadline reload; id makes keyset order index-only
+    IndexModel([("status", ASCENDING), ("send_at", ASCENDING), ("id", ASCENDING)], name="status_send_at"),
+    # History list sorted by sent_at
+    IndexModel([("status", ASCENDING), ("sent_at", DESCENDING), ("id", DESCENDING)], name="status_sent_at"),
+    # Expired-lease reclaim
+    IndexModel([("status", ASCENDING), ("lease_expires_at", ASCENDING)], name="status_lease"),
+    # Unfiltered schedule list
+    IndexModel([("send_at", DESCENDING), ("id", DESCENDING)], name="send_at_id"),
+    # Delivery receipts look rows up by the gateway's message id
+    IndexModel([("gateway_message_id", ASCENDING)], sparse=True, name="gateway_message_id"),
+    # Retention: finished rows by age
+    IndexModel([("status", ASCENDING), ("updated_at", ASCENDING)], name="status_updated_at"),
+    # One schedule per occurrence of a series, however many workers materialize it.
+    # Partial on a string recurrence_id: plain schedules store both fields as
+    # null, and those must not collide.
+    IndexModel(
+        [("recurrence_id", ASCENDING), ("occurrence_at", ASCENDING)],
+        unique=True, name="recurrence_occurrence",
+        partialFilterExpression={"recurrence_id": {"$type": "string"}}
+    ),
+]
+
+CAMPAIGN_INDEXES = [
+    IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+    # Due-campaign poll and deadline reload
+    IndexModel([("status", ASCENDING), ("send_at", ASCENDING)], name="status_send_at"),
+    # Expired-lease reclaim
+    IndexModel([("status", ASCENDING), ("lease_expires_at", ASCENDING)], name="status_lease"),
+    # Campaign list
+    IndexModel([("send_at", DESCENDING), ("id", DESCENDING)], name="send_at_id"),
+]
+
+RECURRENCE_INDEXES = [
+    IndexModel([("id", ASCENDING)], unique=True, name="id_unique"),
+    # Materialization poll and deadline reload
+    IndexModel([("status", ASCENDING), ("next_at", ASCENDING)], name="status_next_at"),
+]
+
+ARCHIVE_INDEXES = [
+    # Archived rows expire on their own; changing the TTL later needs a collMod
+    IndexModel([("archived_at", ASCENDING)], name="archived_at_ttl", expireAfterSeconds=int(ARCHIVE_TTL_DAYS * 86400)),
+    IndexModel([("phone", ASCENDING), ("sent_at", DESCENDING)], name="phone_sent_at"),
+]
+
+IDEMPOTENCY_INDEXES = [
+    # Lookups go by _id; this only expires keys (expires_at is set per key)
+    IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+]
+
+def hot_queries(now: datetime) -> dict:
+    """The queries that run on every poll or dashboard load: name -> (filter, sort)"""
+    return {
+        "due_poll": (claimable_filter(now, 120), [("send_at", ASCENDING)]),
+        "deadline_reload": ({"status": "scheduled", "send_at": {"$lte": now}}, [("send_at", ASCENDING)]),
+        "upcoming_list": ({"status": "scheduled"}, [("send_at", DESCENDING), ("id", DESCENDING)]),
+        "history_list": (
+            {"status": {"$in": ["sent", "failed", "canceled"]}},
+            [("sent_at", DESCENDING), ("id", DESCENDING)]
+        ),
+        "all_list": ({}, [("send_at", DESCENDING), ("id", DESCENDING)]),
+        "by_id": ({"id": "00000000-0000-0000-0000-000000000000"}, None),
+    }
+
+async def ensure_indexes(db: AsyncIOMotorDatabase):
+    """Create missing indexes; existing ones are left alone (create_index is idempotent)"""
+    for collection, indexes in ((db.schedules, SCHEDULE_INDEXES), (db.campaigns, CAMPAIGN_INDEXES),
+                                (db.recurrences, RECURRENCE_INDEXES), (db.schedule_archive, ARCHIVE_INDEXES),
+                                (db.idempotency_keys, IDEMPOTENCY_INDEXES)):
+        for index in indexes:
+            options = dict(index.document)
+            try:
+                # create_index, not create_indexes: mongomock (bench --mongomock)
+                # drops partialFilterExpression from IndexModels
+                await collection.create_index(list(options.pop("key").items()), **options)
+            except PyMongoError as e:
+                # e.g. duplicate ids blocking the unique index - keep serving, but shout
+                logger.error(f"Could not create index {collection.name}.{index.document['name']}: {e}")
+    logger.info("Schedule, campaign and recurrence indexes ensured")
+
+def plan_stages(plan) -> list:
+    """Flatten every 'stage' name in an explain() winning plan"""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(plan_stages(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            stages.extend(plan_stages(item))
+    return stages
+
+async def check_query_plans(db: AsyncIOMotorDatabase) -> dict:
+    """Explain each hot query and warn when the winning plan is a collection scan.
+
+    Returns query name -> list of winning-plan stages.
+    """
+    results = {}
+    for name, (query, sort) in hot_queries(datetime.now(timezone.utc)).items():
+        try:
+            cursor = db.schedules.find(query)
+            if sort:
+                cursor = cursor.sort(sort)
+            explain = await cursor.explain()
+        except Exception as e:
+            logger.warning(f"Could not explain {name}: {e}")
+            continue
+
+        stages = plan_stages(explain.get("queryPlanner", {}).get("winningPlan", {}))
+        results[name] = stages
+        if "COLLSCAN" in stages:
+            logger.warning(f"Hot query '{name}' falls back to a COLLSCAN: {stages}")
+    return results
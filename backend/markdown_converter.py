@@ -1,51 +1,199 @@
+import hashlib
+import os
 import re
-from html.parser import HTMLParser
+from collections import OrderedDict
+from html import unescape
+
+# One regex walks the input once: a tag, a comment, or a run of text
+TOKEN_RE = re.compile(r'<(/?)([a-zA-Z][a-zA-Z0-9]*)([^>]*)>|<!--.*?-->|([^<]+)|<', re.S)
+ATTR_RE = re.compile(r'''([a-zA-Z_:][-a-zA-Z0-9_:.]*)\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))''')
+
+MARKERS = {
+    'strong': '*', 'b': '*',
+    'em': '_', 'i': '_',
+    's': '~', 'strike': '~', 'del': '~',
+    'code': '`',
+}
+HEADINGS = {'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+BLOCKS = {'div', 'blockquote', 'hr'}
+
+def _attr(attrs: str, name: str):
+    for match in ATTR_RE.finditer(attrs):
+        if match.group(1).lower() == name:
+            value = match.group(2)
+            if value is None:
+                value = match.group(3) if match.group(3) is not None else match.group(4)
+            return unescape(value)
+    return None
+
+class HTML2WhatsAppMarkdown:
+    """Single-pass HTML to WhatsApp markdown converter.
+
+    Newlines are not written as they come: block boundaries only record how
+    many are owed, and they are flushed (capped at a blank line) in front of
+    the next piece of output. That keeps the output clean without a second
+    cleanup pass.
+    """
 
-class HTML2WhatsAppMarkdown(HTMLParser):
     def __init__(self):
-        super().__init__()
         self.markdown = []
-        self.bold = False
-        self.italic = False
-        self.list_item = False
-        
-    def handle_starttag(self, tag, attrs):
-        if tag == 'strong' or tag == 'b':
-            self.bold = True
-            self.markdown.append('*')
-        elif tag == 'em' or tag == 'i':
-            self.italic = True
-            self.markdown.append('_')
-        elif tag == 'li':
-            self.list_item = True
-            self.markdown.append('\n• ')
+        self.pending = 0        # newlines owed before the next output
+        self.open = {}          # marker -> nesting depth; only the outermost tag writes it
+        self.lists = []         # stack of [tag, next item number]
+        self.links = []         # stack of (href, output position of the link text)
+        self.fresh_item = False # a list bullet was just written
+        self.pre = 0
+
+    def _write(self, text: str):
+        if self.pending:
+            if self.markdown:
+                self.markdown.append('\n' * self.pending)
+            self.pending = 0
+        self.markdown.append(text)
+        self.fresh_item = False
+
+    def _newlines(self, count: int):
+        self.pending = max(self.pending, count)
+
+    def _marker(self, tag: str, opening: bool):
+        marker = MARKERS[tag] if tag in MARKERS else '*'
+        depth = self.open.get(marker, 0)
+        if opening:
+            self.open[marker] = depth + 1
+            if depth == 0:
+                self._write(marker)
+        elif depth:
+            self.open[marker] = depth - 1
+            if depth == 1:
+                self._write(marker)
+
+    def handle_starttag(self, tag: str, attrs: str):
+        if tag in MARKERS:
+            if not (tag == 'code' and self.pre):
+                self._marker(tag, True)
         elif tag == 'br':
-            self.markdown.append('\n')
-    
-    def handle_endtag(self, tag):
-        if tag == 'strong' or tag == 'b':
-            self.markdown.append('*')
-            self.bold = False
-        elif tag == 'em' or tag == 'i':
-            self.markdown.append('_')
-            self.italic = False
-        elif tag == 'p':
-            self.markdown.append('\n\n')
+            self.pending = min(2, self.pending + 1)
         elif tag == 'li':
-            self.list_item = False
-    
-    def handle_data(self, data):
-        if data.strip():
-            self.markdown.append(data)
+            self._newlines(1)
+            if self.lists and self.lists[-1][0] == 'ol':
+                bullet = f"{self.lists[-1][1]}. "
+                self.lists[-1][1] += 1
+            else:
+                bullet = '• '
+            self._write('  ' * max(0, len(self.lists) - 1) + bullet)
+            self.fresh_item = True
+        elif tag == 'p':
+            # Paragraphs inside list items (as the editor emits them) stay on the item's line
+            if self.lists:
+                if not self.fresh_item:
+                    self._newlines(1)
+            else:
+                self._newlines(2)
+        elif tag in ('ul', 'ol'):
+            if not self.lists:
+                self._newlines(2)
+            start = _attr(attrs, 'start') if tag == 'ol' else None
+            self.lists.append([tag, int(start) if start and start.isdigit() else 1])
+        elif tag in HEADINGS:
+            self._newlines(2)
+            self._marker(tag, True)
+        elif tag == 'a':
+            self.links.append((_attr(attrs, 'href'), len(self.markdown)))
+        elif tag == 'pre':
+            self._newlines(2)
+            self._write('```')
+            self.pre += 1
+        elif tag in BLOCKS:
+            self._newlines(2)
+
+    def handle_endtag(self, tag: str):
+        if tag in MARKERS:
+            if not (tag == 'code' and self.pre):
+                self._marker(tag, False)
+        elif tag == 'p':
+            self._newlines(1 if self.lists else 2)
+        elif tag in ('ul', 'ol'):
+            if self.lists:
+                self.lists.pop()
+            self._newlines(1 if self.lists else 2)
+        elif tag in HEADINGS:
+            self._marker(tag, False)
+            self._newlines(2)
+        elif tag == 'a':
+            if self.links:
+                href, start = self.links.pop()
+                text = ''.join(self.markdown[start:]).strip()
+                if href and not href.startswith('#') and href not in (text, f"mailto:{text}"):
+                    self._write(f" ({href})")
+        elif tag == 'pre':
+            if self.pre:
+                self.pre -= 1
+                self._write('```')
+            self._newlines(2)
+        elif tag in BLOCKS:
+            self._newlines(2)
+
+    def handle_data(self, data: str):
+        if self.pre:
+            self._write(data)
+        elif data.strip():
+            self._write(data)
+        elif ' ' in data and '\n' not in data and self.markdown and not self.pending \
+                and not self.markdown[-1][-1:].isspace():
+            # A space between two inline tags still separates words
+            self._write(' ')
+
+    def feed(self, html: str):
+        for match in TOKEN_RE.finditer(html):
+            tag = match.group(2)
+            if tag is not None:
+                tag = tag.lower()
+                if match.group(1):
+                    self.handle_endtag(tag)
+                else:
+                    self.handle_starttag(tag, match.group(3))
+            elif match.group(4) is not None:
+                self.handle_data(unescape(match.group(4)))
+            elif match.group(0) == '<':
+                self.handle_data('<')
     
     def get_markdown(self):
-        result = ''.join(self.markdown)
-        # Clean up multiple newlines
-        result = re.sub(r'\n{3,}', '\n\n', result)
-        return result.strip()
+        return ''.join(self.markdown).strip()
 
-def html_to_whatsapp_markdown(html: str) -> str:
-    """Convert HTML to WhatsApp-compatible markdown"""
+def _convert(html: str) -> str:
     parser = HTML2WhatsAppMarkdown()
     parser.feed(html)
     return parser.get_markdown()
+
+# Devotion templates come back again and again (create, bulk, update). Keys
+# are digests so the cache never holds on to the HTML bodies themselves.
+CACHE_SIZE = int(os.environ.get('MARKDOWN_CACHE_SIZE', '512'))
+_cache = OrderedDict()
+_cache_stats = {"hits": 0, "misses": 0}
+
+def html_to_whatsapp_markdown(html: str) -> str:
+    """Convert HTML to WhatsApp-compatible markdown"""
+    if CACHE_SIZE <= 0:
+        return _convert(html)
+    key = hashlib.blake2b(html.encode(), digest_size=16).digest()
+    markdown = _cache.get(key)
+    if markdown is not None:
+        _cache.move_to_end(key)
+        _cache_stats["hits"] += 1
+        return markdown
+    _cache_stats["misses"] += 1
+    markdown = _cache[key] = _convert(html)
+    if len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+    return markdown
+
+def cache_info() -> dict:
+    return {**_cache_stats, "size": len(_cache), "max_size": CACHE_SIZE}
+
+def clear_cache():
+    _cache.clear()
+    _cache_stats.update(hits=0, misses=0)
+
+def convert_batch(htmls):
+    """Convert a list of HTML bodies; the unit of work shipped to bulk worker processes"""
+    return [html_to_whatsapp_markdown(html) for html in htmls]
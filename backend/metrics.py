@@ -0,0 +1,216 @@
+"""In-process metrics in the Prometheus text exposition format.
+
+Deliberately tiny instead of pulling in prometheus_client: counters and
+histograms are plain dicts keyed by label-value tuples, observe() is a
+bisect plus two additions, and rendering happens only when /metrics is
+scraped. Gauges that need a database round trip are registered as async
+collectors and evaluated at scrape time.
+"""
+import asyncio
+import logging
+import time
+from bisect import bisect_left
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+LAG_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+
+_metrics = []
+_collectors: List[Callable[[], Awaitable[List[Tuple[str, str, Dict[str, str], float]]]]] = []
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(names, values, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values: Dict[tuple, float] = {}
+        _metrics.append(self)
+
+    def inc(self, *labels, amount: float = 1.0):
+        self.values[labels] = self.values.get(labels, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in self.values.items():
+            lines.append(f"{self.name}{_format_labels(self.labels, labels)} {value}")
+        return lines
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: "Histogram", labels: tuple):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+        return False
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (last one is +Inf), sum, count]
+        self.values: Dict[tuple, list] = {}
+        _metrics.append(self)
+
+    def observe(self, value: float, *labels):
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def time(self, *labels) -> _Timer:
+        """Context manager observing the elapsed wall time of its block"""
+        return _Timer(self, labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in self.values.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, labels)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, labels)} {count}")
+        return lines
+
+def add_collector(collector):
+    """Register an async callable returning [(name, help, labels, value)] gauges, run per scrape"""
+    _collectors.append(collector)
+
+async def render() -> str:
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+
+    for collector in _collectors:
+        try:
+            samples = await collector()
+        except Exception as e:
+            logger.warning(f"Metrics collector {getattr(collector, '__name__', collector)} failed: {e}")
+            continue
+        described = set()
+        for name, help, labels, value in samples:
+            if name not in described:
+                lines += [f"# HELP {name} {help}", f"# TYPE {name} gauge"]
+                described.add(name)
+            lines.append(f"{name}{_format_labels(labels.keys(), labels.values())} {value}")
+    return "\n".join(lines) + "\n"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Send pipeline
+SEND_LAG = Histogram("scheduler_send_lag_seconds", "Delay between send_at and the gateway accepting the message", buckets=LAG_BUCKETS)
+SEND_STAGE = Histogram("scheduler_send_stage_seconds", "Time spent in each stage of sending one schedule", ("stage",))
+SENDS = Counter("scheduler_sends_total", "Send attempts by outcome", ("result",))
+WORKER_LOOP = Histogram("scheduler_worker_loop_seconds", "Duration of one worker loop iteration (excluding the idle wait)")
+GATEWAY_LATENCY = Histogram("scheduler_gateway_request_seconds", "Gateway round-trip latency", ("endpoint", "code"))
+
+# API
+HTTP_LATENCY = Histogram("http_request_duration_seconds", "HTTP handler latency", ("method", "route", "status"))
+
+def database_collector(db):
+    """Collector for the due-but-unsent backlog, straight from Mongo"""
+    async def due_backlog():
+        now = datetime.now(timezone.utc)
+        due = await db.schedules.count_documents({"status": "scheduled", "send_at": {"$lte": now}})
+        sending = await db.schedules.count_documents({"status": "sending"})
+        return [
+            ("scheduler_due_unsent", "Schedules due but not yet sent", {"status": "scheduled"}, due),
+            ("scheduler_due_unsent", "Schedules due but not yet sent", {"status": "sending"}, sending),
+        ]
+    return due_backlog
+
+def worker_collector(worker):
+    """Collector for a BackgroundWorker's in-memory queues"""
+    async def worker_queues():
+        return [
+            ("scheduler_dispatch_queue_depth", "Schedules queued in this process for the senders", {}, worker.queue_depth()),
+            ("scheduler_upcoming_deadlines", "Deadlines held in the worker's timer heap", {}, len(worker._pending)),
+            ("scheduler_gateway_rate_per_second", "Current adaptive gateway send rate", {}, worker.limiter.global_bucket.rate),
+            ("scheduler_active_campaigns", "Campaigns this process is fanning out", {}, len(worker._campaigns)),
+            ("scheduler_circuit_open", "1 while the gateway circuit breaker is open", {}, int(worker.breaker.state != worker.breaker.CLOSED)),
+        ]
+    return worker_queues
+
+def gateway_collector(pool):
+    """Collector for the gateway pool's per-node health and load"""
+    async def gateway_nodes():
+        samples = []
+        for node in pool.nodes:
+            samples.append(("scheduler_gateway_node_up", "1 while the gateway node is in rotation", {"node": node.name}, int(node.healthy)))
+            samples.append(("scheduler_gateway_node_in_flight", "Sends in flight on the gateway node", {"node": node.name}, node.in_flight))
+        return samples
+    return gateway_nodes
+
+class HTTPMetricsMiddleware:
+    """ASGI middleware timing every HTTP request by method, route template and status"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        started = time.perf_counter()
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            # Route templates ("/api/schedules/{schedule_id}") keep label cardinality bounded
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            HTTP_LATENCY.observe(time.perf_counter() - started, scope["method"], path, str(status[0]))
+
+async def serve(port: int, host: str = "0.0.0.0"):
+    """Minimal /metrics HTTP listener for processes without an API (worker.py)"""
+    async def handle(reader, writer):
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            if request_line.split()[1:2] == [b"/metrics"]:
+                body = (await render()).encode()
+                head = f"HTTP/1.1 200 OK\r\nContent-Type: {CONTENT_TYPE}\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n"
+            else:
+                body = b"not found\n"
+                head = f"HTTP/1.1 404 Not Found\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n"
+            writer.write(head.encode() + body)
+            await writer.drain()
+        except Exception as e:
+            logger.warning(f"Metrics request failed: {e}")
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    logger.info(f"Metrics listening on {host}:{port}/metrics")
+    return server
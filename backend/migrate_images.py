@@ -0,0 +1,33 @@
+"""Move inline image_base64 payloads into the content-addressed image store.
+
+    python migrate_images.py
+
+Idempotent: re-running only touches schedules that still carry image_base64.
+"""
+import asyncio
+import logging
+import os
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+from image_store import migrate_inline_images
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+
+async def main():
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    try:
+        await migrate_inline_images(client[os.environ['DB_NAME']])
+    finally:
+        client.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional, List
+from typing import Optional, List, Dict
 from datetime import datetime
 import uuid
 
@@ -7,32 +7,163 @@ class ScheduleCreate(BaseModel):
     phone: str = "120363291513749102@g.us"
     message_html: str
     message_md: Optional[str] = ""
-    image_base64: Optional[str] = None
+    image_base64: Optional[str] = None  # legacy inline upload, moved to the image store on write
+    image_id: Optional[str] = None
     image_filename: Optional[str] = None
     send_at: datetime
+    idempotency_key: Optional[str] = None  # per item in bulk requests; not stored on the schedule
 
 class Schedule(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     phone: str
     message_html: str
     message_md: str
-    image_base64: Optional[str] = None
+    image_base64: Optional[str] = None  # only on rows not yet migrated to the image store
+    image_id: Optional[str] = None  # sha256 of the image in the images collection
     image_filename: Optional[str] = None
     send_at: datetime
     status: str = "scheduled"  # scheduled, sending, sent, failed, canceled
     sent_at: Optional[datetime] = None
     gateway_response: Optional[dict] = None
+    attempts: int = 0
+    next_attempt_at: Optional[datetime] = None  # backoff after a transient failure; send_at stays as requested
+    recurrence_id: Optional[str] = None  # set on occurrences materialized from a series
+    occurrence_at: Optional[datetime] = None
+    gateway_message_id: Optional[str] = None
+    delivery_status: Optional[str] = None  # delivered, read (from gateway receipts)
+    delivered_at: Optional[datetime] = None
+    read_at: Optional[datetime] = None
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
+class ScheduleSummary(BaseModel):
+    """List row without the HTML body or image payload"""
+    id: str
+    phone: str
+    message_md: str = ""
+    send_at: datetime
+    status: str
+    sent_at: Optional[datetime] = None
+    delivery_status: Optional[str] = None
+    has_image: bool = False
+    image_id: Optional[str] = None
+    image_filename: Optional[str] = None
+
 class ScheduleUpdate(BaseModel):
     phone: Optional[str] = None
     message_html: Optional[str] = None
     message_md: Optional[str] = None
     image_base64: Optional[str] = None
+    image_id: Optional[str] = None
     image_filename: Optional[str] = None
     send_at: Optional[datetime] = None
     status: Optional[str] = None
 
 class BulkScheduleCreate(BaseModel):
     schedules: List[ScheduleCreate]
+
+class BulkItemError(BaseModel):
+    index: int  # position in the request's schedules list
+    error: str
+
+class BulkScheduleResult(BaseModel):
+    schedules: List[Schedule]  # created (or replayed) items, in request order
+    errors: List[BulkItemError] = []
+    replayed: int = 0
+
+class CampaignRecipient(BaseModel):
+    phone: str
+    vars: Dict[str, str] = {}  # fills {{name}} placeholders for this recipient
+
+class CampaignCreate(BaseModel):
+    name: Optional[str] = ""
+    message_html: str
+    message_md: Optional[str] = ""
+    vars: Dict[str, str] = {}  # defaults for placeholders a recipient does not set
+    image_base64: Optional[str] = None  # moved to the image store on write
+    image_id: Optional[str] = None
+    image_filename: Optional[str] = None
+    send_at: datetime
+    recipients: List[CampaignRecipient] = Field(min_length=1)
+
+class RecipientDelivery(BaseModel):
+    phone: str
+    vars: Dict[str, str] = {}
+    status: str = "pending"  # pending, sent, failed
+    attempts: int = 0
+    sent_at: Optional[datetime] = None
+    message_id: Optional[str] = None
+    error: Optional[str] = None
+
+class CampaignSummary(BaseModel):
+    """Campaign without its body and recipient list"""
+    id: str
+    name: str = ""
+    message_md: str = ""
+    image_id: Optional[str] = None
+    image_filename: Optional[str] = None
+    send_at: datetime
+    status: str  # scheduled, sending, sent, partial, failed, canceled
+    counts: Dict[str, int] = {}
+    sent_at: Optional[datetime] = None
+    created_at: Optional[datetime] = None
+
+class Campaign(CampaignSummary):
+    message_html: str
+    vars: Dict[str, str] = {}
+    recipients: List[RecipientDelivery] = []
+    updated_at: Optional[datetime] = None
+
+class RecurrenceCreate(BaseModel):
+    phone: str = "120363291513749102@g.us"
+    message_html: str
+    message_md: Optional[str] = ""
+    image_base64: Optional[str] = None  # moved to the image store on write
+    image_id: Optional[str] = None
+    image_filename: Optional[str] = None
+    frequency: str = "daily"  # daily, weekly, rrule
+    time_of_day: Optional[str] = "05:00"  # HH:MM in timezone, for daily/weekly
+    weekdays: List[str] = []  # MO..SU, for weekly
+    rrule: Optional[str] = None  # e.g. FREQ=MONTHLY;BYMONTHDAY=1;BYHOUR=6;BYMINUTE=0
+    timezone: str = "Asia/Jakarta"
+    starts_at: Optional[datetime] = None
+    until: Optional[datetime] = None
+    count: Optional[int] = None
+
+class RecurrenceUpdate(BaseModel):
+    phone: Optional[str] = None
+    message_html: Optional[str] = None
+    image_base64: Optional[str] = None
+    image_id: Optional[str] = None
+    image_filename: Optional[str] = None
+    frequency: Optional[str] = None
+    time_of_day: Optional[str] = None
+    weekdays: Optional[List[str]] = None
+    rrule: Optional[str] = None
+    timezone: Optional[str] = None
+    starts_at: Optional[datetime] = None
+    until: Optional[datetime] = None
+    count: Optional[int] = None
+    status: Optional[str] = None  # active, paused
+
+class Recurrence(BaseModel):
+    id: str
+    phone: str
+    message_html: str
+    message_md: str = ""
+    image_id: Optional[str] = None
+    image_filename: Optional[str] = None
+    frequency: str
+    time_of_day: Optional[str] = None
+    weekdays: Optional[List[str]] = None
+    rrule: Optional[str] = None
+    rule: str
+    timezone: str
+    starts_at: Optional[datetime] = None
+    until: Optional[datetime] = None
+    count: Optional[int] = None
+    status: str  # active, paused, ended
+    next_at: Optional[datetime] = None  # next occurrence not yet materialized
+    upcoming: List[datetime] = []
+    created_at: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
@@ -0,0 +1,50 @@
+import base64
+import json
+from datetime import datetime
+from typing import Optional, Tuple
+
+# Lists are ordered newest first on (field, id); a cursor is the last row's
+# (field value, id) so the next page starts strictly after it. Unlike
+# skip/offset this stays an index range scan however deep the page.
+
+class InvalidCursor(ValueError):
+    pass
+
+def encode_cursor(value: Optional[datetime], schedule_id: str) -> str:
+    payload = {"v": value.isoformat() if value else None, "id": schedule_id}
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[Optional[datetime], str]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded))
+        value = datetime.fromisoformat(payload["v"]) if payload["v"] else None
+        return value, str(payload["id"])
+    except Exception as e:
+        raise InvalidCursor(f"Invalid cursor: {cursor}") from e
+
+def keyset_filter(field: str, cursor: Optional[str]) -> dict:
+    """Mongo filter for rows after the cursor in (field desc, id desc) order.
+
+    Rows with a null field (e.g. failed before sent_at was set) sort last.
+    """
+    if not cursor:
+        return {}
+    value, schedule_id = decode_cursor(cursor)
+    if value is None:
+        return {field: None, "id": {"$lt": schedule_id}}
+    return {"$or": [
+        {field: {"$lt": value}},
+        {field: value, "id": {"$lt": schedule_id}},
+        {field: None},
+    ]}
+
+def next_cursor(rows: list, field: str, limit: int) -> Optional[str]:
+    """Cursor for the page after rows, or None when this was the last page"""
+    if len(rows) < limit:
+        return None
+    last = rows[-1]
+    return encode_cursor(last.get(field), last["id"])
+
+def keyset_sort(field: str) -> list:
+    return [(field, -1), ("id", -1)]
@@ -0,0 +1,228 @@
+import asyncio
+import hashlib
+import hmac
+import logging
+import os
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+# Delivery and read receipts arrive as gateway webhooks, often in bursts of
+# thousands. The endpoint only parses and buffers them; a background flusher
+# folds the buffer into one bulk_write per RECEIPT_FLUSH_SECONDS. Writes use
+# $min/$max, so a repeated or reordered callback can never move a message
+# backwards, and recent receipts are remembered so repeats are dropped early.
+# A receipt that is given up on (unmatched past max_age, or rejected by
+# Mongo) is forgotten again, so the gateway's redelivery still gets through.
+
+DELIVERED = "delivered"
+READ = "read"
+RECEIPT_STATES = {
+    "delivered": DELIVERED,
+    "delivery": DELIVERED,
+    "read": READ,
+    "read-self": READ,
+    "played": READ,
+}
+TIMESTAMP_FIELDS = {DELIVERED: "delivered_at", READ: "read_at"}
+
+def _parse_time(value) -> datetime:
+    if isinstance(value, (int, float)):
+        # Epoch seconds, or milliseconds from some gateways
+        return datetime.fromtimestamp(value / 1000 if value > 1e11 else value, timezone.utc)
+    if isinstance(value, str):
+        try:
+            parsed = datetime.fromisoformat(value)
+            return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+        except ValueError:
+            pass
+    return datetime.now(timezone.utc)
+
+def parse_receipts(body) -> List[Tuple[str, str, datetime]]:
+    """(message_id, state, at) tuples from a webhook body; anything that is not a receipt is ignored.
+
+    Understands the go-whatsapp-web-multidevice "message.ack" event
+    ({"event", "payload": {"ids", "receipt_type"}, "timestamp"}), a flat
+    {"message_id", "status", "timestamp"} form, and lists of either.
+    """
+    items = body if isinstance(body, list) else [body]
+    receipts = []
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        payload = item.get("payload") if isinstance(item.get("payload"), dict) else item
+        state = RECEIPT_STATES.get(str(payload.get("receipt_type") or payload.get("status") or "").lower())
+        if state is None:
+            continue
+        ids = payload.get("ids") or payload.get("message_ids") or [payload.get("message_id") or payload.get("id")]
+        at = _parse_time(payload.get("timestamp") or item.get("timestamp"))
+        receipts.extend((str(message_id), state, at) for message_id in ids if message_id)
+    return receipts
+
+def verify_signature(secret: str, body: bytes, header: Optional[str]) -> bool:
+    """Check an X-Hub-Signature-256 style "sha256=<hex>" HMAC of the raw body"""
+    if not header:
+        return False
+    expected = "sha256=" + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, header.strip())
+
+class ReceiptBuffer:
+    """In-memory receipt buffer, applied to schedules by gateway_message_id in periodic bulk writes"""
+
+    def __init__(self, db: AsyncIOMotorDatabase, on_applied: Optional[Callable[[List[str]], None]] = None):
+        self.db = db
+        self.on_applied = on_applied  # called with the ids of the schedules each flush touched
+        self.flush_seconds = float(os.environ.get('RECEIPT_FLUSH_SECONDS', '1'))
+        self.flush_size = int(os.environ.get('RECEIPT_FLUSH_SIZE', '2000'))
+        self.max_buffered = int(os.environ.get('RECEIPT_BUFFER_MAX', '100000'))
+        # A receipt can beat the sender's own status write; unmatched ones are retried this long
+        self.max_age = float(os.environ.get('RECEIPT_MAX_AGE_SECONDS', '60'))
+        self.max_seen = 200000
+
+        # message_id -> {field: earliest time}; one entry per message however many callbacks
+        self._pending: Dict[str, Dict[str, datetime]] = {}
+        self._first_seen: Dict[str, float] = {}
+        self._seen: "OrderedDict[Tuple[str, str], None]" = OrderedDict()
+        self._wakeup = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task = None
+
+        self.received = 0
+        self.duplicates = 0
+        self.applied = 0
+        self.dropped = 0
+        self.flushes = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush(final=True)
+
+    def full(self) -> bool:
+        return len(self._pending) >= self.max_buffered
+
+    def add(self, receipts: Iterable[Tuple[str, str, datetime]]) -> int:
+        """Buffer receipts (no I/O); returns how many were new"""
+        accepted = 0
+        now = asyncio.get_running_loop().time()
+        for message_id, state, at in receipts:
+            self.received += 1
+            key = (message_id, state)
+            if key in self._seen:
+                self.duplicates += 1
+                continue
+            self._seen[key] = None
+            if len(self._seen) > self.max_seen:
+                self._seen.popitem(last=False)
+
+            fields = self._pending.setdefault(message_id, {})
+            self._first_seen.setdefault(message_id, now)
+            for state_reached in ((DELIVERED, READ) if state == READ else (DELIVERED,)):
+                field = TIMESTAMP_FIELDS[state_reached]
+                if field not in fields or at < fields[field]:
+                    fields[field] = at
+            accepted += 1
+
+        if accepted and len(self._pending) >= self.flush_size:
+            self._wakeup.set()
+        return accepted
+
+    def _update(self, fields: Dict[str, datetime]) -> dict:
+        # "read" > "delivered" as strings, so $max only ever moves the status forward
+        status = READ if "read_at" in fields else DELIVERED
+        return {"$min": dict(fields), "$max": {"delivery_status": status}}
+
+    async def flush(self, final: bool = False):
+        async with self._lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+            first_seen, self._first_seen = self._first_seen, {}
+
+            # Which message ids are on a schedule yet (and which schedules they are)
+            ids = list(batch)
+            found = {}
+            for i in range(0, len(ids), 5000):
+                cursor = self.db.schedules.find(
+                    {"gateway_message_id": {"$in": ids[i:i + 5000]}}, {"_id": 0, "id": 1, "gateway_message_id": 1}
+                )
+                async for row in cursor:
+                    found[row["gateway_message_id"]] = row["id"]
+
+            matched = list(found)
+            ops = [UpdateOne({"gateway_message_id": mid}, self._update(batch[mid])) for mid in matched]
+            failed = 0
+            if ops:
+                try:
+                    await self.db.schedules.bulk_write(ops, ordered=False)
+                except BulkWriteError as e:
+                    errors = e.details.get('writeErrors', [])
+                    failed = len(errors)
+                    logger.error(f"Receipt flush: {failed} of {len(ops)} updates failed")
+                    for error in errors:
+                        self._forget(matched[error["index"]])
+                except Exception:
+                    # Mongo unavailable: put everything back for the next flush
+                    self._merge_back(batch, first_seen)
+                    raise
+            self.applied += len(ops) - failed
+            self.flushes += 1
+
+            # Unmatched receipts wait for the sender's status write, up to max_age
+            now = asyncio.get_running_loop().time()
+            for mid in batch.keys() - found.keys():
+                if not final and now - first_seen.get(mid, now) < self.max_age:
+                    self._merge_back({mid: batch[mid]}, first_seen)
+                else:
+                    self.dropped += 1
+                    self._forget(mid)
+
+        if found and self.on_applied:
+            self.on_applied(list(found.values()))
+
+    def _forget(self, message_id: str):
+        """Let a later callback for this message through again"""
+        for state in (DELIVERED, READ):
+            self._seen.pop((message_id, state), None)
+
+    def _merge_back(self, batch: Dict[str, Dict[str, datetime]], first_seen: Dict[str, float]):
+        for mid, fields in batch.items():
+            current = self._pending.setdefault(mid, {})
+            for field, at in fields.items():
+                if field not in current or at < current[field]:
+                    current[field] = at
+            self._first_seen.setdefault(mid, first_seen.get(mid, 0.0))
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Receipt flush failed, will retry: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "buffered": len(self._pending),
+            "received": self.received,
+            "duplicates": self.duplicates,
+            "applied": self.applied,
+            "dropped_unmatched": self.dropped,
+            "flushes": self.flushes,
+        }
@@ -0,0 +1,127 @@
+import uuid
+from datetime import datetime, timezone
+from typing import List, Optional
+
+from dateutil import tz
+from dateutil.rrule import rrulestr
+
+# A recurring series (e.g. the daily devotion) is one document holding the
+# content and an RRULE. The worker materializes a Schedule for an occurrence
+# only shortly before it is due, so editing the series changes every later
+# occurrence without rewriting anything, and the image is stored once.
+
+DEFAULT_TIMEZONE = "Asia/Jakarta"
+WEEKDAYS = ("MO", "TU", "WE", "TH", "FR", "SA", "SU")
+FREQUENCIES = ("daily", "weekly", "rrule")
+
+ACTIVE = "active"
+PAUSED = "paused"
+ENDED = "ended"
+
+# Fields that change when occurrences fall vs. what each occurrence carries
+RULE_FIELDS = ("frequency", "time_of_day", "weekdays", "rrule", "timezone", "starts_at", "until", "count")
+CONTENT_FIELDS = ("phone", "message_html", "message_md", "image_id", "image_filename")
+
+def _utc(dt: datetime) -> datetime:
+    # Mongo hands back naive UTC datetimes
+    return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt.astimezone(timezone.utc)
+
+def build_rule(spec: dict) -> str:
+    """RRULE text for a daily/weekly shorthand or a raw rule; ValueError if it does not parse"""
+    frequency = spec.get("frequency") or "daily"
+    if frequency not in FREQUENCIES:
+        raise ValueError(f"frequency must be one of {', '.join(FREQUENCIES)}")
+
+    if frequency == "rrule":
+        rule = (spec.get("rrule") or "").strip()
+        if rule.upper().startswith("RRULE:"):
+            rule = rule[6:]
+        if not rule or "DTSTART" in rule.upper() or "\n" in rule:
+            raise ValueError("rrule must be a single RRULE line without DTSTART (use starts_at)")
+    else:
+        try:
+            hour, minute = (int(part) for part in (spec.get("time_of_day") or "05:00").split(":"))
+        except ValueError:
+            raise ValueError("time_of_day must be HH:MM")
+        if not (0 <= hour < 24 and 0 <= minute < 60):
+            raise ValueError("time_of_day must be HH:MM")
+        rule = f"FREQ={frequency.upper()};BYHOUR={hour};BYMINUTE={minute};BYSECOND=0"
+        if frequency == "weekly":
+            weekdays = [day.upper()[:2] for day in spec.get("weekdays") or []]
+            if not weekdays or any(day not in WEEKDAYS for day in weekdays):
+                raise ValueError(f"weekly rules need weekdays from {', '.join(WEEKDAYS)}")
+            rule += ";BYDAY=" + ",".join(weekdays)
+
+    if spec.get("until"):
+        rule += f";UNTIL={_utc(spec['until']):%Y%m%dT%H%M%SZ}"
+    if spec.get("count"):
+        rule += f";COUNT={int(spec['count'])}"
+
+    if any(f"FREQ={freq}" in rule.upper() for freq in ("SECONDLY", "MINUTELY")):
+        raise ValueError("rules more frequent than hourly are not supported")
+    # Parse once so a bad rule is rejected on write, not in the worker
+    compile_rule({"rule": rule, "timezone": spec.get("timezone"), "dtstart": spec.get("dtstart") or datetime.now(timezone.utc)})
+    return rule
+
+def compile_rule(doc: dict):
+    """dateutil rrule anchored at the series start in its own timezone (so 05:00 stays 05:00 WIB)"""
+    zone = tz.gettz(doc.get("timezone") or DEFAULT_TIMEZONE)
+    if zone is None:
+        raise ValueError(f"unknown timezone {doc.get('timezone')}")
+    dtstart = _utc(doc["dtstart"]).astimezone(zone).replace(microsecond=0)
+    return rrulestr(doc["rule"], dtstart=dtstart, cache=False)
+
+def next_occurrence(doc: dict, after: datetime, inc: bool = False) -> Optional[datetime]:
+    occurrence = compile_rule(doc).after(_utc(after), inc=inc)
+    return _utc(occurrence) if occurrence else None
+
+def occurrences_between(doc: dict, start: datetime, end: datetime, limit: int) -> List[datetime]:
+    """Occurrences in [start, end], at most limit of them, as UTC"""
+    occurrences = []
+    for occurrence in compile_rule(doc).xafter(_utc(start), count=limit, inc=True):
+        if occurrence > _utc(end):
+            break
+        occurrences.append(_utc(occurrence))
+    return occurrences
+
+def upcoming(doc: dict, count: int = 5) -> List[datetime]:
+    if doc.get("status") != ACTIVE or not doc.get("next_at"):
+        return []
+    return [_utc(o) for o in compile_rule(doc).xafter(_utc(doc["next_at"]), count=count, inc=True)]
+
+def new_recurrence_doc(data: dict, markdown: str, now: datetime) -> dict:
+    """Series document from validated RecurrenceCreate data; ValueError for a bad rule"""
+    spec = {field: data.get(field) for field in RULE_FIELDS}
+    spec["timezone"] = spec["timezone"] or DEFAULT_TIMEZONE
+    spec["dtstart"] = data.get("starts_at") or now
+    doc = {
+        "id": str(uuid.uuid4()),
+        **{field: data.get(field) for field in CONTENT_FIELDS},
+        "message_md": markdown,
+        **spec,
+        "rule": build_rule(spec),
+        "status": ACTIVE,
+        "revision": 0,
+        "created_at": now,
+        "updated_at": now,
+    }
+    doc["next_at"] = next_occurrence(doc, max(_utc(doc["dtstart"]), now), inc=True)
+    if doc["next_at"] is None:
+        doc["status"] = ENDED
+    return doc
+
+def occurrence_doc(series: dict, occurrence_at: datetime, now: datetime) -> dict:
+    """The Schedule that sends one occurrence; (recurrence_id, occurrence_at) is unique"""
+    return {
+        "id": str(uuid.uuid4()),
+        **{field: series.get(field) for field in CONTENT_FIELDS},
+        "send_at": occurrence_at,
+        "status": "scheduled",
+        "sent_at": None,
+        "gateway_response": None,
+        "attempts": 0,
+        "recurrence_id": series["id"],
+        "occurrence_at": occurrence_at,
+        "created_at": now,
+        "updated_at": now,
+    }
@@ -0,0 +1,153 @@
+import logging
+import os
+import random
+from typing import Dict, Any
+
+from clock import SYSTEM_CLOCK, Clock
+
+logger = logging.getLogger(__name__)
+
+def is_transient(result: Dict[str, Any]) -> bool:
+    """Whether a failed gateway result is worth retrying (timeouts, 5xx, 429)"""
+    return bool(result.get("transient"))
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Exponential backoff with equal jitter for the given 1-based attempt"""
+    delay = min(cap, base * (2 ** (attempt - 1)))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+class TokenBucket:
+    """Classic token bucket. reserve() takes a token now and says how long to wait for it."""
+
+    def __init__(self, rate: float, burst: float, clock: Clock = SYSTEM_CLOCK):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = burst
+        self.clock = clock
+        self.updated = clock.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self) -> float:
+        now = self.clock.monotonic()
+        self._refill(now)
+        self.tokens -= 1
+        # A negative balance is a queue of reservations; each waits its turn
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def idle(self) -> bool:
+        self._refill(self.clock.monotonic())
+        return self.tokens >= self.capacity
+
+class RateLimiter:
+    """Global and per-recipient token buckets in front of the gateway.
+
+    The global rate adapts AIMD-style: halved whenever the gateway answers
+    429, then crept back up towards the configured ceiling on successes.
+    """
+
+    def __init__(self, clock: Clock = SYSTEM_CLOCK):
+        self.clock = clock
+        self.max_rate = float(os.environ.get('GATEWAY_RATE_PER_SEC', '5'))
+        self.min_rate = float(os.environ.get('GATEWAY_MIN_RATE_PER_SEC', '0.2'))
+        self.recipient_rate = float(os.environ.get('RECIPIENT_RATE_PER_SEC', '1'))
+        self.recipient_burst = float(os.environ.get('RECIPIENT_BURST', '3'))
+        self.max_recipients = 10000
+
+        self.global_bucket = TokenBucket(self.max_rate, float(os.environ.get('GATEWAY_BURST', '10')), clock)
+        self.recipients: Dict[str, TokenBucket] = {}
+
+    def _recipient_bucket(self, phone: str) -> TokenBucket:
+        bucket = self.recipients.get(phone)
+        if bucket is None:
+            if len(self.recipients) >= self.max_recipients:
+                # Full buckets carry no state worth keeping
+                self.recipients = {p: b for p, b in self.recipients.items() if not b.idle()}
+            bucket = self.recipients[phone] = TokenBucket(self.recipient_rate, self.recipient_burst, self.clock)
+        return bucket
+
+    async def acquire(self, phone: str):
+        """Wait until both the global and the recipient's bucket allow a send"""
+        wait = max(self.global_bucket.reserve(), self._recipient_bucket(phone).reserve())
+        if wait > 0:
+            await self.clock.sleep(wait)
+
+    def on_throttled(self):
+        rate = max(self.min_rate, self.global_bucket.rate / 2)
+        if rate != self.global_bucket.rate:
+            logger.warning(f"Gateway throttled us, global rate {self.global_bucket.rate:.2f} -> {rate:.2f}/s")
+        self.global_bucket.rate = rate
+
+    def on_success(self):
+        if self.global_bucket.rate < self.max_rate:
+            self.global_bucket.rate = min(self.max_rate, self.global_bucket.rate + self.max_rate * 0.05)
+
+class CircuitBreaker:
+    """Stops dispatch while the gateway is down instead of failing the due queue.
+
+    closed -> open after N consecutive transient failures; open -> half-open
+    after reset_timeout, letting a single probe through; the probe's outcome
+    closes or re-opens the circuit. Take the probe (before_call) right before
+    the gateway call and always report back: record_success/record_failure,
+    or release() when the call never got a verdict.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, clock: Clock = SYSTEM_CLOCK):
+        self.clock = clock
+        self.failure_threshold = int(os.environ.get('BREAKER_FAILURE_THRESHOLD', '5'))
+        self.reset_timeout = float(os.environ.get('BREAKER_RESET_SECONDS', '30'))
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+
+    async def before_call(self):
+        """Return once a call may go through; sleeps while the circuit is open"""
+        while True:
+            if self.state == self.CLOSED:
+                return
+            now = self.clock.monotonic()
+            if self.state == self.OPEN:
+                reopen_at = self.opened_at + self.reset_timeout
+                if now >= reopen_at:
+                    self.state = self.HALF_OPEN
+                    logger.info("Circuit half-open, probing gateway")
+                    return
+                await self.clock.sleep(reopen_at - now)
+            else:
+                # A probe is in flight; wait for its verdict
+                await self.clock.sleep(min(1.0, self.reset_timeout))
+
+    async def ready(self):
+        """Wait out an open circuit without taking the half-open probe"""
+        while self.state == self.OPEN:
+            now = self.clock.monotonic()
+            reopen_at = self.opened_at + self.reset_timeout
+            if now >= reopen_at:
+                return
+            await self.clock.sleep(reopen_at - now)
+
+    def release(self):
+        """The probe ended without a verdict (cancelled, or it blew up): let the next caller probe"""
+        if self.state == self.HALF_OPEN:
+            self.state = self.OPEN
+            self.opened_at = self.clock.monotonic() - self.reset_timeout
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info("Gateway recovered, circuit closed")
+        self.state = self.CLOSED
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(f"Circuit opened after {self.failures} gateway failures, pausing dispatch for {self.reset_timeout}s")
+            self.state = self.OPEN
+            self.opened_at = self.clock.monotonic()
@@ -0,0 +1,231 @@
+import asyncio
+import json
+import logging
+import os
+import uuid
+import zlib
+from datetime import datetime, timedelta, timezone
+
+import bson
+from bson.binary import Binary
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from image_store import ImageStore
+
+logger = logging.getLogger(__name__)
+
+# Tiered retention for finished schedules:
+#   1. compact - sent rows lose their inline image (moved to the image store)
+#                and keep only the useful part of the gateway response
+#   2. archive - finished rows older than RETENTION_ARCHIVE_AFTER_DAYS move to
+#                schedule_archive as one zlib-compressed BSON blob each
+#   3. purge   - a TTL index drops archived rows after RETENTION_ARCHIVE_TTL_DAYS,
+#                and images nothing references any more are deleted
+# Every phase walks small batches and sleeps between them, so a run never
+# competes with the send path for Mongo.
+
+ARCHIVE_AFTER_DAYS = float(os.environ.get('RETENTION_ARCHIVE_AFTER_DAYS', '90'))
+ARCHIVE_TTL_DAYS = float(os.environ.get('RETENTION_ARCHIVE_TTL_DAYS', '730'))
+RETENTION_BATCH_SIZE = int(os.environ.get('RETENTION_BATCH_SIZE', '200'))
+RETENTION_PAUSE_SECONDS = float(os.environ.get('RETENTION_PAUSE_SECONDS', '0.5'))
+RETENTION_INTERVAL_HOURS = float(os.environ.get('RETENTION_INTERVAL_HOURS', '24'))
+IMAGE_GRACE = timedelta(days=1)  # never collect an image uploaded or reused this recently
+
+FINISHED_STATUSES = ["sent", "failed", "canceled"]
+
+def compact_gateway_response(response):
+    """The part of a gateway response worth keeping once a row is sent"""
+    if not isinstance(response, dict):
+        return response
+    compact = {key: response[key] for key in ("code", "message", "status_code", "error") if key in response}
+    results = response.get("results")
+    if isinstance(results, dict) and results.get("message_id"):
+        compact["message_id"] = results["message_id"]
+    return compact
+
+def archive_doc(row: dict, now: datetime) -> dict:
+    """Compressed archive entry; a few fields stay queryable next to the blob"""
+    row = {k: v for k, v in row.items() if k != "_id"}
+    return {
+        "_id": row["id"],
+        "phone": row.get("phone"),
+        "status": row.get("status"),
+        "send_at": row.get("send_at"),
+        "sent_at": row.get("sent_at"),
+        "image_id": row.get("image_id"),
+        "recurrence_id": row.get("recurrence_id"),
+        "archived_at": now,
+        "data": Binary(zlib.compress(bson.encode(row))),
+    }
+
+def unpack_archive(doc: dict) -> dict:
+    return bson.decode(zlib.decompress(doc["data"]))
+
+def _size(value) -> int:
+    return len(json.dumps(value, default=str))
+
+class RetentionJob:
+    """One retention run over every phase; dry_run only counts what would change"""
+
+    def __init__(self, db: AsyncIOMotorDatabase, dry_run: bool = False):
+        self.db = db
+        self.images = ImageStore(db)
+        self.dry_run = dry_run
+        self.job_id = uuid.uuid4().hex
+        self.status = "running"
+        self.phase = None
+        self.started_at = datetime.now(timezone.utc)
+        self.finished_at = None
+        self.error = None
+        self.compacted = 0
+        self.images_offloaded = 0
+        self.archived = 0
+        self.archived_bytes = 0
+        self.archive_compressed_bytes = 0
+        self.images_deleted = 0
+        self.bytes_freed = 0
+
+    def progress(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "dry_run": self.dry_run,
+            "status": self.status,
+            "phase": self.phase,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "compacted": self.compacted,
+            "images_offloaded": self.images_offloaded,
+            "archived": self.archived,
+            "archived_bytes": self.archived_bytes,
+            "archive_compressed_bytes": self.archive_compressed_bytes,
+            "images_deleted": self.images_deleted,
+            "bytes_freed": self.bytes_freed,
+            "error": self.error,
+        }
+
+    async def run(self):
+        try:
+            for phase, step in (("compact", self.compact), ("archive", self.archive), ("images", self.collect_images)):
+                self.phase = phase
+                await step()
+            self.status = "done"
+        except Exception as e:
+            self.status = "failed"
+            self.error = str(e)
+            logger.error(f"Retention {self.job_id} failed in {self.phase}: {e}", exc_info=True)
+        finally:
+            self.phase = None
+            self.finished_at = datetime.now(timezone.utc)
+            verb = "would free" if self.dry_run else "freed"
+            logger.info(f"Retention {self.job_id}{' (dry run)' if self.dry_run else ''}: {self.compacted} compacted, "
+                        f"{self.archived} archived, {self.images_deleted} images deleted, {verb} ~{self.bytes_freed} bytes")
+
+    async def _pause(self):
+        await asyncio.sleep(RETENTION_PAUSE_SECONDS)
+
+    async def compact(self):
+        """Offload inline images of sent rows and trim their gateway responses"""
+        now = datetime.now(timezone.utc)
+        cursor = self.db.schedules.find(
+            {"status": "sent", "compacted_at": {"$exists": False}},
+            {"_id": 1, "image_base64": 1, "image_filename": 1, "gateway_response": 1},
+            batch_size=RETENTION_BATCH_SIZE
+        )
+        ops = []
+        async for row in cursor:
+            update = {"$set": {"compacted_at": now}}
+            if row.get("image_base64"):
+                self.images_offloaded += 1
+                self.bytes_freed += len(row["image_base64"])
+                if not self.dry_run:
+                    update["$set"]["image_id"] = await self.images.put_base64(row["image_base64"], row.get("image_filename"))
+                update["$unset"] = {"image_base64": ""}
+            response = row.get("gateway_response")
+            compact = compact_gateway_response(response)
+            if compact != response:
+                self.bytes_freed += max(0, _size(response) - _size(compact))
+                update["$set"]["gateway_response"] = compact
+            ops.append(UpdateOne({"_id": row["_id"]}, update))
+            self.compacted += 1
+
+            if len(ops) >= RETENTION_BATCH_SIZE:
+                await self._write(ops)
+                ops = []
+                await self._pause()
+        await self._write(ops)
+
+    async def _write(self, ops: list):
+        if ops and not self.dry_run:
+            await self.db.schedules.bulk_write(ops, ordered=False)
+
+    async def archive(self):
+        """Move finished rows older than ARCHIVE_AFTER_DAYS into schedule_archive"""
+        now = datetime.now(timezone.utc)
+        cursor = self.db.schedules.find(
+            {"status": {"$in": FINISHED_STATUSES}, "updated_at": {"$lt": now - timedelta(days=ARCHIVE_AFTER_DAYS)}},
+            batch_size=RETENTION_BATCH_SIZE
+        )
+        batch = []
+        async for row in cursor:
+            batch.append(row)
+            if len(batch) >= RETENTION_BATCH_SIZE:
+                await self._archive_batch(batch, now)
+                batch = []
+                await self._pause()
+        if batch:
+            await self._archive_batch(batch, now)
+
+    async def _archive_batch(self, rows: list, now: datetime):
+        docs = [archive_doc(row, now) for row in rows]
+        raw = sum(len(bson.encode({k: v for k, v in row.items() if k != "_id"})) for row in rows)
+        compressed = sum(len(doc["data"]) for doc in docs)
+        self.archived += len(rows)
+        self.archived_bytes += raw
+        self.archive_compressed_bytes += compressed
+        self.bytes_freed += raw
+        if self.dry_run:
+            return
+
+        try:
+            await self.db.schedule_archive.insert_many(docs, ordered=False)
+        except BulkWriteError as e:
+            # Already archived by an earlier, interrupted run: the copy is there, so deleting is safe
+            real = [err for err in e.details.get("writeErrors", []) if err.get("code") != 11000]
+            if real:
+                raise RuntimeError(f"{len(real)} archive inserts failed: {real[0].get('errmsg')}")
+        # Only rows still finished; a retry may have brought one back meanwhile
+        await self.db.schedules.delete_many({"id": {"$in": [row["id"] for row in rows]}, "status": {"$in": FINISHED_STATUSES}})
+
+    async def collect_images(self):
+        """Delete stored images that no schedule, campaign, series or archived row refers to"""
+        referenced = set()
+        for collection in (self.db.schedules, self.db.campaigns, self.db.recurrences, self.db.schedule_archive):
+            referenced.update(await collection.distinct("image_id"))
+
+        cutoff = datetime.now(timezone.utc) - IMAGE_GRACE
+        cursor = self.images.collection.find(
+            {"$or": [{"last_used_at": {"$lt": cutoff}}, {"last_used_at": {"$exists": False}, "created_at": {"$lt": cutoff}}]},
+            {"_id": 1, "size": 1},
+            batch_size=RETENTION_BATCH_SIZE
+        )
+        unused = []
+        async for image in cursor:
+            if image["_id"] not in referenced:
+                unused.append(image["_id"])
+                self.images_deleted += 1
+                self.bytes_freed += image.get("size") or 0
+            if len(unused) >= RETENTION_BATCH_SIZE:
+                await self._delete_images(unused, cutoff)
+                unused = []
+                await self._pause()
+        await self._delete_images(unused, cutoff)
+
+    async def _delete_images(self, image_ids: list, cutoff: datetime):
+        if image_ids and not self.dry_run:
+            # Re-check the grace period in the delete so an image re-used mid-run survives
+            await self.images.collection.delete_many({
+                "_id": {"$in": image_ids},
+                "$or": [{"last_used_at": {"$lt": cutoff}}, {"last_used_at": {"$exists": False}}]
+            })
@@ -0,0 +1,54 @@
+import logging
+from typing import Any, Callable, Dict, Iterable, Type
+
+from pydantic import BaseModel, TypeAdapter
+
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:  # optional: without it reads go through pydantic
+    orjson = None
+
+# Read endpoints serve documents that were validated when they were written,
+# so they skip pydantic on the way out: each document is cut down to the
+# response model's fields (filling that model's defaults) and handed to
+# orjson. OPT_UTC_Z makes aware UTC datetimes end in "Z" like pydantic's,
+# and naive ones (what Mongo returns) print identically in both.
+
+def _field_defaults(model: Type[BaseModel]) -> Dict[str, Any]:
+    defaults = {}
+    for name, field in model.model_fields.items():
+        if field.is_required() or field.default_factory is not None:
+            defaults[name] = None
+        else:
+            defaults[name] = field.default
+    return defaults
+
+def list_encoder(model: Type[BaseModel]) -> Callable[[Iterable[dict]], bytes]:
+    """Function turning raw documents into the JSON array response_model=List[model] would produce"""
+    if orjson is None:
+        adapter = TypeAdapter(list[model])
+        logger.info(f"orjson not installed, {model.__name__} lists are serialized through pydantic")
+        return lambda docs: adapter.dump_json(adapter.validate_python(list(docs)))
+
+    defaults = _field_defaults(model)
+    dumps = orjson.dumps
+    option = orjson.OPT_UTC_Z
+
+    def encode(docs: Iterable[dict]) -> bytes:
+        # One dict per row; the strings (base64 included) are shared, not copied
+        return dumps([{name: doc.get(name, default) for name, default in defaults.items()} for doc in docs],
+                     option=option, default=str)
+
+    return encode
+
+def item_encoder(model: Type[BaseModel]) -> Callable[[dict], bytes]:
+    """Single-document counterpart of list_encoder"""
+    if orjson is None:
+        return lambda doc: model(**doc).model_dump_json().encode()
+
+    defaults = _field_defaults(model)
+    dumps = orjson.dumps
+    option = orjson.OPT_UTC_Z
+    return lambda doc: dumps({name: doc.get(name, default) for name, default in defaults.items()}, option=option, default=str)
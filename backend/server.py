@@ -1,22 +1,45 @@
-from fastapi import FastAPI, APIRouter, UploadFile, File, HTTPException
+from fastapi import FastAPI, APIRouter, HTTPException, Request, Response
 from fastapi.staticfiles import StaticFiles
 from dotenv import load_dotenv
+from fastapi.responses import StreamingResponse
 from starlette.middleware.cors import CORSMiddleware
+from starlette.datastructures import UploadFile
+from starlette.formparsers import MultiPartException, MultiPartParser
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
 import os
 import logging
 import asyncio
 from pathlib import Path
 from typing import List, Optional
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 import pytz
 import shutil
+import hashlib
+import json
+import tempfile
 
-from models import Schedule, ScheduleCreate, ScheduleUpdate, BulkScheduleCreate
+from models import Schedule, ScheduleCreate, ScheduleUpdate, BulkScheduleCreate, BulkScheduleResult, ScheduleSummary
+from models import Campaign, CampaignCreate, CampaignSummary
+from models import Recurrence, RecurrenceCreate, RecurrenceUpdate
+from campaigns import FAILED, PENDING, new_campaign_doc
+import recurrences
 from markdown_converter import html_to_whatsapp_markdown
 from gateway import gateway
-from background_worker import BackgroundWorker
-from pydantic import BaseModel
+from background_worker import BackgroundWorker, as_utc
+from image_store import ImageStore
+from indexes import ensure_indexes, check_query_plans
+from pagination import InvalidCursor, keyset_filter, keyset_sort, next_cursor
+from bulk import BULK_CHUNK_SIZE, create_chunk, iter_ndjson_lines, shutdown_executor
+import idempotency
+from backup import ImportJob, export_lines, gzip_stream, maybe_gunzip
+import retention
+from serialization import item_encoder, list_encoder
+from receipts import ReceiptBuffer, parse_receipts, verify_signature
+import metrics
+from cache import ResponseCache
+from events import RELOAD, STATUS, Broadcaster, StatusFeed, status_event
+from pydantic import BaseModel, ValidationError
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -30,14 +53,56 @@ db = client[os.environ['DB_NAME']]
 UPLOADS_DIR = ROOT_DIR / 'uploads'
 UPLOADS_DIR.mkdir(exist_ok=True)
 
+# Image uploads are capped (a Mongo document tops out at 16 MB) and read in chunks
+MAX_IMAGE_BYTES = int(os.environ.get('MAX_IMAGE_BYTES', str(10 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = 64 * 1024
+MULTIPART_OVERHEAD_BYTES = 16 * 1024
+
 # Create the main app without a prefix
 app = FastAPI()
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
+# Images live once in a content-addressed store; schedules reference them by id
+image_store = ImageStore(db)
+
 # Initialize background worker
+# Set EMBEDDED_WORKER=false when senders run as separate processes (worker.py)
 worker = BackgroundWorker(db)
+EMBEDDED_WORKER = os.environ.get('EMBEDDED_WORKER', 'true').lower() == 'true'
+
+# Read-through cache for the dashboard's polled reads. Writes below and the
+# embedded worker's status changes invalidate it; changes made by a separate
+# worker process arrive through the status feed below, or only show up on
+# expiry without change streams, hence the shorter default TTL.
+response_cache = ResponseCache(ttl=float(os.environ.get('CACHE_TTL_SECONDS', '30' if EMBEDDED_WORKER else '5')))
+worker.add_listener(lambda event: response_cache.invalidate(event["id"], (event["previous"], event["status"])))
+
+# Live status events for open dashboards (GET /api/events). The embedded
+# worker publishes directly; a separate worker process is heard through a
+# change stream on schedules instead.
+broadcaster = Broadcaster()
+worker.add_listener(broadcaster.publish_status)
+
+def feed_changed(schedule_id: str):
+    # Change events carry no previous status, so every status list may be stale
+    response_cache.invalidate(schedule_id, SCHEDULE_STATUSES)
+
+status_feed = None if EMBEDDED_WORKER else StatusFeed(db, broadcaster, on_change=feed_changed)
+
+def receipts_applied(schedule_ids: List[str]):
+    for schedule_id in schedule_ids:
+        response_cache.invalidate(schedule_id, ("sent",))
+
+# Gateway delivery/read receipts, buffered and applied in bulk
+receipts = ReceiptBuffer(db, on_applied=receipts_applied)
+RECEIPT_WEBHOOK_SECRET = os.environ.get('RECEIPT_WEBHOOK_SECRET', '')
+
+# Reads skip pydantic: stored documents were validated on write
+encode_schedules = list_encoder(Schedule)
+encode_summaries = list_encoder(ScheduleSummary)
+encode_schedule = item_encoder(Schedule)
 
 # Configure logging
 logging.basicConfig(
@@ -46,6 +111,109 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+async def store_inline_image(data: dict, cache: Optional[dict] = None) -> dict:
+    """Swap an inline image_base64 payload for an image_id reference into the image store.
+
+    A client-supplied image_id must already be in the store (422 otherwise),
+    so a typo fails here rather than at send time.
+    """
+    image_base64 = data.pop('image_base64', None)
+    if image_base64:
+        if cache is not None and image_base64 in cache:
+            data['image_id'] = cache[image_base64]
+        else:
+            data['image_id'] = await image_store.put_base64(image_base64, data.get('image_filename'))
+            if cache is not None:
+                cache[image_base64] = data['image_id']
+    elif data.get('image_id'):
+        # ":" is not in the base64 alphabet, so these never clash with payload keys
+        known = f"id:{data['image_id']}"
+        if cache is None or known not in cache:
+            if not await image_store.exists(data['image_id']):
+                raise HTTPException(status_code=422, detail=f"Unknown image_id {data['image_id']}")
+            if cache is not None:
+                cache[known] = data['image_id']
+    return data
+
+# Summary rows leave out message_html and image payloads
+SUMMARY_PROJECTION = {
+    "_id": 0, "id": 1, "phone": 1, "message_md": 1, "send_at": 1, "status": 1,
+    "sent_at": 1, "delivery_status": 1, "image_id": 1, "image_filename": 1,
+    "has_image": {"$or": [
+        {"$ifNull": ["$image_id", False]},
+        {"$ifNull": ["$image_base64", False]}
+    ]}
+}
+MAX_PAGE_SIZE = 500
+HISTORY_STATUSES = ["sent", "failed", "canceled"]
+SCHEDULE_STATUSES = ["scheduled", "sending", *HISTORY_STATUSES]
+
+async def find_page(query: dict, sort_field: str, limit: int, cursor: Optional[str],
+                    headers: dict, projection: Optional[dict] = None) -> list:
+    """One keyset page; the next page's cursor goes out in the X-Next-Cursor header"""
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    try:
+        page_filter = keyset_filter(sort_field, cursor)
+    except InvalidCursor as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if page_filter:
+        query = {"$and": [query, page_filter]}
+
+    rows = await db.schedules.find(query, projection).sort(keyset_sort(sort_field)).limit(limit).to_list(length=limit)
+    cursor_out = next_cursor(rows, sort_field, limit)
+    if cursor_out:
+        headers["X-Next-Cursor"] = cursor_out
+    return rows
+
+async def cached_read(request: Request, tags: List[str], build) -> Response:
+    """Serve a GET from the response cache; on a miss build(headers) returns the JSON body to store"""
+    key = (request.url.path, request.url.query)
+    entry = response_cache.get(key)
+    if entry is None:
+        generations = response_cache.snapshot(tags)
+        headers = {}
+        body = await build(headers)
+        entry = response_cache.put(key, generations, body, headers)
+    return entry.response(request)
+
+def status_tags(statuses: List[str]) -> List[str]:
+    return [f"status:{s}" for s in statuses]
+
+def history_query(status: Optional[str]) -> dict:
+    # Only show sent, failed, or canceled unless a status is given
+    return {"status": status} if status else {"status": {"$in": HISTORY_STATUSES}}
+
+async def dispatch_new(schedule_dict: dict):
+    """Send a just-written schedule now if it is past due, else put it on the worker's timeline"""
+    response_cache.invalidate(statuses=["scheduled"])
+    if as_utc(schedule_dict['send_at']) <= datetime.now(timezone.utc):
+        logger.info(f"Schedule {schedule_dict['id']} is past due, sending immediately")
+        await worker.enqueue(schedule_dict)
+    else:
+        worker.notify(schedule_dict['id'], schedule_dict['send_at'])
+
+def idempotency_key(request: Request, default: Optional[str] = None) -> Optional[str]:
+    key = request.headers.get(idempotency.HEADER, default)
+    if key is not None and not idempotency.valid_key(key):
+        raise HTTPException(status_code=400, detail=f"{idempotency.HEADER} must be 1-{idempotency.MAX_KEY_LENGTH} characters")
+    return key
+
+def idempotent_replay(record: dict, request_fingerprint: str, response: Response):
+    """The stored response of the earlier request with this key, or the reason it cannot be replayed"""
+    problem = idempotency.conflict(record, request_fingerprint)
+    if problem:
+        raise HTTPException(status_code=problem[0], detail=problem[1])
+    response.headers["Idempotent-Replayed"] = "true"
+    return record["response"]
+
+def key_items(key: Optional[str], items):
+    """Give each (index, data) item without its own idempotency_key one derived from the request's key"""
+    if key:
+        for index, data in items:
+            if not data.get("idempotency_key"):
+                data["idempotency_key"] = f"{key}:{index}"
+    return items
+
 # Debug route for testing gateway
 class DebugSendRequest(BaseModel):
     phone: str
@@ -80,34 +248,88 @@ async def debug_send(request: DebugSendRequest):
         logger.error(f"Debug send error: {e}")
         return {"success": False, "error": str(e)}
 
+async def iter_upload(upload: UploadFile):
+    while chunk := await upload.read(UPLOAD_CHUNK_BYTES):
+        yield chunk
+
+async def read_capped(chunks) -> tuple:
+    """Collect an upload chunk by chunk, hashing as it goes and stopping at the size cap.
+
+    Returns the bytearray itself; the image store copies it once, into the BSON payload.
+    """
+    hasher = hashlib.sha256()
+    buffer = bytearray()
+    async for chunk in chunks:
+        if len(buffer) + len(chunk) > MAX_IMAGE_BYTES:
+            raise HTTPException(status_code=413, detail=f"Image exceeds {MAX_IMAGE_BYTES} bytes")
+        hasher.update(chunk)
+        buffer += chunk
+    return buffer, hasher.hexdigest()
+
+async def cap_stream(chunks, limit: int):
+    """Pass a request body through, failing with 413 as soon as more than limit bytes arrived"""
+    received = 0
+    async for chunk in chunks:
+        received += len(chunk)
+        if received > limit:
+            raise HTTPException(status_code=413, detail=f"Image exceeds {MAX_IMAGE_BYTES} bytes")
+        yield chunk
+
 # Upload endpoint
 @api_router.post("/uploads/image")
-async def upload_image(file: UploadFile = File(...)):
-    """Upload an image file and return base64 encoding"""
+async def upload_image(request: Request):
+    """Stream an image into the image store and return a short reference to it.
+
+    Accepts multipart/form-data with a ``file`` field (what the dashboard
+    sends) or a raw image body with the name in an X-Filename header.
+    """
     try:
-        import base64
-        
-        # Read file content
-        file_content = await file.read()
+        # Reject oversized uploads before reading a single byte
+        content_length = request.headers.get('content-length')
+        try:
+            declared = int(content_length) if content_length else None
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid Content-Length header")
+        if declared is not None and declared > MAX_IMAGE_BYTES + MULTIPART_OVERHEAD_BYTES:
+            raise HTTPException(status_code=413, detail=f"Image exceeds {MAX_IMAGE_BYTES} bytes")
+
+        if request.headers.get('content-type', '').startswith('multipart/form-data'):
+            # Capped while it streams in, so a chunked (or understated) body cannot run past the limit
+            body = cap_stream(request.stream(), MAX_IMAGE_BYTES + MULTIPART_OVERHEAD_BYTES)
+            try:
+                form = await MultiPartParser(request.headers, body, max_files=1, max_fields=5).parse()
+            except MultiPartException as e:
+                raise HTTPException(status_code=400, detail=e.message)
+            try:
+                file = form.get('file')
+                if not isinstance(file, UploadFile):
+                    raise HTTPException(status_code=400, detail="Missing file field")
+                original_name = file.filename or 'image.jpg'
+                file_content, image_id = await read_capped(iter_upload(file))
+            finally:
+                await form.close()
+        else:
+            original_name = request.headers.get('x-filename') or 'image.jpg'
+            file_content, image_id = await read_capped(request.stream())
         
         # Verify file is not empty
         if len(file_content) == 0:
             raise HTTPException(status_code=400, detail="File is empty")
         
-        # Convert to base64
-        image_base64 = base64.b64encode(file_content).decode('utf-8')
-        
         # Generate filename for reference
-        ext = file.filename.split('.')[-1] if '.' in file.filename else 'jpg'
-        filename = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{file.filename}"
-        
-        logger.info(f"Image uploaded and encoded: {filename} ({len(file_content)} bytes)")
+        filename = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{Path(original_name).name}"
+
+        # Stored once; uploading the same image again is a no-op
+        await image_store.put(file_content, filename=filename, image_id=image_id)
+
+        logger.info(f"Image uploaded: {filename} ({len(file_content)} bytes) -> {image_id}")
         
         return {
             "success": True,
+            "image_id": image_id,
             "filename": filename,
-            "image_base64": image_base64,
-            "size": len(file_content)
+            "size": len(file_content),
+            "url": f"/api/images/{image_id}"
         }
     except HTTPException:
         raise
@@ -117,119 +339,286 @@ async def upload_image(file: UploadFile = File(...)):
 
 # Schedule CRUD endpoints
 @api_router.post("/schedules", response_model=Schedule)
-async def create_schedule(schedule_data: ScheduleCreate):
-    """Create a new schedule (pure database operation)"""
+async def create_schedule(schedule_data: ScheduleCreate, request: Request, response: Response):
+    """Create a new schedule (pure database operation); a repeated Idempotency-Key replays the first response"""
+    key = idempotency_key(request, schedule_data.idempotency_key)
+    if key:
+        request_fingerprint = idempotency.fingerprint(schedule_data.model_dump(exclude={"idempotency_key"}))
+        record = await idempotency.begin(db, idempotency.SCHEDULES, key, request_fingerprint)
+        if record:
+            return Schedule(**idempotent_replay(record, request_fingerprint, response))
     try:
         # Convert HTML to markdown
         markdown = html_to_whatsapp_markdown(schedule_data.message_html)
 
         # Create dict and set message_md
-        schedule_dict = schedule_data.dict()
+        schedule_dict = schedule_data.model_dump()
         schedule_dict['message_md'] = markdown
+        await store_inline_image(schedule_dict)
 
         schedule = Schedule(**schedule_dict)
 
         # Simple database insert - use model_dump with mode='python' to preserve datetime objects
-        await db.schedules.insert_one(schedule.model_dump(mode='python'))
+        doc = schedule.model_dump(mode='python', exclude={'image_base64'})
+        await db.schedules.insert_one(doc)
+        if key:
+            doc.pop('_id', None)
+            await idempotency.complete(db, idempotency.SCHEDULES, key, doc)
 
         logger.info(f"Created schedule {schedule.id} for {schedule.send_at}")
+        broadcaster.publish(STATUS, status_event(schedule.id, "scheduled"))
 
         # If send_at is in the past, send immediately
-        now_utc = datetime.now(timezone.utc)
-        if schedule.send_at <= now_utc:
-            logger.info(f"Schedule {schedule.id} is past due, sending immediately")
-            asyncio.create_task(worker._send_schedule(schedule.dict()))
+        await dispatch_new(schedule.model_dump(mode='python'))
 
         return schedule
+    except HTTPException:
+        if key:
+            await idempotency.release(db, idempotency.SCHEDULES, key)
+        raise
     except Exception as e:
         logger.error(f"Create schedule error: {e}")
+        if key:
+            await idempotency.release(db, idempotency.SCHEDULES, key)
         raise HTTPException(status_code=500, detail=str(e))
 
-@api_router.post("/schedules/bulk", response_model=List[Schedule])
-async def create_bulk_schedules(bulk_data: BulkScheduleCreate):
-    """Create multiple schedules at once (pure database operation)"""
+@api_router.post("/schedules/bulk", response_model=BulkScheduleResult)
+async def create_bulk_schedules(bulk_data: BulkScheduleCreate, request: Request, response: Response):
+    """Create multiple schedules at once.
+
+    Returns the schedules created, and an {"index", "error"} entry for each
+    item that was not (X-Bulk-Failed counts them).
+
+    Items are idempotent by their own idempotency_key, or by "<Idempotency-Key>:<index>"
+    when the request carries the header; already-created items come back as they
+    were (X-Bulk-Replayed counts them) without being written or sent again.
+    """
+    key = idempotency_key(request)
     try:
-        schedules = []
-        for schedule_data in bulk_data.schedules:
-            markdown = html_to_whatsapp_markdown(schedule_data.message_html)
-            schedule_dict = schedule_data.dict()
-            schedule_dict['message_md'] = markdown
-            schedule = Schedule(**schedule_dict)
-            schedules.append(schedule.model_dump(mode='python'))
+        items = key_items(key, [(index, item.model_dump()) for index, item in enumerate(bulk_data.schedules)])
+        image_ids = {}  # the same devotion image is usually repeated across items
 
-        if schedules:
-            # Simple database insert - no tasks, no futures
-            await db.schedules.insert_many(schedules)
+        async def store_image(data):
+            return await store_inline_image(data, image_ids)
 
-        logger.info(f"Created {len(schedules)} schedules via bulk add")
+        created, failed, replayed = [], [], 0
+        for start in range(0, len(items), BULK_CHUNK_SIZE):
+            # Past-due items are enqueued as they land (enqueue waits when the dispatch queue is full)
+            chunk_created, results = await create_chunk(db, items[start:start + BULK_CHUNK_SIZE], store_image, dispatch_new)
+            created.extend(chunk_created)
+            failed.extend(r for r in results if r["status"] == "error")
+            replayed += sum(1 for r in results if r["status"] == "replayed")
 
-        # Send past-due schedules immediately
-        now_utc = datetime.now(timezone.utc)
-        for schedule_dict in schedules:
-            if schedule_dict['send_at'] <= now_utc:
-                logger.info(f"Schedule {schedule_dict['id']} is past due, sending immediately")
-                asyncio.create_task(worker._send_schedule(schedule_dict))
+        logger.info(f"Created {len(created) - replayed} schedules via bulk add ({len(failed)} failed, {replayed} replayed)")
+        if len(created) > replayed:
+            broadcaster.publish(RELOAD, {"created": len(created) - replayed})
+        if failed:
+            logger.warning(f"Bulk add item errors: {failed[:10]}")
+            response.headers["X-Bulk-Failed"] = str(len(failed))
+        if replayed:
+            response.headers["X-Bulk-Replayed"] = str(replayed)
 
-        return [Schedule(**s) for s in schedules]
+        return BulkScheduleResult(
+            schedules=[Schedule(**s) for s in created],
+            errors=[{"index": r["index"], "error": r["error"]} for r in failed],
+            replayed=replayed
+        )
     except Exception as e:
         logger.error(f"Bulk create error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@api_router.post("/schedules/bulk/ndjson")
+async def create_bulk_schedules_ndjson(request: Request):
+    """Bulk create from an NDJSON body, one ScheduleCreate object per line.
+
+    The body is consumed chunk by chunk (BULK_CHUNK_SIZE items at a time)
+    and the response is NDJSON: one result per input line ({"index",
+    "status", "id" | "error"}, index being the 1-based line number) and a
+    final {"summary": ...} line. Results are spooled to a temporary file, so
+    a batch of any size never sits in memory. Idempotency keys work as for
+    /schedules/bulk, derived keys using the line number.
+    """
+    key = idempotency_key(request)
+    image_ids = {}
+    counts = {"created": 0, "replayed": 0, "error": 0}
+    chunk = []
+    results = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+
+    async def store_image(data):
+        # Only remember a handful of recent payloads; dedup still happens in the store
+        if len(image_ids) > 16:
+            image_ids.clear()
+        return await store_inline_image(data, image_ids)
+
+    def emit(result):
+        counts[result["status"]] += 1
+        results.write(json.dumps(result).encode() + b"\n")
+
+    async def flush():
+        _, chunk_results = await create_chunk(db, chunk, store_image, dispatch_new)
+        chunk.clear()
+        for result in chunk_results:
+            emit(result)
+
+    try:
+        async for line_no, line in iter_ndjson_lines(request.stream()):
+            try:
+                chunk.extend(key_items(key, [(line_no, ScheduleCreate.model_validate_json(line).model_dump())]))
+            except ValidationError as e:
+                emit({"index": line_no, "status": "error", "error": str(e)})
+                continue
+            if len(chunk) >= BULK_CHUNK_SIZE:
+                await flush()
+        if chunk:
+            await flush()
+    except Exception as e:
+        results.close()
+        logger.error(f"NDJSON bulk create error: {e}")
+        raise HTTPException(status_code=500, detail=f"{e} ({counts['created']} created before the error)")
+
+    logger.info(f"NDJSON bulk add: {counts['created']} created, {counts['error']} failed")
+    if counts["created"]:
+        broadcaster.publish(RELOAD, {"created": counts["created"]})
+    results.write(json.dumps({"summary": counts}).encode() + b"\n")
+    results.seek(0)
+
+    def read_results():
+        try:
+            while block := results.read(64 * 1024):
+                yield block
+        finally:
+            results.close()
+
+    return StreamingResponse(read_results(), media_type="application/x-ndjson")
+
 @api_router.get("/schedules", response_model=List[Schedule])
-async def get_schedules(status: Optional[str] = None, limit: int = 100):
-    """Get all schedules with optional status filter (pure database read)"""
+async def get_schedules(request: Request, status: Optional[str] = None, limit: int = 100, cursor: Optional[str] = None):
+    """Get all schedules with optional status filter (cached, ETag-aware)"""
     try:
         query = {}
         if status:
             query["status"] = status
         
-        cursor = db.schedules.find(query).sort("send_at", -1).limit(limit)
-        schedules = await cursor.to_list(length=limit)
-        return [Schedule(**s) for s in schedules]
+        async def build(headers):
+            schedules = await find_page(query, "send_at", limit, cursor, headers)
+            return encode_schedules(schedules)
+
+        return await cached_read(request, status_tags([status]) if status else ["all"], build)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Get schedules error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@api_router.get("/schedules/{schedule_id}", response_model=Schedule)
-async def get_schedule(schedule_id: str):
-    """Get a specific schedule (pure database read)"""
-    schedule = await db.schedules.find_one({"id": schedule_id})
+@api_router.get("/schedules/summary", response_model=List[ScheduleSummary])
+async def get_schedule_summaries(request: Request, status: Optional[str] = None, limit: int = 100, cursor: Optional[str] = None):
+    """Lightweight schedule list for the dashboard, paged by X-Next-Cursor"""
+    query = {"status": status} if status else {}
+
+    async def build(headers):
+        rows = await find_page(query, "send_at", limit, cursor, headers, SUMMARY_PROJECTION)
+        return encode_summaries(rows)
+
+    return await cached_read(request, status_tags([status]) if status else ["all"], build)
+
+@api_router.get("/schedules/counts")
+async def get_schedule_counts(request: Request):
+    """Number of schedules per status, counted server-side"""
+    async def build(headers):
+        counts = {}
+        async for row in db.schedules.aggregate([{"$group": {"_id": "$status", "count": {"$sum": 1}}}]):
+            counts[row["_id"]] = row["count"]
+        counts["total"] = sum(counts.values())
+        return json.dumps(counts).encode()
+
+    return await cached_read(request, ["all"], build)
+
+@api_router.get("/schedules/{schedule_id}/image")
+async def get_schedule_image(schedule_id: str):
+    """Image attached to a schedule, as raw bytes"""
+    schedule = await db.schedules.find_one({"id": schedule_id}, {"image_id": 1, "image_base64": 1})
     if not schedule:
         raise HTTPException(status_code=404, detail="Schedule not found")
-    return Schedule(**schedule)
+    if schedule.get("image_id"):
+        return await get_image(schedule["image_id"])
+    if schedule.get("image_base64"):
+        import base64
+        from image_store import sniff_content_type
+        image_bytes = base64.b64decode(schedule["image_base64"])
+        return Response(content=image_bytes, media_type=sniff_content_type(image_bytes))
+    raise HTTPException(status_code=404, detail="Schedule has no image")
 
-@api_router.put("/schedules/{schedule_id}", response_model=Schedule)
-async def update_schedule(schedule_id: str, update_data: ScheduleUpdate):
-    """Update a schedule (pure database update)"""
-    try:
-        # Get existing schedule
+@api_router.get("/images/{image_id}")
+async def get_image(image_id: str):
+    """Image bytes from the content-addressed store (immutable, cacheable forever)"""
+    doc = await image_store.collection.find_one({"_id": image_id})
+    if not doc:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return Response(
+        content=doc["data"],
+        media_type=doc.get("content_type") or "image/jpeg",
+        headers={"Cache-Control": "public, max-age=31536000, immutable", "ETag": f'"{image_id}"'}
+    )
+
+@api_router.get("/schedules/{schedule_id}", response_model=Schedule)
+async def get_schedule(request: Request, schedule_id: str):
+    """Get a specific schedule (cached, ETag-aware)"""
+    async def build(headers):
         schedule = await db.schedules.find_one({"id": schedule_id})
         if not schedule:
             raise HTTPException(status_code=404, detail="Schedule not found")
+        return encode_schedule(schedule)
 
+    return await cached_read(request, [f"schedule:{schedule_id}"], build)
+
+@api_router.put("/schedules/{schedule_id}", response_model=Schedule)
+async def update_schedule(schedule_id: str, update_data: ScheduleUpdate):
+    """Update a schedule (pure database update)"""
+    try:
         # Prepare update
-        update_dict = {k: v for k, v in update_data.dict().items() if v is not None}
+        update_dict = {k: v for k, v in update_data.model_dump().items() if v is not None}
 
         # If message_html is updated, regenerate markdown
         if "message_html" in update_dict:
             update_dict["message_md"] = html_to_whatsapp_markdown(update_dict["message_html"])
 
         update_dict["updated_at"] = datetime.now(timezone.utc)
+        update_ops = {"$set": update_dict}
+
+        # A new inline image goes to the image store; drop any legacy payload
+        if "image_base64" in update_dict:
+            update_ops.setdefault("$unset", {})["image_base64"] = ""
+        await store_inline_image(update_dict)
+        # A new send time starts over; a pending retry backoff belonged to the old one
+        if "send_at" in update_dict:
+            update_ops.setdefault("$unset", {})["next_attempt_at"] = ""
 
-        # Simple database update - no tasks, no futures
-        await db.schedules.update_one(
+        # One atomic round trip that returns the updated document
+        updated_schedule = await db.schedules.find_one_and_update(
             {"id": schedule_id},
-            {"$set": update_dict}
+            update_ops,
+            return_document=ReturnDocument.AFTER
         )
+        if not updated_schedule:
+            raise HTTPException(status_code=404, detail="Schedule not found")
 
-        updated_schedule = await db.schedules.find_one({"id": schedule_id})
+        # A status edit may have moved it out of any list
+        changed = SCHEDULE_STATUSES if "status" in update_dict else [updated_schedule["status"]]
+        response_cache.invalidate(schedule_id, changed)
+        previous = None if "status" in update_dict else updated_schedule["status"]
+        broadcaster.publish(STATUS, status_event(schedule_id, updated_schedule["status"], previous, updated_schedule.get("sent_at")))
         logger.info(f"Updated schedule {schedule_id}")
 
-        # If schedule is still "scheduled" and send_at is in the past, send immediately
+        # If schedule is still "scheduled" and due (send_at, or a retry's backoff) has passed, send immediately
         now_utc = datetime.now(timezone.utc)
-        if updated_schedule['status'] == 'scheduled' and updated_schedule['send_at'] <= now_utc:
+        due_at = updated_schedule.get('next_attempt_at') or updated_schedule['send_at']
+        if updated_schedule['status'] != 'scheduled':
+            worker.forget(schedule_id)
+        elif as_utc(due_at) <= now_utc:
             logger.info(f"Schedule {schedule_id} is past due, sending immediately")
-            asyncio.create_task(worker._send_schedule(updated_schedule))
+            await worker.enqueue(updated_schedule)
+        else:
+            worker.notify(schedule_id, due_at)
 
         return Schedule(**updated_schedule)
     except HTTPException:
@@ -242,10 +631,13 @@ async def update_schedule(schedule_id: str, update_data: ScheduleUpdate):
 async def delete_schedule(schedule_id: str):
     """Delete a schedule (pure database delete)"""
     # Simple database delete - no task cancellation needed
-    result = await db.schedules.delete_one({"id": schedule_id})
-    if result.deleted_count == 0:
+    deleted = await db.schedules.find_one_and_delete({"id": schedule_id}, projection={"_id": 0, "status": 1})
+    if deleted is None:
         raise HTTPException(status_code=404, detail="Schedule not found")
     
+    response_cache.invalidate(schedule_id, (deleted.get("status"),))
+    broadcaster.publish(STATUS, status_event(schedule_id, "deleted", deleted.get("status")))
+    worker.forget(schedule_id)
     logger.info(f"Deleted schedule {schedule_id}")
     return {"success": True}
 
@@ -253,22 +645,28 @@ async def delete_schedule(schedule_id: str):
 async def retry_schedule(schedule_id: str):
     """Retry sending a failed schedule (pure database update)"""
     try:
-        schedule = await db.schedules.find_one({"id": schedule_id})
-        if not schedule:
-            raise HTTPException(status_code=404, detail="Schedule not found")
-        
-        # Reset status to scheduled and set new send time to now
-        # Background worker will pick it up in the next cycle
-        await db.schedules.update_one(
+        # Reset status to scheduled and set new send time to now; the previous
+        # status comes back from the same round trip
+        # Wake the background worker so it picks it up right away
+        now_utc = datetime.now(timezone.utc)
+        schedule = await db.schedules.find_one_and_update(
             {"id": schedule_id},
             {
                 "$set": {
                     "status": "scheduled",
-                    "send_at": datetime.now(timezone.utc),
-                    "updated_at": datetime.now(timezone.utc)
-                }
-            }
+                    "send_at": now_utc,
+                    "attempts": 0,
+                    "updated_at": now_utc
+                },
+                "$unset": {"next_attempt_at": ""}
+            },
+            projection={"_id": 0, "status": 1}
         )
+        if not schedule:
+            raise HTTPException(status_code=404, detail="Schedule not found")
+        response_cache.invalidate(schedule_id, (schedule.get("status"), "scheduled"))
+        broadcaster.publish(STATUS, status_event(schedule_id, "scheduled", schedule.get("status")))
+        worker.notify(schedule_id, now_utc)
         
         logger.info(f"Retry queued for schedule {schedule_id}")
         return {"success": True, "message": "Schedule queued for retry"}
@@ -278,52 +676,485 @@ async def retry_schedule(schedule_id: str):
         logger.error(f"Retry error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# Campaign endpoints: one body and image, many recipients
+CAMPAIGN_SUMMARY_PROJECTION = {"_id": 0, "message_html": 0, "recipients": 0, "vars": 0}
+
+@api_router.post("/campaigns", response_model=CampaignSummary)
+async def create_campaign(campaign_data: CampaignCreate):
+    """Create a broadcast campaign; recipients are fanned out by the worker at send_at"""
+    try:
+        data = await store_inline_image(campaign_data.model_dump())
+        markdown = html_to_whatsapp_markdown(data["message_html"])
+        doc = new_campaign_doc(data, markdown, datetime.now(timezone.utc))
+        await db.campaigns.insert_one(doc)
+        # Past-due campaigns pop straight off the worker's timeline
+        worker.notify(doc["id"], doc["send_at"])
+
+        logger.info(f"Created campaign {doc['id']} for {len(doc['recipients'])} recipients at {doc['send_at']}")
+        return CampaignSummary(**doc)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Create campaign error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/campaigns", response_model=List[CampaignSummary])
+async def get_campaigns(status: Optional[str] = None, limit: int = 100):
+    """Campaigns with delivery counts, newest send time first (no bodies or recipient lists)"""
+    query = {"status": status} if status else {}
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    campaigns = await db.campaigns.find(query, CAMPAIGN_SUMMARY_PROJECTION).sort(
+        [("send_at", -1), ("id", -1)]
+    ).limit(limit).to_list(length=limit)
+    return [CampaignSummary(**c) for c in campaigns]
+
+@api_router.get("/campaigns/{campaign_id}", response_model=Campaign)
+async def get_campaign(campaign_id: str):
+    """A campaign with per-recipient delivery status"""
+    campaign = await db.campaigns.find_one({"id": campaign_id}, {"_id": 0})
+    if not campaign:
+        raise HTTPException(status_code=404, detail="Campaign not found")
+    return Campaign(**campaign)
+
+@api_router.post("/campaigns/{campaign_id}/cancel")
+async def cancel_campaign(campaign_id: str):
+    """Stop a campaign; a running fan-out stops at its next batch write"""
+    result = await db.campaigns.update_one(
+        {"id": campaign_id, "status": {"$in": ["scheduled", "sending"]}},
+        {"$set": {"status": "canceled", "updated_at": datetime.now(timezone.utc)}, "$unset": {"lease_expires_at": ""}}
+    )
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="No scheduled or running campaign with that id")
+    worker.forget(campaign_id)
+    logger.info(f"Canceled campaign {campaign_id}")
+    return {"success": True}
+
+@api_router.post("/campaigns/{campaign_id}/retry")
+async def retry_campaign(campaign_id: str):
+    """Send again to the recipients that failed"""
+    try:
+        campaign = await db.campaigns.find_one({"id": campaign_id}, {"_id": 0, "recipients.status": 1, "status": 1})
+        if not campaign:
+            raise HTTPException(status_code=404, detail="Campaign not found")
+        if campaign["status"] in ("scheduled", "sending"):
+            raise HTTPException(status_code=409, detail="Campaign is still running")
+
+        failed = [i for i, r in enumerate(campaign["recipients"]) if r.get("status") == FAILED]
+        if not failed:
+            return {"success": True, "message": "No failed recipients to retry"}
+
+        now_utc = datetime.now(timezone.utc)
+        update = {f"recipients.{i}.{field}": value for i in failed for field, value in (("status", PENDING), ("attempts", 0))}
+        await db.campaigns.update_one(
+            {"id": campaign_id},
+            {
+                "$set": {**update, "status": "scheduled", "send_at": now_utc, "updated_at": now_utc},
+                "$inc": {f"counts.{FAILED}": -len(failed), f"counts.{PENDING}": len(failed)}
+            }
+        )
+        worker.notify(campaign_id, now_utc)
+        logger.info(f"Retry queued for {len(failed)} recipients of campaign {campaign_id}")
+        return {"success": True, "message": f"Retrying {len(failed)} recipients"}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Campaign retry error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.delete("/campaigns/{campaign_id}")
+async def delete_campaign(campaign_id: str):
+    """Delete a campaign"""
+    result = await db.campaigns.delete_one({"id": campaign_id})
+    if result.deleted_count == 0:
+        raise HTTPException(status_code=404, detail="Campaign not found")
+    worker.forget(campaign_id)
+    logger.info(f"Deleted campaign {campaign_id}")
+    return {"success": True}
+
+# Recurring series: one document, occurrences materialized by the worker shortly before they are due
+def notify_series(series: dict):
+    if series["status"] == recurrences.ACTIVE and series.get("next_at"):
+        worker.notify(series["id"], as_utc(series["next_at"]) - timedelta(seconds=worker.recurrence_lead))
+    else:
+        worker.forget(series["id"])
+
+def recurrence_response(series: dict, count: int = 5) -> Recurrence:
+    return Recurrence(**series, upcoming=recurrences.upcoming(series, count))
+
+@api_router.post("/recurrences", response_model=Recurrence)
+async def create_recurrence(recurrence_data: RecurrenceCreate):
+    """Create a recurring series (daily, weekly or RRULE, in its own timezone)"""
+    try:
+        data = await store_inline_image(recurrence_data.model_dump())
+        markdown = html_to_whatsapp_markdown(data["message_html"])
+        try:
+            doc = recurrences.new_recurrence_doc(data, markdown, datetime.now(timezone.utc))
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        await db.recurrences.insert_one(doc)
+        notify_series(doc)
+
+        logger.info(f"Created recurrence {doc['id']} ({doc['rule']}), first occurrence {doc['next_at']}")
+        return recurrence_response(doc)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Create recurrence error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.get("/recurrences", response_model=List[Recurrence])
+async def get_recurrences(status: Optional[str] = None, limit: int = 100):
+    """Recurring series, soonest next occurrence first"""
+    query = {"status": status} if status else {}
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    series = await db.recurrences.find(query, {"_id": 0}).sort([("next_at", 1), ("id", 1)]).limit(limit).to_list(length=limit)
+    return [recurrence_response(s) for s in series]
+
+@api_router.get("/recurrences/{recurrence_id}", response_model=Recurrence)
+async def get_recurrence(recurrence_id: str, upcoming: int = 10):
+    """A series with its next occurrences"""
+    series = await db.recurrences.find_one({"id": recurrence_id}, {"_id": 0})
+    if not series:
+        raise HTTPException(status_code=404, detail="Recurrence not found")
+    return recurrence_response(series, max(0, min(upcoming, 100)))
+
+@api_router.put("/recurrences/{recurrence_id}", response_model=Recurrence)
+async def update_recurrence(recurrence_id: str, update_data: RecurrenceUpdate):
+    """Edit a series; every occurrence not yet sent follows the change"""
+    try:
+        series = await db.recurrences.find_one({"id": recurrence_id}, {"_id": 0})
+        if not series:
+            raise HTTPException(status_code=404, detail="Recurrence not found")
+
+        update = {k: v for k, v in update_data.model_dump().items() if v is not None}
+        if update.get("status") not in (None, recurrences.ACTIVE, recurrences.PAUSED):
+            raise HTTPException(status_code=400, detail="status must be active or paused")
+        update = await store_inline_image(update)
+        if "message_html" in update:
+            update["message_md"] = html_to_whatsapp_markdown(update["message_html"])
+
+        now_utc = datetime.now(timezone.utc)
+        timing_changed = "status" in update or any(field in update for field in recurrences.RULE_FIELDS)
+        if timing_changed:
+            merged = {**series, **update}
+            if "starts_at" in update:
+                merged["dtstart"] = update["dtstart"] = update["starts_at"]
+            try:
+                merged["rule"] = update["rule"] = recurrences.build_rule(merged)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            if merged["status"] == recurrences.PAUSED:
+                update["next_at"] = None
+            else:
+                update["next_at"] = recurrences.next_occurrence(merged, max(as_utc(merged["dtstart"]), now_utc), inc=True)
+                update["status"] = recurrences.ACTIVE if update["next_at"] else recurrences.ENDED
+
+        # The revision bump makes a concurrent materialization of the old version back off
+        updated = await db.recurrences.find_one_and_update(
+            {"id": recurrence_id},
+            {"$set": {**update, "updated_at": now_utc}, "$inc": {"revision": 1}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+
+        # Occurrences already materialized but not sent: rematerialize on a new
+        # timing, otherwise just carry the new content over
+        occurrence_ids = [row["id"] for row in await db.schedules.find(
+            {"recurrence_id": recurrence_id, "status": "scheduled"}, {"_id": 0, "id": 1}
+        ).to_list(length=None)]
+        if occurrence_ids:
+            if timing_changed:
+                await db.schedules.delete_many({"id": {"$in": occurrence_ids}, "status": "scheduled"})
+                for occurrence_id in occurrence_ids:
+                    worker.forget(occurrence_id)
+            else:
+                content = {field: updated.get(field) for field in recurrences.CONTENT_FIELDS}
+                await db.schedules.update_many(
+                    {"id": {"$in": occurrence_ids}, "status": "scheduled"},
+                    {"$set": {**content, "updated_at": now_utc}}
+                )
+            for occurrence_id in occurrence_ids:
+                response_cache.invalidate(occurrence_id, ["scheduled"])
+            broadcaster.publish(RELOAD, {"recurrence": recurrence_id})
+
+        notify_series(updated)
+        logger.info(f"Updated recurrence {recurrence_id} ({len(occurrence_ids)} pending occurrence(s) {'reset' if timing_changed else 'updated'})")
+        return recurrence_response(updated)
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Update recurrence error: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api_router.delete("/recurrences/{recurrence_id}")
+async def delete_recurrence(recurrence_id: str):
+    """Delete a series and its unsent occurrences; sent ones stay in history"""
+    result = await db.recurrences.delete_one({"id": recurrence_id})
+    if result.deleted_count == 0:
+        raise HTTPException(status_code=404, detail="Recurrence not found")
+    worker.forget(recurrence_id)
+    occurrence_ids = [row["id"] for row in await db.schedules.find(
+        {"recurrence_id": recurrence_id, "status": "scheduled"}, {"_id": 0, "id": 1}
+    ).to_list(length=None)]
+    if occurrence_ids:
+        await db.schedules.delete_many({"id": {"$in": occurrence_ids}, "status": "scheduled"})
+        for occurrence_id in occurrence_ids:
+            worker.forget(occurrence_id)
+            response_cache.invalidate(occurrence_id, ["scheduled"])
+        broadcaster.publish(RELOAD, {"recurrence": recurrence_id})
+    logger.info(f"Deleted recurrence {recurrence_id} and {len(occurrence_ids)} pending occurrence(s)")
+    return {"success": True}
+
 # History endpoint (same as schedules but with filters)
 @api_router.get("/history", response_model=List[Schedule])
-async def get_history(status: Optional[str] = None, limit: int = 100):
-    """Get message history (pure database read)"""
+async def get_history(request: Request, status: Optional[str] = None, limit: int = 100, cursor: Optional[str] = None):
+    """Get message history (cached, ETag-aware)"""
     try:
-        query = {}
-        if status:
-            query["status"] = status
-        else:
-            # Only show sent, failed, or canceled
-            query["status"] = {"$in": ["sent", "failed", "canceled"]}
-        
-        cursor = db.schedules.find(query).sort("sent_at", -1).limit(limit)
-        schedules = await cursor.to_list(length=limit)
-        return [Schedule(**s) for s in schedules]
+        async def build(headers):
+            schedules = await find_page(history_query(status), "sent_at", limit, cursor, headers)
+            return encode_schedules(schedules)
+
+        return await cached_read(request, status_tags([status] if status else HISTORY_STATUSES), build)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Get history error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-# Import endpoint
+@api_router.get("/history/summary", response_model=List[ScheduleSummary])
+async def get_history_summaries(request: Request, status: Optional[str] = None, limit: int = 100, cursor: Optional[str] = None):
+    """Lightweight history list, paged by X-Next-Cursor"""
+    async def build(headers):
+        rows = await find_page(history_query(status), "sent_at", limit, cursor, headers, SUMMARY_PROJECTION)
+        return encode_summaries(rows)
+
+    return await cached_read(request, status_tags([status] if status else HISTORY_STATUSES), build)
+
+@api_router.get("/worker/stats")
+async def get_worker_stats():
+    """Send-lag figures measured by the background worker"""
+    return {
+        "upcoming_deadlines": len(worker._pending),
+        "dispatch_queue": worker.queue_depth(),
+        "active_campaigns": len(worker._campaigns),
+        "buffered_status_writes": worker.status_writer.pending(),
+        "gateways": gateway.stats(),
+        "response_cache": response_cache.stats(),
+        "send_lag": worker.lag_stats()
+    }
+
+# Export / import
 class ImportData(BaseModel):
     schedules: List[dict]
     replace_existing: bool = False
 
+# Progress of running and recently finished imports, by import_id
+import_jobs = {}
+MAX_TRACKED_IMPORTS = 20
+
+@api_router.get("/export")
+async def export_schedules(gzip: bool = False, include_images: bool = True):
+    """Stream every schedule (and stored image) as NDJSON, optionally gzipped"""
+    stamp = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+    body = export_lines(db, include_images=include_images)
+    if gzip:
+        return StreamingResponse(
+            gzip_stream(body),
+            media_type="application/gzip",
+            headers={"Content-Disposition": f'attachment; filename="devotion_scheduler_export_{stamp}.ndjson.gz"'}
+        )
+    return StreamingResponse(
+        body,
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="devotion_scheduler_export_{stamp}.ndjson"'}
+    )
+
 @api_router.post("/import")
-async def import_schedules(import_data: ImportData):
-    """Import schedules from exported JSON"""
+async def import_schedules(request: Request, response: Response, replace_existing: bool = False,
+                           import_id: Optional[str] = None):
+    """Import schedules from an export.
+
+    Takes the NDJSON export (plain or gzipped) as the raw body, or the legacy
+    JSON {"schedules": [...], "replace_existing": ...} document. Rows are
+    validated as they arrive and upserted by id in chunks, so an import can
+    be re-run safely. Progress is available from GET /import/{import_id}.
+    With an Idempotency-Key the body is streamed, so the key is matched on
+    the query and body size only; a repeat returns the first summary.
+    """
+    key = idempotency_key(request)
+    if key:
+        request_fingerprint = idempotency.fingerprint({
+            "replace_existing": replace_existing,
+            "content_type": request.headers.get("content-type"),
+            "content_length": request.headers.get("content-length"),
+        })
+        record = await idempotency.begin(db, idempotency.IMPORTS, key, request_fingerprint)
+        if record:
+            return idempotent_replay(record, request_fingerprint, response)
+
+    job = ImportJob(db, import_id)
+    if len(import_jobs) >= MAX_TRACKED_IMPORTS:
+        finished = [k for k, j in import_jobs.items() if j.status != "running"]
+        for job_id in finished[:len(import_jobs) - MAX_TRACKED_IMPORTS + 1]:
+            del import_jobs[job_id]
+    import_jobs[job.import_id] = job
+
     try:
-        if import_data.replace_existing:
+        if request.headers.get("content-type", "").startswith("application/json"):
+            import_data = ImportData.model_validate_json(await request.body())
+            rows = enumerate(import_data.schedules, start=1)
+            replace_existing = replace_existing or import_data.replace_existing
+        else:
+            rows = None
+
+        if replace_existing:
             # Clear existing schedules
             result = await db.schedules.delete_many({})
             logger.info(f"Deleted {result.deleted_count} existing schedules")
         
-        # Import schedules
-        if import_data.schedules:
-            await db.schedules.insert_many(import_data.schedules)
-            logger.info(f"Imported {len(import_data.schedules)} schedules")
-        
-        return {
+        if rows is not None:
+            for line_no, row in rows:
+                await job.feed(line_no, row)
+        else:
+            async for line_no, line in iter_ndjson_lines(maybe_gunzip(request.stream())):
+                try:
+                    row = json.loads(line)
+                except ValueError as e:
+                    job.error(line_no, f"invalid JSON: {e}")
+                    continue
+                if not isinstance(row, dict):
+                    job.error(line_no, "expected a JSON object")
+                    continue
+                await job.feed(line_no, row)
+        await job.finish()
+
+        response_cache.clear()
+        broadcaster.publish(RELOAD, {"imported": job.upserted + job.updated})
+        # Imported rows may be due sooner than anything the worker knows about
+        worker.reload()
+        imported = job.upserted + job.updated
+        logger.info(f"Import {job.import_id}: {job.upserted} inserted, {job.updated} updated, {job.error_count} rejected")
+        summary = {
             "success": True,
-            "imported_count": len(import_data.schedules),
-            "message": f"Successfully imported {len(import_data.schedules)} schedules"
+            "imported_count": imported,
+            "message": f"Successfully imported {imported} schedules",
+            **job.progress()
         }
+        if key:
+            await idempotency.complete(db, idempotency.IMPORTS, key, summary)
+        return summary
     except Exception as e:
+        job.status = "failed"
         logger.error(f"Import error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+        if key:
+            await idempotency.release(db, idempotency.IMPORTS, key)
+        raise HTTPException(status_code=500, detail=f"{e} ({job.processed} rows processed before the error)")
+
+@api_router.get("/import/{import_id}")
+async def get_import_progress(import_id: str):
+    """Progress of a running or recently finished import"""
+    job = import_jobs.get(import_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Import not found")
+    return job.progress()
+
+@api_router.post("/webhooks/gateway")
+async def gateway_webhook(request: Request):
+    """Delivery and read receipts from the gateway: acknowledged at once, applied in batches"""
+    body = await request.body()
+    if RECEIPT_WEBHOOK_SECRET and not verify_signature(RECEIPT_WEBHOOK_SECRET, body, request.headers.get("x-hub-signature-256")):
+        raise HTTPException(status_code=401, detail="Invalid webhook signature")
+    if receipts.full():
+        # Let the gateway retry later rather than grow without bound
+        raise HTTPException(status_code=503, detail="Receipt buffer full")
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON")
+    return {"accepted": receipts.add(parse_receipts(payload))}
+
+@api_router.get("/webhooks/gateway/stats")
+async def get_receipt_stats():
+    """Receipt ingestion counters"""
+    return receipts.stats()
+
+@api_router.get("/events")
+async def stream_events():
+    """Server-sent events for live dashboards.
+
+    "status" events carry {"id", "status", "previous", "sent_at", "error"}
+    for one schedule ("deleted" once it is gone; previous is null when not
+    known); "reload" means many rows changed at once. A client that falls
+    too far behind is disconnected and should reload when it reconnects.
+    """
+    return StreamingResponse(broadcaster.stream(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        # Stop nginx-style proxies from buffering the stream
+        "X-Accel-Buffering": "no",
+    })
+
+@api_router.get("/events/stats")
+async def get_event_stats():
+    """Connected dashboards and event counters"""
+    return {**broadcaster.stats(), "change_stream": status_feed is not None}
+
+# Retention: compaction, archival and image collection for finished history
+retention_job: Optional[retention.RetentionJob] = None
+retention_task: Optional[asyncio.Task] = None  # the periodic loop
+retention_run: Optional[asyncio.Task] = None  # the current run
+
+async def run_retention(job: retention.RetentionJob):
+    await job.run()
+    if not job.dry_run:
+        # Archived rows left the schedules collection
+        response_cache.clear()
+
+def start_retention(dry_run: bool) -> Optional[retention.RetentionJob]:
+    """Start a retention run in the background, unless one is already running"""
+    global retention_job, retention_run
+    if retention_job is not None and retention_job.status == "running":
+        return None
+    retention_job = retention.RetentionJob(db, dry_run=dry_run)
+    retention_run = asyncio.create_task(run_retention(retention_job))
+    return retention_job
+
+async def retention_loop():
+    while True:
+        await asyncio.sleep(retention.RETENTION_INTERVAL_HOURS * 3600)
+        job = start_retention(dry_run=False)
+        if job is not None:
+            logger.info(f"Scheduled retention run {job.job_id} started")
+
+@api_router.get("/retention")
+async def get_retention():
+    """Retention settings and the progress of the current or last run"""
+    return {
+        "archive_after_days": retention.ARCHIVE_AFTER_DAYS,
+        "archive_ttl_days": retention.ARCHIVE_TTL_DAYS,
+        "interval_hours": retention.RETENTION_INTERVAL_HOURS,
+        "job": retention_job.progress() if retention_job else None
+    }
+
+@api_router.post("/retention/run")
+async def run_retention_now(dry_run: bool = True):
+    """Start a retention run; dry_run (the default) only reports what it would do"""
+    job = start_retention(dry_run)
+    if job is None:
+        raise HTTPException(status_code=409, detail="A retention run is already in progress")
+    return job.progress()
+
+@api_router.get("/archive/{schedule_id}", response_model=Schedule)
+async def get_archived_schedule(schedule_id: str):
+    """A schedule that retention has moved to the archive"""
+    doc = await db.schedule_archive.find_one({"_id": schedule_id})
+    if not doc:
+        raise HTTPException(status_code=404, detail="Archived schedule not found")
+    return Schedule(**retention.unpack_archive(doc))
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus scrape endpoint"""
+    return Response(content=await metrics.render(), media_type=metrics.CONTENT_TYPE)
 
 # Include the router in the main app
 app.include_router(api_router)
@@ -340,20 +1171,53 @@ app.add_middleware(
     expose_headers=["*"],
     max_age=3600,
 )
+# Outermost, so handler latency includes every other middleware
+app.add_middleware(metrics.HTTPMetricsMiddleware)
+
+metrics.add_collector(metrics.database_collector(db))
+metrics.add_collector(metrics.gateway_collector(gateway))
+if EMBEDDED_WORKER:
+    metrics.add_collector(metrics.worker_collector(worker))
 
 @app.on_event("startup")
 async def startup_event():
     """Start the background worker in the same event loop"""
+    # Indexes first: every hot query below depends on them
+    await ensure_indexes(db)
+    await check_query_plans(db)
+
+    # Open the pooled gateway client before anything can send
+    await gateway.open()
+
     # Start background worker using asyncio.create_task
     # This ensures it runs in the same event loop as FastAPI
-    await worker.start()
-    logger.info("Application started with background worker")
+    if EMBEDDED_WORKER:
+        await worker.start()
+        logger.info("Application started with background worker")
+    else:
+        logger.info("Application started without embedded worker (run worker.py)")
+
+    receipts.start()
+    if status_feed:
+        status_feed.start()
+
+    global retention_task
+    if retention.RETENTION_INTERVAL_HOURS > 0:
+        retention_task = asyncio.create_task(retention_loop())
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Shutdown the background worker and close connections"""
-    # Stop background worker
+    for task in (retention_task, retention_run):
+        if task:
+            task.cancel()
+    # Stop background worker (drains in-flight sends), then the gateway pool
     await worker.stop()
+    await receipts.close()
+    if status_feed:
+        await status_feed.close()
+    await gateway.close()
+    shutdown_executor()
     # Close MongoDB connection
     client.close()
     logger.info("Application shut down")
@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import os
+from typing import Callable, List, Optional, Tuple
+
+from motor.motor_asyncio import AsyncIOMotorCollection
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, ConnectionFailure
+
+from clock import SYSTEM_CLOCK, Clock
+
+logger = logging.getLogger(__name__)
+
+class StatusWriter:
+    """Buffers final status writes from concurrent sends into one bulk_write.
+
+    A write waits at most flush_seconds (or until flush_size writes are
+    buffered) before it reaches Mongo; its callback runs only after that, so
+    listeners never announce a status readers cannot see yet. A buffered
+    schedule stays "sending" in the meantime, and write() returns a future
+    that settles once the write landed (True) or was dropped (False): the
+    caller keeps its lease alive until then, so nobody else can claim the
+    row. A write the batch could not make is retried on its own, then
+    reduced to its fallback update (just the final status), so a message
+    the gateway already took is not sent again when its lease expires.
+    close() flushes whatever is left on shutdown.
+    """
+
+    def __init__(self, collection: AsyncIOMotorCollection, flush_size: Optional[int] = None,
+                 flush_seconds: Optional[float] = None, clock: Clock = SYSTEM_CLOCK):
+        self.collection = collection
+        self.clock = clock
+        self.flush_size = flush_size if flush_size is not None else int(os.environ.get('STATUS_FLUSH_SIZE', '100'))
+        self.flush_seconds = flush_seconds if flush_seconds is not None else float(os.environ.get('STATUS_FLUSH_SECONDS', '0.25'))
+        # (filter, update, after, settled, fallback) per buffered write
+        self._ops: List[Tuple[dict, dict, Optional[Callable[[], None]], asyncio.Future, Optional[dict]]] = []
+        self._lock = asyncio.Lock()
+        self._has_ops = asyncio.Event()
+        self._task = None
+        self.flushes = 0
+
+    def start(self):
+        if self._task is None and self.flush_size > 1:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        """Stop the flush timer and write out everything still buffered"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+        if self._ops:
+            logger.error(f"{len(self._ops)} status writes could not be flushed; their leases will expire and they will be retried")
+            for _, _, _, settled, _ in self._ops:
+                settled.set_result(False)
+            self._ops = []
+
+    def pending(self) -> int:
+        return len(self._ops)
+
+    async def write(self, filter: dict, update: dict, after: Optional[Callable[[], None]] = None,
+                    fallback: Optional[dict] = None) -> asyncio.Future:
+        """Queue one update_one; after() runs once it is in Mongo. Returns the write's settled future.
+
+        fallback is a smaller update to apply instead if update itself keeps failing.
+        """
+        settled = asyncio.get_running_loop().create_future()
+        if self.flush_size <= 1 or self._task is None:
+            # Unbuffered (STATUS_FLUSH_SIZE=1, or the timer is not running)
+            await self.collection.update_one(filter, update)
+            self.flushes += 1
+            if after:
+                after()
+            settled.set_result(True)
+            return settled
+
+        self._ops.append((filter, update, after, settled, fallback))
+        if len(self._ops) >= self.flush_size:
+            await self.flush()
+        else:
+            self._has_ops.set()
+        return settled
+
+    async def flush(self):
+        async with self._lock:
+            ops, self._ops = self._ops, []
+            if not ops:
+                return
+            failed = set()
+            try:
+                await self.collection.bulk_write([UpdateOne(op[0], op[1]) for op in ops], ordered=False)
+            except BulkWriteError as e:
+                # The rest of the batch landed; the failed rows are retried one by one below
+                errors = e.details.get('writeErrors', [])
+                failed = {error["index"] for error in errors}
+                logger.error(f"Status flush: {len(errors)} of {len(ops)} writes failed: {errors[:3]}")
+            except ConnectionFailure as e:
+                # Mongo unreachable: keep the batch for the next flush
+                logger.error(f"Status flush of {len(ops)} writes failed, will retry: {e}")
+                self._ops = ops + self._ops
+                return
+            except Exception as e:
+                logger.error(f"Status flush of {len(ops)} writes failed, writing them one by one: {e}", exc_info=True)
+                failed = set(range(len(ops)))
+            else:
+                self.flushes += 1
+
+        for index, op in enumerate(ops):
+            filter, update, after, settled, fallback = op
+            if index in failed:
+                landed = await self._write_one(filter, update, fallback)
+                if landed is None:
+                    # Mongo went away meanwhile: back in the buffer, lease still held
+                    self._ops.append(op)
+                    self._has_ops.set()
+                    continue
+                if not landed:
+                    # Nothing could be written; the row is retried once its lease expires
+                    settled.set_result(False)
+                    continue
+            if after:
+                try:
+                    after()
+                except Exception as e:
+                    logger.warning(f"Status write callback failed: {e}")
+            settled.set_result(True)
+
+    async def _write_one(self, filter: dict, update: dict, fallback: Optional[dict]) -> Optional[bool]:
+        """One write the batch could not make: retried alone, then reduced to its fallback.
+
+        None when Mongo is unreachable and the write should stay buffered.
+        """
+        for attempt in (update, fallback):
+            if attempt is None:
+                continue
+            try:
+                await self.collection.update_one(filter, attempt)
+                return True
+            except ConnectionFailure:
+                return None
+            except Exception as e:
+                logger.error(f"Status write for {filter.get('id')} failed{' (fallback)' if attempt is fallback else ''}: {e}")
+        return False
+
+    async def _run(self):
+        while True:
+            await self._has_ops.wait()
+            await self.clock.sleep(self.flush_seconds)
+            self._has_ops.clear()
+            await self.flush()
+            if self._ops:
+                self._has_ops.set()
@@ -0,0 +1,66 @@
+"""Standalone sender process.
+
+Runs BackgroundWorker without the API so senders can be scaled separately:
+
+    python worker.py
+
+Start the API with EMBEDDED_WORKER=false when senders run this way. Any
+number of these processes can share one database; lease-based claiming
+keeps each schedule to a single sender. Prometheus metrics are served on
+METRICS_PORT (default 9464, 0 disables) at /metrics.
+"""
+import asyncio
+import logging
+import os
+import signal
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+from background_worker import BackgroundWorker
+from gateway import gateway
+from indexes import ensure_indexes
+import metrics
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+async def main():
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'])
+    db = client[os.environ['DB_NAME']]
+    worker = BackgroundWorker(db)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await ensure_indexes(db)
+    await gateway.open()
+    await worker.start()
+    logger.info(f"Standalone worker {worker.worker_id} running")
+
+    metrics.add_collector(metrics.database_collector(db))
+    metrics.add_collector(metrics.worker_collector(worker))
+    metrics.add_collector(metrics.gateway_collector(gateway))
+    metrics_port = int(os.environ.get('METRICS_PORT', '9464'))
+    metrics_server = await metrics.serve(metrics_port) if metrics_port else None
+
+    await stop.wait()
+
+    if metrics_server is not None:
+        metrics_server.close()
+    await worker.stop()
+    await gateway.close()
+    client.close()
+    logger.info("Standalone worker shut down")
+
+if __name__ == "__main__":
+    asyncio.run(main())
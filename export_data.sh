@@ -9,7 +9,7 @@ mkdir -p "$EXPORT_DIR"
 
 echo "Exporting data to: $EXPORT_DIR"
 
-# 1. Export MongoDB data
+# 1. Export MongoDB data (schedules plus the images collection they reference)
 echo "Exporting MongoDB database..."
 mongodump --uri="mongodb://localhost:27017/devotion_scheduler" --out="$EXPORT_DIR/mongodb_backup"
 
@@ -54,6 +54,10 @@ Required Environment Variables:
 - CORS_ORIGINS (*)
 - REACT_APP_BACKEND_URL (your backend URL)
 
+Images are stored once in the 'images' collection (keyed by SHA-256) and
+referenced from schedules by image_id. Restores from older exports that still
+carry image_base64 are converted with: python backend/migrate_images.py
+
 Python Dependencies: see backend/requirements.txt
 Node Dependencies: see frontend/package.json
 EOF
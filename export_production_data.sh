@@ -68,6 +68,8 @@ Connection: mongodb+srv cluster
 To restore on new server:
 1. Update MongoDB connection string in .env
 2. Run: mongorestore --uri="YOUR_NEW_MONGO_URL" mongodb_backup/
+3. Run: cd backend && python migrate_images.py
+   (moves inline image_base64 payloads into the images collection)
 
 Environment Variables:
 - MONGO_URL: Your MongoDB connection string
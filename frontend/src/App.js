@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import './App.css';
 import axios from 'axios';
 import { Tabs, TabsList, TabsTrigger, TabsContent } from './components/ui/tabs';
@@ -10,6 +10,7 @@ import { Toaster } from './components/ui/sonner';
 import { toast } from 'sonner';
 import { CalendarClock, History, Users, Download, Upload } from 'lucide-react';
 import { format } from 'date-fns';
+import { idempotencyKey } from './lib/utils';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 
@@ -17,40 +18,142 @@ function App() {
   const [activeTab, setActiveTab] = useState('schedule');
   const [schedules, setSchedules] = useState([]);
   const [history, setHistory] = useState([]);
+  const [historyCursor, setHistoryCursor] = useState(null);
+  const [counts, setCounts] = useState({});
   const [bulkModalOpen, setBulkModalOpen] = useState(false);
   const [importModalOpen, setImportModalOpen] = useState(false);
+  const importSubmission = useRef(null);
 
-  // Fetch schedules
+  // Fetch schedules (summary rows: no HTML body or image payload)
   const fetchSchedules = async () => {
     try {
-      const response = await axios.get(`${BACKEND_URL}/api/schedules?status=scheduled`);
+      const [response, countsResponse] = await Promise.all([
+        axios.get(`${BACKEND_URL}/api/schedules/summary?status=scheduled`),
+        axios.get(`${BACKEND_URL}/api/schedules/counts`)
+      ]);
       setSchedules(response.data);
+      setCounts(countsResponse.data);
     } catch (error) {
       console.error('Fetch schedules error:', error);
     }
   };
 
-  // Fetch history
-  const fetchHistory = async () => {
+  // Fetch history; pass a cursor to append the next page
+  const fetchHistory = async (cursor = null) => {
     try {
-      const response = await axios.get(`${BACKEND_URL}/api/history`);
-      setHistory(response.data);
+      const params = cursor ? { cursor } : {};
+      const response = await axios.get(`${BACKEND_URL}/api/history/summary`, { params });
+      setHistory((prev) => (cursor ? [...prev, ...response.data] : response.data));
+      setHistoryCursor(response.headers['x-next-cursor'] || null);
     } catch (error) {
       console.error('Fetch history error:', error);
     }
   };
 
+  const fetchCounts = async () => {
+    try {
+      const response = await axios.get(`${BACKEND_URL}/api/schedules/counts`);
+      setCounts(response.data);
+    } catch (error) {
+      console.error('Fetch counts error:', error);
+    }
+  };
+
+  // Latest lists, for the event handler below (its closure outlives renders)
+  const schedulesRef = useRef(schedules);
+  const historyRef = useRef(history);
+  schedulesRef.current = schedules;
+  historyRef.current = history;
+
+  // Live updates: status events from /api/events patch the lists in place.
+  // Only rows we do not have yet are re-read (a burst of them in one request),
+  // and polling takes over while the stream is down.
   useEffect(() => {
-    fetchSchedules();
-    fetchHistory();
-    
-    // Refresh every 30 seconds
-    const interval = setInterval(() => {
+    let pollTimer = null;
+    let reloadTimer = null;
+    let lost = false;
+    const inFlight = new Map(); // rows that left the upcoming list while sending
+    const pending = { schedules: false, history: false, counts: false };
+
+    const reloadSoon = (what) => {
+      pending[what] = true;
+      if (reloadTimer) return;
+      reloadTimer = setTimeout(() => {
+        reloadTimer = null;
+        if (pending.schedules) fetchSchedules();
+        else if (pending.counts) fetchCounts();
+        if (pending.history) fetchHistory();
+        pending.schedules = pending.history = pending.counts = false;
+      }, 1000);
+    };
+
+    const reloadAll = () => {
       fetchSchedules();
       fetchHistory();
-    }, 30000);
+    };
+
+    const applyStatus = ({ id, status, previous, sent_at }) => {
+      const row = schedulesRef.current.find((s) => s.id === id)
+        || inFlight.get(id)
+        || historyRef.current.find((s) => s.id === id);
+      inFlight.delete(id);
+
+      if (status === 'scheduled') {
+        // New, retried or edited: the upcoming list needs the full row
+        setHistory((prev) => prev.filter((s) => s.id !== id));
+        reloadSoon('schedules');
+        return;
+      }
+
+      setSchedules((prev) => prev.filter((s) => s.id !== id));
+      if (status === 'deleted') {
+        setHistory((prev) => prev.filter((s) => s.id !== id));
+      } else if (status === 'sending') {
+        if (row) inFlight.set(id, row);
+      } else {
+        if (!row) {
+          reloadSoon('history');
+        } else {
+          const updated = { ...row, status, sent_at: sent_at ?? row.sent_at };
+          setHistory((prev) => [updated, ...prev.filter((s) => s.id !== id)]);
+        }
+      }
 
-    return () => clearInterval(interval);
+      if (previous && previous !== status) {
+        setCounts((prev) => ({
+          ...prev,
+          [previous]: Math.max(0, (prev[previous] || 0) - 1),
+          ...(status === 'deleted' ? {} : { [status]: (prev[status] || 0) + 1 })
+        }));
+      } else if (!previous) {
+        reloadSoon('counts');
+      }
+    };
+
+    const source = new EventSource(`${BACKEND_URL}/api/events`);
+    source.onopen = () => {
+      clearInterval(pollTimer);
+      pollTimer = null;
+      // Reconnected: catch up on anything missed while disconnected
+      if (lost) reloadAll();
+      lost = false;
+    };
+    source.onerror = () => {
+      // EventSource reconnects by itself; poll until it does
+      lost = true;
+      inFlight.clear();
+      if (!pollTimer) pollTimer = setInterval(reloadAll, 30000);
+    };
+    source.addEventListener('status', (event) => applyStatus(JSON.parse(event.data)));
+    source.addEventListener('reload', reloadAll);
+
+    reloadAll();
+
+    return () => {
+      source.close();
+      clearInterval(pollTimer);
+      clearTimeout(reloadTimer);
+    };
   }, []);
 
   const handleScheduleSuccess = () => {
@@ -90,43 +193,14 @@ function App() {
     alert(`Phone: ${schedule.phone}\nMessage: ${schedule.message_md}\nStatus: ${schedule.status}`);
   };
 
-  const handleExportData = async () => {
-    try {
-      // Fetch all schedules (both upcoming and history)
-      const allSchedules = await axios.get(`${BACKEND_URL}/api/schedules?limit=1000`);
-      
-      // Create export data object
-      const exportData = {
-        exported_at: new Date().toISOString(),
-        exported_from: window.location.origin,
-        total_schedules: allSchedules.data.length,
-        schedules: allSchedules.data,
-        metadata: {
-          timezone: 'GMT+7',
-          version: '1.0',
-          app_name: 'WhatsApp Daily Devotion Scheduler'
-        }
-      };
-
-      // Convert to JSON
-      const dataStr = JSON.stringify(exportData, null, 2);
-      const dataBlob = new Blob([dataStr], { type: 'application/json' });
-
-      // Create download link
-      const url = URL.createObjectURL(dataBlob);
-      const link = document.createElement('a');
-      link.href = url;
-      link.download = `devotion_scheduler_export_${new Date().toISOString().split('T')[0]}.json`;
-      document.body.appendChild(link);
-      link.click();
-      document.body.removeChild(link);
-      URL.revokeObjectURL(url);
-
-      toast.success(`Exported ${allSchedules.data.length} schedules successfully!`);
-    } catch (error) {
-      console.error('Export error:', error);
-      toast.error('Failed to export data');
-    }
+  const handleExportData = () => {
+    // The server streams the export straight from the database (gzipped NDJSON)
+    const link = document.createElement('a');
+    link.href = `${BACKEND_URL}/api/export?gzip=true`;
+    document.body.appendChild(link);
+    link.click();
+    document.body.removeChild(link);
+    toast.success('Export started');
   };
 
   const handleImportData = async (event) => {
@@ -134,29 +208,45 @@ function App() {
     if (!file) return;
 
     try {
-      const fileText = await file.text();
-      const importData = JSON.parse(fileText);
-
-      // Validate import data
-      if (!importData.schedules || !Array.isArray(importData.schedules)) {
-        toast.error('Invalid export file format');
-        return;
-      }
-
       // Ask user if they want to replace existing data
       const replaceExisting = window.confirm(
-        `Import ${importData.schedules.length} schedules?\n\n` +
+        `Import ${file.name}?\n\n` +
         `Click OK to REPLACE all existing data\n` +
-        `Click Cancel to ADD to existing data`
+        `Click Cancel to ADD to existing data (rows with the same id are updated)`
       );
 
-      // Import to backend
-      const response = await axios.post(`${BACKEND_URL}/api/import`, {
-        schedules: importData.schedules,
-        replace_existing: replaceExisting
-      });
+      let response;
+      if (file.name.endsWith('.json')) {
+        // Legacy JSON export
+        const importData = JSON.parse(await file.text());
+        if (!importData.schedules || !Array.isArray(importData.schedules)) {
+          toast.error('Invalid export file format');
+          return;
+        }
+        const payload = { schedules: importData.schedules, replace_existing: replaceExisting };
+        response = await axios.post(`${BACKEND_URL}/api/import`, payload, {
+          headers: { 'Idempotency-Key': idempotencyKey(importSubmission, JSON.stringify(payload)) }
+        });
+      } else {
+        // NDJSON export (.ndjson or .ndjson.gz), sent as-is and streamed in by the server
+        response = await axios.post(`${BACKEND_URL}/api/import`, file, {
+          params: { replace_existing: replaceExisting },
+          headers: {
+            'Content-Type': 'application/x-ndjson',
+            'Idempotency-Key': idempotencyKey(
+              importSubmission, `${file.name}:${file.size}:${file.lastModified}:${replaceExisting}`
+            )
+          }
+        });
+      }
+      importSubmission.current = null;
 
-      toast.success(response.data.message);
+      const { message, error_count } = response.data;
+      if (error_count) {
+        toast.warning(`${message} (${error_count} rows rejected)`);
+      } else {
+        toast.success(message);
+      }
       
       // Refresh data
       fetchSchedules();
@@ -186,7 +276,7 @@ function App() {
             <input
               type="file"
               id="import-file"
-              accept=".json"
+              accept=".json,.ndjson,.gz"
               onChange={handleImportData}
               style={{ display: 'none' }}
             />
@@ -255,7 +345,7 @@ function App() {
               {/* Upcoming List */}
               <div className="bg-white rounded-lg border border-[color:var(--border)] p-6 shadow-sm">
                 <h2 className="text-lg font-semibold font-display mb-4">
-                  Upcoming ({schedules.length})
+                  Upcoming ({counts.scheduled ?? schedules.length})
                 </h2>
                 <div className="space-y-2 max-h-[500px] overflow-y-auto">
                   {schedules.length === 0 ? (
@@ -314,6 +404,17 @@ function App() {
                 onDelete={handleDelete}
                 onView={handleView}
               />
+              {historyCursor && (
+                <div className="flex justify-center mt-4">
+                  <Button
+                    variant="secondary"
+                    onClick={() => fetchHistory(historyCursor)}
+                    data-testid="history-load-more-button"
+                  >
+                    Load more
+                  </Button>
+                </div>
+              )}
             </div>
           </TabsContent>
         </Tabs>
@@ -1,16 +1,18 @@
-import React, { useState } from 'react';
+import React, { useRef, useState } from 'react';
 import { Dialog, DialogContent, DialogHeader, DialogTitle, DialogDescription } from './ui/dialog';
 import { Button } from './ui/button';
 import { Textarea } from './ui/textarea';
 import { Label } from './ui/label';
 import axios from 'axios';
 import { toast } from 'sonner';
+import { idempotencyKey } from '../lib/utils';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 
 export const BulkAddModal = ({ open, onOpenChange, onSuccess }) => {
   const [bulkText, setBulkText] = useState('');
   const [loading, setLoading] = useState(false);
+  const submission = useRef(null);
 
   const handleBulkSubmit = async () => {
     setLoading(true);
@@ -34,7 +36,23 @@ export const BulkAddModal = ({ open, onOpenChange, onSuccess }) => {
         };
       });
 
-      await axios.post(`${BACKEND_URL}/api/schedules/bulk`, { schedules });
+      // Items already created by a timed-out attempt come back instead of being added again
+      const response = await axios.post(`${BACKEND_URL}/api/schedules/bulk`, { schedules }, {
+        headers: { 'Idempotency-Key': idempotencyKey(submission, JSON.stringify(schedules)) }
+      });
+      submission.current = null;
+      const { errors } = response.data;
+      if (errors.length) {
+        // Keep only the failed lines so they can be fixed and sent again
+        const failed = new Set(errors.map((e) => e.index));
+        toast.warning(
+          `${schedules.length - errors.length} schedules created, ${errors.length} failed ` +
+          `(line ${errors[0].index + 1}: ${errors[0].error})`
+        );
+        setBulkText(lines.filter((_, index) => failed.has(index)).join('\n'));
+        onSuccess?.();
+        return;
+      }
       toast.success(`${schedules.length} schedules created successfully!`);
       setBulkText('');
       onOpenChange(false);
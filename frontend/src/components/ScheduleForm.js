@@ -1,4 +1,4 @@
-import React, { useState } from 'react';
+import React, { useRef, useState } from 'react';
 import { Input } from './ui/input';
 import { Button } from './ui/button';
 import { Label } from './ui/label';
@@ -6,6 +6,7 @@ import { Upload, Trash2 } from 'lucide-react';
 import axios from 'axios';
 import { toast } from 'sonner';
 import { SimpleEditor } from './SimpleEditor';
+import { idempotencyKey } from '../lib/utils';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 
@@ -20,6 +21,7 @@ export const ScheduleForm = ({ onSuccess, editData = null, onCancel = null }) =>
   const [imagePreview, setImagePreview] = useState(editData?.image_path || null);
   const [loading, setLoading] = useState(false);
   const [editorKey, setEditorKey] = useState(0);
+  const submission = useRef(null);
 
   const handleEditorChange = (html) => {
     setFormData({ ...formData, message: html });
@@ -38,15 +40,15 @@ export const ScheduleForm = ({ onSuccess, editData = null, onCancel = null }) =>
     setLoading(true);
 
     try {
-      let imageBase64 = editData?.image_base64 || null;
+      let imageId = editData?.image_id || null;
       let imageFilename = editData?.image_filename || null;
 
-      // Upload image if new one selected
+      // Upload image if new one selected; the server keeps the bytes and returns a reference
       if (formData.image) {
         const imageFormData = new FormData();
         imageFormData.append('file', formData.image);
         const uploadRes = await axios.post(`${BACKEND_URL}/api/uploads/image`, imageFormData);
-        imageBase64 = uploadRes.data.image_base64;
+        imageId = uploadRes.data.image_id;
         imageFilename = uploadRes.data.filename;
       }
 
@@ -66,7 +68,7 @@ export const ScheduleForm = ({ onSuccess, editData = null, onCancel = null }) =>
       const scheduleData = {
         phone: formData.phone,
         message_html: messageHtml,
-        image_base64: imageBase64,
+        image_id: imageId,
         image_filename: imageFilename,
         send_at: sendAt
       };
@@ -76,8 +78,11 @@ export const ScheduleForm = ({ onSuccess, editData = null, onCancel = null }) =>
         await axios.put(`${BACKEND_URL}/api/schedules/${editData.id}`, scheduleData);
         toast.success('Schedule updated successfully!');
       } else {
-        // Create new
-        await axios.post(`${BACKEND_URL}/api/schedules`, scheduleData);
+        // Create new; retrying the same schedule after a timeout must not create it twice
+        await axios.post(`${BACKEND_URL}/api/schedules`, scheduleData, {
+          headers: { 'Idempotency-Key': idempotencyKey(submission, JSON.stringify(scheduleData)) }
+        });
+        submission.current = null;
         toast.success('Schedule created successfully!');
       }
 
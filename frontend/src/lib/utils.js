@@ -3,3 +3,14 @@ import { clsx } from "clsx";
 export function cn(...inputs) {
   return clsx(inputs);
 }
+
+// One Idempotency-Key per distinct submission: sending the same payload again
+// (e.g. after a timeout) reuses the key, so the server replays instead of
+// creating a duplicate. Clear ref.current once the request succeeds.
+export function idempotencyKey(ref, payload) {
+  if (!ref.current || ref.current.payload !== payload) {
+    const key = window.crypto?.randomUUID?.() ?? `${Date.now().toString(36)}-${Math.random().toString(36).slice(2)}`;
+    ref.current = { payload, key };
+  }
+  return ref.current.key;
+}
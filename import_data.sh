@@ -71,6 +71,12 @@ yarn install
 echo "Building frontend..."
 yarn build
 
+# 11. Move inline images from older exports into the image store
+echo "Migrating inline schedule images..."
+cd "$APP_DIR/backend"
+source venv/bin/activate
+python migrate_images.py
+
 echo ""
 echo "========================================="
 echo "Import Complete!"
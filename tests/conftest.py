@@ -0,0 +1,46 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# The backend is a flat set of modules run from backend/, not a package
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+# server.py reads these at import; tests never reach a real Mongo
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "scheduler_test")
+
+from mongomock_motor import AsyncMongoMockClient
+from pymongo import ReplaceOne, UpdateOne
+
+# mongomock's bulk_write calls _add_to_bulk with the old pymongo signature
+UpdateOne._add_to_bulk = lambda self, bulk: bulk.add_update(self._filter, self._doc, False, bool(self._upsert))
+ReplaceOne._add_to_bulk = lambda self, bulk: bulk.add_replace(self._filter, self._doc, bool(self._upsert))
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+@pytest.fixture
+def db():
+    """A fresh in-memory database (mongomock: no index plans, unique indexes enforced)"""
+    return AsyncMongoMockClient()["scheduler_test"]
+
+@pytest.fixture
+async def api(db, monkeypatch):
+    """An HTTP client for server.app on the test database; the worker is never started"""
+    import httpx
+
+    import server
+    from background_worker import BackgroundWorker
+    from cache import ResponseCache
+    from image_store import ImageStore
+
+    monkeypatch.setattr(server, "db", db)
+    monkeypatch.setattr(server, "image_store", ImageStore(db))
+    monkeypatch.setattr(server, "worker", BackgroundWorker(db))
+    monkeypatch.setattr(server, "response_cache", ResponseCache(ttl=30))
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
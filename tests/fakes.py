@@ -0,0 +1,35 @@
+from datetime import datetime, timedelta, timezone
+
+SUCCESS = {"code": "SUCCESS", "message": "Success"}
+TRANSIENT = {"code": "ERROR", "message": "gateway timeout", "results": {}, "status_code": 504, "transient": True}
+
+class FakeGateway:
+    """Stands in for the gateway pool: answers each send with the next queued result (success by default)"""
+
+    def __init__(self, *results, error: Exception = None):
+        self.results = list(results)
+        self.error = error
+        self.sent = []
+
+    async def send_text_message(self, phone: str, message: str) -> dict:
+        self.sent.append(phone)
+        if self.error:
+            raise self.error
+        if self.results:
+            return dict(self.results.pop(0))
+        return {**SUCCESS, "results": {"message_id": f"MSG{len(self.sent)}"}}
+
+def schedule_doc(schedule_id: str, **fields) -> dict:
+    """A due schedule as the API stores it"""
+    now = datetime.now(timezone.utc)
+    return {
+        "id": schedule_id,
+        "phone": "628123456789",
+        "message_md": "hello",
+        "send_at": now - timedelta(seconds=5),
+        "status": "scheduled",
+        "attempts": 0,
+        "created_at": now,
+        "updated_at": now,
+        **fields,
+    }
@@ -0,0 +1,115 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from background_worker import BackgroundWorker
+from resilience import CircuitBreaker
+from tests.fakes import TRANSIENT, FakeGateway, schedule_doc
+
+pytestmark = pytest.mark.anyio
+
+def open_breaker(breaker: CircuitBreaker, reset_seconds: float = 0.05) -> CircuitBreaker:
+    breaker.reset_timeout = reset_seconds
+    for _ in range(breaker.failure_threshold):
+        breaker.record_failure()
+    assert breaker.state == breaker.OPEN
+    return breaker
+
+async def half_open(breaker: CircuitBreaker):
+    await breaker.ready()
+    await breaker.before_call()
+    assert breaker.state == breaker.HALF_OPEN
+
+async def test_half_open_lets_one_probe_through():
+    breaker = open_breaker(CircuitBreaker())
+    await half_open(breaker)
+
+    waiter = asyncio.create_task(breaker.before_call())
+    await asyncio.sleep(0.1)
+    assert not waiter.done()
+
+    breaker.record_success()
+    await asyncio.wait_for(waiter, 1)
+    assert breaker.state == breaker.CLOSED
+
+async def test_failed_probe_reopens():
+    breaker = open_breaker(CircuitBreaker())
+    await half_open(breaker)
+    breaker.record_failure()
+    assert breaker.state == breaker.OPEN
+
+async def test_released_probe_passes_to_next_caller():
+    breaker = open_breaker(CircuitBreaker(), reset_seconds=60)
+    breaker.opened_at -= 60
+    await half_open(breaker)
+
+    waiter = asyncio.create_task(breaker.before_call())
+    await asyncio.sleep(0)
+    breaker.release()
+    # Straight through, without waiting out another reset_timeout
+    await asyncio.wait_for(waiter, 2)
+    assert breaker.state == breaker.HALF_OPEN
+
+async def test_ready_does_not_take_the_probe():
+    breaker = open_breaker(CircuitBreaker())
+    await breaker.ready()
+    assert breaker.state == breaker.OPEN
+    await asyncio.wait_for(breaker.before_call(), 1)
+    assert breaker.state == breaker.HALF_OPEN
+
+async def test_skipped_send_leaves_the_probe_for_a_real_call(db):
+    live_lease = datetime.now(timezone.utc) + timedelta(minutes=1)
+    await db.schedules.insert_one(schedule_doc("taken", status="sending", worker_id="other", lease_expires_at=live_lease))
+    await db.schedules.insert_one(schedule_doc("due"))
+    gateway = FakeGateway()
+    worker = BackgroundWorker(db, gateway_client=gateway)
+    open_breaker(worker.breaker)
+    await worker.breaker.ready()
+
+    # Another replica holds it: no gateway call, so no probe either
+    await worker._send_schedule({"id": "taken"})
+    assert worker.breaker.state == worker.breaker.OPEN
+
+    await asyncio.wait_for(worker._send_schedule({"id": "due"}), 2)
+    assert gateway.sent == ["628123456789"]
+    assert worker.breaker.state == worker.breaker.CLOSED
+
+async def test_probe_that_raises_is_released(db):
+    await db.schedules.insert_one(schedule_doc("s1"))
+    worker = BackgroundWorker(db, gateway_client=FakeGateway(error=RuntimeError("boom")))
+    open_breaker(worker.breaker)
+    await worker.breaker.ready()
+
+    await worker._send_schedule({"id": "s1"})
+    assert worker.breaker.state == worker.breaker.OPEN
+    assert (await db.schedules.find_one({"id": "s1"}))["status"] == "failed"
+
+async def test_retry_keeps_requested_send_at(db):
+    requested = (datetime.now(timezone.utc) - timedelta(minutes=2)).replace(microsecond=0)
+    await db.schedules.insert_one(schedule_doc("s1", send_at=requested))
+    worker = BackgroundWorker(db, gateway_client=FakeGateway(TRANSIENT))
+
+    await worker._send_schedule({"id": "s1"})
+    stored = await db.schedules.find_one({"id": "s1"})
+    assert stored["status"] == "scheduled"
+    assert stored["send_at"].replace(tzinfo=timezone.utc) == requested
+    assert stored["next_attempt_at"].replace(tzinfo=timezone.utc) > datetime.now(timezone.utc)
+    # Held back until the backoff is over
+    assert await worker._claim("s1") is None
+
+    await db.schedules.update_one({"id": "s1"}, {"$set": {"next_attempt_at": datetime.now(timezone.utc) - timedelta(seconds=1)}})
+    await worker._send_schedule({"id": "s1"})
+    stored = await db.schedules.find_one({"id": "s1"})
+    assert stored["status"] == "sent"
+    assert stored["attempts"] == 2
+    assert "next_attempt_at" not in stored
+    # Lag counts from the time the user asked for, not from the retry
+    assert stored["send_lag_ms"] >= 120_000
+
+async def test_deadline_reload_uses_retry_time(db):
+    retry_at = datetime.now(timezone.utc) + timedelta(seconds=30)
+    await db.schedules.insert_one(schedule_doc("s1", next_attempt_at=retry_at))
+    worker = BackgroundWorker(db)
+    await worker._load_deadlines()
+    assert abs((worker._pending["s1"] - retry_at).total_seconds()) < 0.01
@@ -0,0 +1,28 @@
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+def item(message: str, **fields) -> dict:
+    return {"phone": "628123456789", "message_html": f"<p>{message}</p>", "send_at": "2030-01-01T00:00:00Z", **fields}
+
+async def test_bulk_reports_failed_items(api, db):
+    response = await api.post("/api/schedules/bulk", json={"schedules": [
+        item("one"),
+        item("two", image_base64="a"),  # not decodable
+        item("three"),
+    ]})
+    assert response.status_code == 200
+    body = response.json()
+    assert [s["message_md"] for s in body["schedules"]] == ["one", "three"]
+    assert len(body["errors"]) == 1
+    assert body["errors"][0]["index"] == 1
+    assert body["errors"][0]["error"]
+    assert response.headers["X-Bulk-Failed"] == "1"
+    assert await db.schedules.count_documents({}) == 2
+
+async def test_bulk_without_failures(api):
+    response = await api.post("/api/schedules/bulk", json={"schedules": [item("one"), item("two")]})
+    body = response.json()
+    assert len(body["schedules"]) == 2
+    assert body["errors"] == []
+    assert "X-Bulk-Failed" not in response.headers
@@ -0,0 +1,58 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from background_worker import BackgroundWorker
+from campaigns import new_campaign_doc
+from tests.fakes import FakeGateway
+
+pytestmark = pytest.mark.anyio
+
+def campaign_doc(*phones: str) -> dict:
+    data = {"message_html": "<p>hi</p>", "send_at": datetime.now(timezone.utc) - timedelta(seconds=5),
+            "recipients": [{"phone": phone} for phone in phones]}
+    return new_campaign_doc(data, "hi", datetime.now(timezone.utc))
+
+class TakenOverGateway(FakeGateway):
+    """Lets the lease run out mid-send while a restarted process (same worker_id) claims the campaign"""
+
+    def __init__(self, db, campaign_id: str, worker_id: str):
+        super().__init__()
+        self.db, self.campaign_id, self.worker_id = db, campaign_id, worker_id
+
+    async def send_text_message(self, phone: str, message: str) -> dict:
+        past = datetime.now(timezone.utc) - timedelta(seconds=1)
+        await self.db.campaigns.update_one({"id": self.campaign_id}, {"$set": {"lease_expires_at": past}})
+        restarted = BackgroundWorker(self.db)
+        restarted.worker_id = self.worker_id
+        assert await restarted._claim(self.campaign_id, self.db.campaigns) is not None
+        return await super().send_text_message(phone, message)
+
+async def test_campaign_runs_to_completion(db):
+    campaign = campaign_doc("628111", "628222")
+    await db.campaigns.insert_one(campaign)
+    worker = BackgroundWorker(db, gateway_client=FakeGateway())
+    worker.running = True
+
+    await worker._run_campaign(campaign["id"])
+
+    stored = await db.campaigns.find_one({"id": campaign["id"]})
+    assert stored["status"] == "sent"
+    assert stored["counts"]["sent"] == 2
+    assert [r["status"] for r in stored["recipients"]] == ["sent", "sent"]
+
+async def test_expired_claim_does_not_overwrite_a_newer_one(db):
+    campaign = campaign_doc("628111")
+    await db.campaigns.insert_one(campaign)
+    worker = BackgroundWorker(db)
+    worker.gateway = TakenOverGateway(db, campaign["id"], worker.worker_id)
+    worker.running = True
+
+    await worker._run_campaign(campaign["id"])
+
+    # The newer claim still owns the campaign; the stale runner wrote nothing
+    stored = await db.campaigns.find_one({"id": campaign["id"]})
+    assert stored["status"] == "sending"
+    assert stored["attempts"] == 2
+    assert stored["recipients"][0]["status"] == "pending"
+    assert stored["counts"]["pending"] == 1
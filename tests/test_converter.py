@@ -0,0 +1,58 @@
+import pytest
+
+import markdown_converter
+from bench.converter import devotion
+from markdown_converter import convert_batch, html_to_whatsapp_markdown
+
+GOLDEN = [
+    ("<p>Hello <strong>world</strong></p>", "Hello *world*"),
+    ("<p><b>bold</b> <i>italic</i> <s>strike</s> <code>code</code></p>", "*bold* _italic_ ~strike~ `code`"),
+    ("<p><strong>outer <b>inner</b> still</strong></p>", "*outer inner still*"),
+    ("<p>one</p><p>two</p>", "one\n\ntwo"),
+    ("<p>line<br>break<br><br><br>many</p>", "line\nbreak\n\nmany"),
+    ("<ul><li><p>a</p></li><li><p>b</p><ul><li><p>nested</p></li></ul></li></ul>", "• a\n• b\n  • nested"),
+    ('<ol start="3"><li>three</li><li>four</li></ol>', "3. three\n4. four"),
+    ("<h2>Title</h2><p>body</p>", "*Title*\n\nbody"),
+    ('<p><a href="https://example.com">site</a> <a href="https://x.y">https://x.y</a> <a href="#top">top</a></p>',
+     "site (https://example.com) https://x.y top"),
+    ("<pre><code>x = 1\n  y</code></pre>", "```x = 1\n  y```"),
+    ("<p>Tom &amp; Jerry &lt;3 a < b</p>", "Tom & Jerry <3 a < b"),
+    ("<p><em>a</em> <em>b</em></p>", "_a_ _b_"),
+    ("<!-- note --><p>x</p>", "x"),
+]
+
+DEVOTION = (
+    "*Renungan Hari ke-1*\n\n"
+    "*Bacaan:* _Mazmur 23:1-6_\n\n"
+    "Tuhan adalah gembalaku, takkan kekurangan aku. Ia membaringkan aku di padang yang berumput hijau, "
+    "Ia membimbing aku ke air yang tenang; Ia menyegarkan jiwaku.\n\n"
+    "Dalam perjalanan hidup kita sering merasa ~sendirian~ lelah, namun Firman mengingatkan bahwa "
+    "Gembala yang baik tidak pernah meninggalkan domba-Nya.\n\n"
+    "*Refleksi*\n\n"
+    "1. Apa yang membuat Anda merasa kekurangan hari ini?\n"
+    "2. Di mana Anda melihat pemeliharaan Tuhan minggu ini?\n"
+    "  • di keluarga\n"
+    "  • di pekerjaan\n"
+    "3. Bagaimana Anda dapat menjadi berkat bagi orang lain?\n\n"
+    "*Doa:* Tuhan, ajar kami percaya sepenuhnya kepada-Mu. _Amin._\n\n"
+    "Bacaan lengkap: Mazmur 23 (https://alkitab.example/mzm/23?d=1)\n\n"
+    "Ayat hafalan: `Mzm 23:1`"
+)
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    markdown_converter.clear_cache()
+    yield
+    markdown_converter.clear_cache()
+
+@pytest.mark.parametrize("html, expected", GOLDEN)
+def test_golden_output(html, expected):
+    assert html_to_whatsapp_markdown(html) == expected
+
+def test_editor_devotion():
+    assert html_to_whatsapp_markdown(devotion(1)) == DEVOTION
+
+def test_repeated_bodies_come_from_the_cache():
+    assert convert_batch([devotion(1), devotion(1), devotion(2)])[1] == DEVOTION
+    info = markdown_converter.cache_info()
+    assert (info["hits"], info["misses"], info["size"]) == (1, 2, 2)
@@ -0,0 +1,22 @@
+import pytest
+
+import server
+from events import StatusFeed
+from tests.fakes import schedule_doc
+
+pytestmark = pytest.mark.anyio
+
+async def test_feed_change_invalidates_cached_lists(api, db):
+    await db.schedules.insert_one(schedule_doc("s1"))
+    assert (await api.get("/api/schedules/counts")).json() == {"scheduled": 1, "total": 1}
+
+    # A separate worker process sends it; only the change stream hears about it
+    await db.schedules.update_one({"id": "s1"}, {"$set": {"status": "sent"}})
+    assert (await api.get("/api/schedules/counts")).json() == {"scheduled": 1, "total": 1}
+
+    feed = StatusFeed(db, server.broadcaster, on_change=server.feed_changed)
+    feed._publish({"operationType": "update", "fullDocument": {"id": "s1", "status": "sent"}})
+
+    assert (await api.get("/api/schedules/counts")).json() == {"sent": 1, "total": 1}
+    history = await api.get("/api/history")
+    assert [row["id"] for row in history.json()] == ["s1"]
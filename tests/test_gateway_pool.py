@@ -0,0 +1,64 @@
+import pytest
+
+from gateway import GatewayNode, GatewayPool
+from tests.fakes import TRANSIENT, FakeGateway
+
+pytestmark = pytest.mark.anyio
+
+UNREACHABLE = {**TRANSIENT, "message": "connection refused", "status_code": None, "not_sent": True}
+
+def pool(*gateways: FakeGateway, **settings) -> GatewayPool:
+    result = GatewayPool([GatewayNode(f"node{i}", gateway) for i, gateway in enumerate(gateways)])
+    for name, value in settings.items():
+        setattr(result, name, value)
+    return result
+
+def phones(count: int) -> list:
+    return [f"62812{i:07d}" for i in range(count)]
+
+@pytest.mark.parametrize("strategy", ["weighted", "least_in_flight"])
+async def test_recipients_stick_to_one_node(strategy):
+    balanced = pool(FakeGateway(), FakeGateway(), FakeGateway(), strategy=strategy)
+    first = {}
+    for phone in phones(300):
+        first[phone] = (await balanced.send_text_message(phone, "hello"))["gateway_node"]
+    for phone, node in first.items():
+        assert (await balanced.send_text_message(phone, "again"))["gateway_node"] == node
+    assert set(first.values()) == {"node0", "node1", "node2"}
+
+def test_weight_shifts_new_recipients():
+    light, heavy = GatewayNode("light", FakeGateway(), 1.0), GatewayNode("heavy", FakeGateway(), 4.0)
+    weighted = GatewayPool([light, heavy])
+    share = sum(weighted.pick(phone) is heavy for phone in phones(2000)) / 2000
+    assert 0.7 < share < 0.9
+
+async def test_unreachable_node_fails_over_once():
+    gateways = [FakeGateway(UNREACHABLE), FakeGateway()]
+    balanced = pool(*gateways)
+    phone = next(p for p in phones(100) if balanced.pick(p).name == "node0")
+
+    result = await balanced.send_text_message(phone, "hello")
+    assert result["code"] == "SUCCESS"
+    assert result["gateway_node"] == "node1"
+    assert [len(g.sent) for g in gateways] == [1, 1]
+
+async def test_possibly_sent_message_is_not_sent_twice():
+    gateways = [FakeGateway(TRANSIENT), FakeGateway()]
+    balanced = pool(*gateways)
+    phone = next(p for p in phones(100) if balanced.pick(p).name == "node0")
+
+    result = await balanced.send_text_message(phone, "hello")
+    assert result["transient"]
+    assert result["gateway_node"] == "node0"
+    assert [len(g.sent) for g in gateways] == [1, 0]
+
+async def test_failing_node_leaves_rotation():
+    failing = FakeGateway(TRANSIENT, TRANSIENT)
+    balanced = pool(failing, FakeGateway(), max_failures=2)
+    phone = next(p for p in phones(100) if balanced.pick(p).name == "node0")
+
+    for _ in range(2):
+        await balanced.send_text_message(phone, "hello")
+    assert not balanced.nodes[0].healthy
+    assert balanced.pick(phone).name == "node1"
+    assert (await balanced.send_text_message(phone, "hello"))["gateway_node"] == "node1"
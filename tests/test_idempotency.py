@@ -0,0 +1,54 @@
+import json
+
+import pytest
+
+import server
+from backup import ImportJob
+
+pytestmark = pytest.mark.anyio
+
+def schedule(message: str) -> dict:
+    return {"phone": "628123456789", "message_html": f"<p>{message}</p>", "send_at": "2030-01-01T00:00:00Z"}
+
+async def test_create_is_replayed(api, db):
+    headers = {"Idempotency-Key": "create-1"}
+    first = await api.post("/api/schedules", json=schedule("one"), headers=headers)
+    second = await api.post("/api/schedules", json=schedule("one"), headers=headers)
+
+    assert first.status_code == second.status_code == 200
+    assert second.json()["id"] == first.json()["id"]
+    assert second.headers["Idempotent-Replayed"] == "true"
+    assert await db.schedules.count_documents({}) == 1
+
+async def test_key_reused_for_another_request_is_rejected(api):
+    headers = {"Idempotency-Key": "create-1"}
+    await api.post("/api/schedules", json=schedule("one"), headers=headers)
+    response = await api.post("/api/schedules", json=schedule("two"), headers=headers)
+    assert response.status_code == 422
+
+async def test_bulk_is_replayed_item_by_item(api, db):
+    headers = {"Idempotency-Key": "bulk-1"}
+    first = await api.post("/api/schedules/bulk", json={"schedules": [schedule("one"), schedule("two")]}, headers=headers)
+    second = await api.post("/api/schedules/bulk", json={"schedules": [schedule("one"), schedule("two")]}, headers=headers)
+
+    assert [s["id"] for s in second.json()["schedules"]] == [s["id"] for s in first.json()["schedules"]]
+    assert second.json()["replayed"] == 2
+    assert await db.schedules.count_documents({}) == 2
+
+async def test_import_is_replayed_after_job_eviction(api, db, monkeypatch):
+    # Tracking is full of finished jobs, so this import evicts one of them
+    finished = ImportJob(db, "old")
+    finished.status = "done"
+    monkeypatch.setattr(server, "import_jobs", {"old": finished})
+    monkeypatch.setattr(server, "MAX_TRACKED_IMPORTS", 1)
+
+    body = json.dumps({"id": "s1", **schedule("one")}) + "\n"
+    headers = {"Idempotency-Key": "import-1", "Content-Type": "application/x-ndjson"}
+    first = await api.post("/api/import", content=body, headers=headers)
+    assert first.status_code == 200, first.text
+    assert "old" not in server.import_jobs
+
+    second = await api.post("/api/import", content=body, headers=headers)
+    assert second.status_code == 200, second.text
+    assert second.headers["Idempotent-Replayed"] == "true"
+    assert second.json() == first.json()
@@ -0,0 +1,80 @@
+from datetime import datetime, timezone
+
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+from indexes import SCHEDULE_INDEXES, check_query_plans, ensure_indexes, hot_queries, plan_stages
+from tests.fakes import schedule_doc
+
+pytestmark = pytest.mark.anyio
+
+def plain(message: str) -> dict:
+    return {"phone": "628123456789", "message_html": f"<p>{message}</p>", "send_at": "2030-01-01T00:00:00Z"}
+
+async def test_plain_schedules_do_not_collide_on_the_occurrence_index(api, db):
+    await ensure_indexes(db)
+
+    for message in ("one", "two"):
+        response = await api.post("/api/schedules", json=plain(message))
+        assert response.status_code == 200, response.text
+
+    stored = await db.schedules.find({}, {"_id": 0, "recurrence_id": 1, "occurrence_at": 1}).to_list(None)
+    assert stored == [{"recurrence_id": None, "occurrence_at": None}] * 2
+
+    # mongomock skips all-null keys even in a sparse index; real Mongo indexes
+    # them, so the definition itself must exclude plain schedules
+    index = (await db.schedules.index_information())["recurrence_occurrence"]
+    assert "sparse" not in index
+    assert index["partialFilterExpression"] == {"recurrence_id": {"$type": "string"}}
+
+async def test_each_occurrence_is_materialized_once(db):
+    await ensure_indexes(db)
+    occurrence_at = datetime(2030, 1, 1, tzinfo=timezone.utc)
+
+    await db.schedules.insert_one(schedule_doc("a", recurrence_id="r1", occurrence_at=occurrence_at))
+    with pytest.raises(DuplicateKeyError):
+        await db.schedules.insert_one(schedule_doc("b", recurrence_id="r1", occurrence_at=occurrence_at))
+    await db.schedules.insert_one(schedule_doc("c", recurrence_id="r2", occurrence_at=occurrence_at))
+
+async def test_ensure_indexes_is_idempotent(db):
+    await ensure_indexes(db)
+    await ensure_indexes(db)
+    names = set(await db.schedules.index_information())
+    assert names == {"_id_"} | {index.document["name"] for index in SCHEDULE_INDEXES}
+
+def test_plan_stages_flattens_nested_plans():
+    plan = {"stage": "LIMIT", "inputStage": {"stage": "FETCH", "inputStage": {
+        "stage": "OR", "inputStages": [{"stage": "IXSCAN"}, {"stage": "COLLSCAN"}]}}}
+    assert plan_stages(plan) == ["LIMIT", "FETCH", "OR", "IXSCAN", "COLLSCAN"]
+
+class ExplainedCursor:
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def sort(self, sort):
+        return self
+
+    async def explain(self):
+        return {"queryPlanner": {"winningPlan": {"stage": "FETCH", "inputStage": {"stage": self.stage}}}}
+
+class ExplainedSchedules:
+    """explain() is not emulated by mongomock; this answers with a fixed plan per query"""
+
+    def __init__(self, collscan: set):
+        self.collscan = collscan
+
+    def find(self, query):
+        return ExplainedCursor("COLLSCAN" if repr(query) in self.collscan else "IXSCAN")
+
+async def test_query_plan_check_flags_collscans(caplog):
+    queries = hot_queries(datetime.now(timezone.utc))
+    slow = repr(queries["history_list"][0])
+
+    class Db:
+        schedules = ExplainedSchedules({slow})
+
+    results = await check_query_plans(Db())
+    assert set(results) == set(queries)
+    assert results["history_list"] == ["FETCH", "COLLSCAN"]
+    assert all(stages == ["FETCH", "IXSCAN"] for name, stages in results.items() if name != "history_list")
+    assert "'history_list' falls back to a COLLSCAN" in caplog.text
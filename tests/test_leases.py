@@ -0,0 +1,59 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from background_worker import BackgroundWorker
+from tests.fakes import FakeGateway, schedule_doc
+
+pytestmark = pytest.mark.anyio
+
+async def test_claim_is_exclusive(db):
+    await db.schedules.insert_one(schedule_doc("s1"))
+    first, second = BackgroundWorker(db), BackgroundWorker(db)
+
+    claimed = await first._claim("s1")
+    assert claimed["status"] == "sending"
+    assert claimed["claimed_from"] == "scheduled"
+    assert claimed["worker_id"] == first.worker_id
+    assert claimed["attempts"] == 1
+    assert await second._claim("s1") is None
+
+    stored = await db.schedules.find_one({"id": "s1"})
+    assert stored["worker_id"] == first.worker_id
+    assert "claimed_from" not in stored
+
+async def test_future_schedule_is_not_claimed(db):
+    await db.schedules.insert_one(schedule_doc("s1", send_at=datetime.now(timezone.utc) + timedelta(hours=1)))
+    assert await BackgroundWorker(db)._claim("s1") is None
+
+async def test_expired_lease_is_reclaimed(db):
+    past = datetime.now(timezone.utc) - timedelta(seconds=1)
+    await db.schedules.insert_one(schedule_doc("s1", status="sending", worker_id="crashed", lease_expires_at=past, attempts=1))
+    worker = BackgroundWorker(db)
+
+    claimed = await worker._claim("s1")
+    assert claimed["claimed_from"] == "sending"
+    assert claimed["attempts"] == 2
+    assert (await db.schedules.find_one({"id": "s1"}))["worker_id"] == worker.worker_id
+
+async def test_live_lease_is_not_reclaimed(db):
+    future = datetime.now(timezone.utc) + timedelta(minutes=1)
+    await db.schedules.insert_one(schedule_doc("s1", status="sending", worker_id="alive", lease_expires_at=future))
+    assert await BackgroundWorker(db)._claim("s1") is None
+
+async def test_reclaimed_send_reports_previous_status(db):
+    past = datetime.now(timezone.utc) - timedelta(seconds=1)
+    await db.schedules.insert_one(schedule_doc("s1", status="sending", worker_id="crashed", lease_expires_at=past))
+    gateway = FakeGateway()
+    worker = BackgroundWorker(db, gateway_client=gateway)
+    events = []
+    worker.add_listener(events.append)
+
+    await worker._send_schedule({"id": "s1"})
+
+    assert [(e["status"], e["previous"]) for e in events] == [("sending", "sending"), ("sent", "sending")]
+    assert gateway.sent == ["628123456789"]
+    stored = await db.schedules.find_one({"id": "s1"})
+    assert stored["status"] == "sent"
+    assert stored["gateway_message_id"] == "MSG1"
+    assert "lease_expires_at" not in stored
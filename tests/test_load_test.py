@@ -0,0 +1,42 @@
+import argparse
+
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+# What bench.load_test sets at import, scoped to this test
+LOAD_TEST_LIMITS = {
+    "GATEWAY_RATE_PER_SEC": "100000", "GATEWAY_BURST": "100000",
+    "RECIPIENT_RATE_PER_SEC": "100000", "RECIPIENT_BURST": "100000",
+    "RETRY_BASE_SECONDS": "0.1", "RETRY_MAX_SECONDS": "1",
+}
+
+@pytest.fixture(autouse=True)
+def load_test_limits(monkeypatch):
+    for name, value in LOAD_TEST_LIMITS.items():
+        monkeypatch.setenv(name, value)
+
+def load_test_args(**overrides) -> argparse.Namespace:
+    args = dict(count=60, recipients=20, images=0.0, latency_ms=1.0, error_rate=0.0, gateways=2,
+                kill_gateway_after=None, mongomock=True, db="scheduler_load_test", timeout=30.0,
+                min_throughput=None, max_p95_lag_ms=None, max_failed=0)
+    args.update(overrides)
+    return argparse.Namespace(**args)
+
+async def test_load_test_sends_everything_through_the_fake_gateways():
+    from bench import load_test
+
+    args = load_test_args()
+    result = await load_test.run(args)
+
+    assert result["completed"]
+    assert result["sent"] == args.count
+    assert sum(node["sent"] for node in result["gateway_nodes"]) == args.count
+    assert load_test.check_thresholds(result, args) == []
+
+def test_thresholds_report_each_breach():
+    from bench.load_test import check_thresholds
+
+    result = {"completed": False, "throughput_per_s": 50.0, "lag_p95_ms": 900.0, "failed": 3}
+    breaches = check_thresholds(result, load_test_args(min_throughput=100, max_p95_lag_ms=500, max_failed=0))
+    assert len(breaches) == 4
@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from pagination import InvalidCursor, decode_cursor, encode_cursor
+from tests.fakes import schedule_doc
+
+pytestmark = pytest.mark.anyio
+
+T0 = datetime(2030, 1, 1, tzinfo=timezone.utc)
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor(T0, "s1")) == (T0, "s1")
+    assert decode_cursor(encode_cursor(None, "s1")) == (None, "s1")
+
+def test_garbage_cursor_is_rejected():
+    with pytest.raises(InvalidCursor):
+        decode_cursor("not-a-cursor")
+
+async def pages(api, path: str, limit: int) -> list:
+    """Every page of a list endpoint, following X-Next-Cursor"""
+    result, params = [], {"limit": limit}
+    while True:
+        response = await api.get(path, params=params)
+        assert response.status_code == 200, response.text
+        result.append([row["id"] for row in response.json()])
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            return result
+        params = {"limit": limit, "cursor": cursor}
+
+async def test_history_pages_cover_every_row_once(api, db):
+    # Ties on sent_at are broken by id; rows without sent_at come last
+    rows = [
+        schedule_doc("a", status="sent", sent_at=T0),
+        schedule_doc("b", status="sent", sent_at=T0),
+        schedule_doc("c", status="sent", sent_at=T0 + timedelta(minutes=1)),
+        schedule_doc("d", status="failed", sent_at=T0 - timedelta(minutes=1)),
+        schedule_doc("e", status="failed", sent_at=None),
+        schedule_doc("f", status="canceled", sent_at=None),
+        schedule_doc("g", status="scheduled"),
+    ]
+    await db.schedules.insert_many(rows)
+
+    assert await pages(api, "/api/history", limit=2) == [["c", "b"], ["a", "d"], ["f", "e"], []]
+
+async def test_schedule_pages_follow_send_at(api, db):
+    await db.schedules.insert_many([
+        schedule_doc(f"s{i}", send_at=T0 + timedelta(minutes=i)) for i in range(5)
+    ])
+    assert await pages(api, "/api/schedules", limit=2) == [["s4", "s3"], ["s2", "s1"], ["s0"]]
+
+async def test_bad_cursor_is_a_400(api):
+    response = await api.get("/api/schedules", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
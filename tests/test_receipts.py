@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from receipts import ReceiptBuffer, parse_receipts
+from tests.fakes import schedule_doc
+
+pytestmark = pytest.mark.anyio
+
+T0 = datetime(2030, 1, 1, 12, 0, tzinfo=timezone.utc)
+
+def ack(message_id: str, receipt_type: str, at: datetime) -> dict:
+    return {"event": "message.ack", "payload": {"ids": [message_id], "receipt_type": receipt_type},
+            "timestamp": at.isoformat()}
+
+def as_utc(value: datetime) -> datetime:
+    return value.replace(tzinfo=timezone.utc)
+
+async def test_repeated_receipts_are_applied_once(db):
+    await db.schedules.insert_one(schedule_doc("s1", status="sent", gateway_message_id="M1"))
+    receipts = ReceiptBuffer(db)
+
+    assert receipts.add(parse_receipts(ack("M1", "delivered", T0))) == 1
+    assert receipts.add(parse_receipts([ack("M1", "delivered", T0)] * 3)) == 0
+    await receipts.flush()
+
+    assert receipts.stats()["duplicates"] == 3
+    assert receipts.stats()["applied"] == 1
+    stored = await db.schedules.find_one({"id": "s1"})
+    assert stored["delivery_status"] == "delivered"
+    assert as_utc(stored["delivered_at"]) == T0
+
+async def test_late_delivered_does_not_move_read_back(db):
+    await db.schedules.insert_one(schedule_doc("s1", status="sent", gateway_message_id="M1"))
+    receipts = ReceiptBuffer(db)
+
+    receipts.add(parse_receipts(ack("M1", "read", T0 + timedelta(seconds=5))))
+    await receipts.flush()
+    # The delivered callback arrives after the read one, in a later flush
+    receipts.add(parse_receipts(ack("M1", "delivered", T0)))
+    await receipts.flush()
+
+    stored = await db.schedules.find_one({"id": "s1"})
+    assert stored["delivery_status"] == "read"
+    assert as_utc(stored["read_at"]) == T0 + timedelta(seconds=5)
+    # $min keeps the earliest delivery time
+    assert as_utc(stored["delivered_at"]) == T0
+
+async def test_unmatched_receipt_waits_for_the_status_write(db):
+    receipts = ReceiptBuffer(db)
+    receipts.add(parse_receipts(ack("M1", "delivered", T0)))
+    await receipts.flush()
+    assert receipts.stats()["buffered"] == 1
+
+    await db.schedules.insert_one(schedule_doc("s1", status="sent", gateway_message_id="M1"))
+    await receipts.flush()
+    assert receipts.stats()["buffered"] == 0
+    assert (await db.schedules.find_one({"id": "s1"}))["delivery_status"] == "delivered"
+
+async def test_dropped_receipt_is_accepted_again(db):
+    receipts = ReceiptBuffer(db)
+    receipts.max_age = 0
+
+    receipts.add(parse_receipts(ack("M1", "delivered", T0)))
+    await receipts.flush()
+    assert receipts.stats()["dropped_unmatched"] == 1
+
+    # The gateway redelivers once the row exists; it must not count as a repeat
+    await db.schedules.insert_one(schedule_doc("s1", status="sent", gateway_message_id="M1"))
+    assert receipts.add(parse_receipts(ack("M1", "delivered", T0))) == 1
+    await receipts.flush()
+    assert (await db.schedules.find_one({"id": "s1"}))["delivery_status"] == "delivered"
@@ -0,0 +1,117 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from pymongo.errors import OperationFailure
+
+from background_worker import BackgroundWorker
+from status_writer import StatusWriter
+from tests.fakes import FakeGateway, schedule_doc
+
+pytestmark = pytest.mark.anyio
+
+async def test_buffered_write_settles_after_flush(db):
+    await db.schedules.insert_one(schedule_doc("s1"))
+    writer = StatusWriter(db.schedules, flush_size=10, flush_seconds=60)
+    writer.start()
+    ran = []
+
+    settled = await writer.write({"id": "s1"}, {"$set": {"status": "sent"}}, lambda: ran.append(True))
+    assert not settled.done()
+    assert (await db.schedules.find_one({"id": "s1"}))["status"] == "scheduled"
+
+    await writer.close()
+    assert settled.result() is True
+    assert ran == [True]
+    assert (await db.schedules.find_one({"id": "s1"}))["status"] == "sent"
+
+async def test_lease_is_held_until_final_write_lands(db):
+    await db.schedules.insert_one(schedule_doc("s1"))
+    worker = BackgroundWorker(db, gateway_client=FakeGateway())
+    worker.status_writer = StatusWriter(db.schedules, flush_size=10, flush_seconds=60)
+    worker.status_writer.start()
+
+    await worker._send_schedule({"id": "s1"})
+
+    # Sent, but the write is still buffered: the row is ours and the heartbeat runs
+    assert len(worker._lease_holders) == 1
+    stored = await db.schedules.find_one({"id": "s1"})
+    assert stored["status"] == "sending"
+    assert stored["lease_expires_at"] is not None
+
+    await worker.status_writer.close()
+    await asyncio.gather(*worker._lease_holders)
+    assert not worker._lease_holders
+    stored = await db.schedules.find_one({"id": "s1"})
+    assert stored["status"] == "sent"
+    assert "lease_expires_at" not in stored
+
+async def test_write_from_an_expired_claim_does_not_land(db):
+    await db.schedules.insert_one(schedule_doc("s1"))
+    worker = BackgroundWorker(db)
+    stale = await worker._claim("s1")
+
+    # The lease runs out and the same worker claims the row again
+    past = datetime.now(timezone.utc) - timedelta(seconds=1)
+    await db.schedules.update_one({"id": "s1"}, {"$set": {"lease_expires_at": past}})
+    current = await worker._claim("s1")
+    assert current["attempts"] == stale["attempts"] + 1
+
+    await worker.status_writer.write(worker._owned(stale), {"$set": {"status": "failed"}})
+    assert (await db.schedules.find_one({"id": "s1"}))["status"] == "sending"
+
+    await worker.status_writer.write(worker._owned(current), {"$set": {"status": "sent"}})
+    assert (await db.schedules.find_one({"id": "s1"}))["status"] == "sent"
+
+class RejectingCollection:
+    """Fails every bulk write, and any single update that sets one of the rejected fields"""
+
+    def __init__(self, collection, rejected=()):
+        self.collection = collection
+        self.rejected = set(rejected)
+
+    async def bulk_write(self, ops, ordered=True):
+        raise OperationFailure("batch rejected")
+
+    async def update_one(self, filter, update):
+        if self.rejected & set(update.get("$set", {})):
+            raise OperationFailure("document rejected")
+        return await self.collection.update_one(filter, update)
+
+async def test_failed_batch_is_written_one_by_one(db):
+    await db.schedules.insert_one(schedule_doc("s1"))
+    writer = StatusWriter(RejectingCollection(db.schedules), flush_size=10, flush_seconds=60)
+    writer.start()
+    ran = []
+
+    settled = await writer.write({"id": "s1"}, {"$set": {"status": "sent"}}, lambda: ran.append(True))
+    await writer.close()
+
+    assert settled.result() is True
+    assert ran == [True]
+    assert (await db.schedules.find_one({"id": "s1"}))["status"] == "sent"
+
+async def test_unwritable_final_write_falls_back_to_the_status(db):
+    await db.schedules.insert_one(schedule_doc("s1"))
+    gateway = FakeGateway()
+    worker = BackgroundWorker(db, gateway_client=gateway)
+    worker.status_writer = StatusWriter(RejectingCollection(db.schedules, {"gateway_response"}),
+                                        flush_size=10, flush_seconds=60)
+    worker.status_writer.start()
+    events = []
+    worker.add_listener(events.append)
+
+    await worker._send_schedule({"id": "s1"})
+    await worker.status_writer.close()
+    await asyncio.gather(*worker._lease_holders)
+
+    stored = await db.schedules.find_one({"id": "s1"})
+    assert stored["status"] == "sent"
+    assert stored["gateway_message_id"] == "MSG1"
+    assert "gateway_response" not in stored
+    assert [e["status"] for e in events] == ["sending", "sent"]
+
+    # Even once the lease would have run out, the delivered message is not sent again
+    await db.schedules.update_one({"id": "s1"}, {"$set": {"lease_expires_at": datetime.now(timezone.utc) - timedelta(seconds=1)}})
+    assert await worker._claim("s1") is None
+    assert gateway.sent == ["628123456789"]
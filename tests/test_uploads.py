@@ -0,0 +1,105 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 200
+BOUNDARY = "testboundary"
+
+def multipart(data: bytes, name: str = "photo.png") -> bytes:
+    return (
+        f"--{BOUNDARY}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="{name}"\r\n'
+        "Content-Type: image/png\r\n\r\n"
+    ).encode() + data + f"\r\n--{BOUNDARY}--\r\n".encode()
+
+async def chunked(body: bytes, size: int = 64):
+    for start in range(0, len(body), size):
+        yield body[start:start + size]
+
+MULTIPART_HEADERS = {"content-type": f"multipart/form-data; boundary={BOUNDARY}"}
+
+async def test_multipart_upload_is_stored_once(api, db):
+    first = await api.post("/api/uploads/image", content=multipart(PNG), headers=MULTIPART_HEADERS)
+    assert first.status_code == 200
+    body = first.json()
+    assert body["size"] == len(PNG)
+    assert body["filename"].endswith("_photo.png")
+
+    again = await api.post("/api/uploads/image", content=multipart(PNG), headers=MULTIPART_HEADERS)
+    assert again.json()["image_id"] == body["image_id"]
+    stored = await db.images.find_one({"_id": body["image_id"]})
+    assert bytes(stored["data"]) == PNG
+    assert stored["content_type"] == "image/png"
+    assert await db.images.count_documents({}) == 1
+
+async def test_raw_upload(api):
+    response = await api.post("/api/uploads/image", content=PNG, headers={"x-filename": "raw.png"})
+    assert response.status_code == 200
+    assert response.json()["size"] == len(PNG)
+
+async def test_invalid_content_length_is_rejected(api):
+    response = await api.post("/api/uploads/image", content=PNG, headers={"content-length": "lots"})
+    assert response.status_code == 400
+
+async def test_declared_oversize_is_rejected(api, monkeypatch):
+    monkeypatch.setattr(server, "MAX_IMAGE_BYTES", 100)
+    monkeypatch.setattr(server, "MULTIPART_OVERHEAD_BYTES", 50)
+    response = await api.post("/api/uploads/image", content=multipart(PNG), headers=MULTIPART_HEADERS)
+    assert response.status_code == 413
+
+async def test_chunked_multipart_is_capped_while_streaming(api, monkeypatch):
+    monkeypatch.setattr(server, "MAX_IMAGE_BYTES", 100)
+    monkeypatch.setattr(server, "MULTIPART_OVERHEAD_BYTES", 50)
+    # No Content-Length: only the stream cap can stop it
+    response = await api.post("/api/uploads/image", content=chunked(multipart(b"\x00" * 10_000)),
+                              headers=MULTIPART_HEADERS)
+    assert response.status_code == 413
+
+async def test_chunked_raw_upload_is_capped(api, monkeypatch):
+    monkeypatch.setattr(server, "MAX_IMAGE_BYTES", 100)
+    response = await api.post("/api/uploads/image", content=chunked(PNG))
+    assert response.status_code == 413
+
+async def test_empty_upload_is_rejected(api):
+    response = await api.post("/api/uploads/image", content=multipart(b""), headers=MULTIPART_HEADERS)
+    assert response.status_code == 400
+
+def future() -> str:
+    return (datetime.now(timezone.utc) + timedelta(days=1)).isoformat()
+
+@pytest.mark.parametrize("path, extra", [
+    ("/api/schedules", {}),
+    ("/api/campaigns", {"recipients": [{"phone": "628111"}]}),
+    ("/api/recurrences", {}),
+])
+async def test_unknown_image_id_is_rejected(api, db, path, extra):
+    response = await api.post(path, json={"message_html": "<p>hi</p>", "send_at": future(),
+                                          "image_id": "missing", **extra})
+    assert response.status_code == 422
+    assert "missing" in response.json()["detail"]
+    assert await db.schedules.count_documents({}) == 0
+    assert await db.campaigns.count_documents({}) == 0
+    assert await db.recurrences.count_documents({}) == 0
+
+async def test_known_image_id_is_accepted_and_checked_on_update(api):
+    image_id = (await api.post("/api/uploads/image", content=PNG, headers={"x-filename": "raw.png"})).json()["image_id"]
+    created = await api.post("/api/schedules", json={"message_html": "<p>hi</p>", "send_at": future(), "image_id": image_id})
+    assert created.status_code == 200
+    assert created.json()["image_id"] == image_id
+
+    updated = await api.put(f"/api/schedules/{created.json()['id']}", json={"image_id": "missing"})
+    assert updated.status_code == 422
+    assert (await api.get(f"/api/schedules/{created.json()['id']}")).json()["image_id"] == image_id
+
+async def test_bulk_reports_unknown_image_id_per_item(api):
+    response = await api.post("/api/schedules/bulk", json={"schedules": [
+        {"message_html": "<p>a</p>", "send_at": future()},
+        {"message_html": "<p>b</p>", "send_at": future(), "image_id": "missing"},
+    ]})
+    assert response.status_code == 200
+    assert len(response.json()["schedules"]) == 1
+    assert response.json()["errors"][0]["index"] == 1